@@ -124,20 +124,6 @@ def create_dot_plot(sizes: list, times_androguard: list, times_kunai: list, time
     return size_time_fig, size_memory_fig
 
 
-def flip_index(l: list, i: int, j: int) -> list:
-    '''
-    Simply flip two index from a list.
-
-    :param l: list where to flip the data.
-    :param i: first index.
-    :param j: second index.
-    '''
-    temp = l[i]
-    l[i] = l[j]
-    l[j] = temp
-    return l
-
-
 def create_plot_line(sizes: list, times_androguard: list, times_kunai: list, times_kunai_recursive: list, memory_androguard: list, memory_kunai: list, memory_kunai_recursive: list) -> tuple:
     '''
     Create a plot with a line that represents how it
@@ -282,167 +268,88 @@ class InterestingDexFile(object):
             self.memory_kunai_recursive
         )
 
+def interesting_dex_file(values: dict) -> InterestingDexFile:
+    '''
+    Create an InterestingDexFile from one of the extremes
+    of DatabaseConnector.get_malware_benchmark_summary.
+    '''
+    dex_file = InterestingDexFile()
+
+    if values is None:
+        return dex_file
+
+    dex_file.size = values['size']
+    dex_file.md5 = values['md5']
+    dex_file.file = values['file']
+    dex_file.time_androguard = values['time_androguard']
+    dex_file.time_kunai = values['time_kunai']
+    dex_file.time_kunai_recursive = values['time_kunai_recursive']
+    dex_file.memory_androguard = values['memory_androguard']
+    dex_file.memory_kunai = values['memory_kunai']
+    dex_file.memory_kunai_recursive = values['memory_kunai_recursive']
+
+    return dex_file
+
 
 databaseconnector = DatabaseConnector()
 
 databaseconnector.config()
 
-total_apks = databaseconnector.get_number_of_values_by_query_malware(
-    {"analysis": {'$exists': True}})
+# counters and extremes computed by the database, the
+# anomaly of 17108 bytes is left out of the extremes
+summary = databaseconnector.get_malware_benchmark_summary(ignored_size=17108)
+
+biggest_file = interesting_dex_file(summary.get('biggest_file'))
+smallest_file = interesting_dex_file(summary.get('smallest_file'))
+
+# one row per sample, DEX file and tool, flattened by the database,
+# the analysis of the APK is only in the counters
+rows = databaseconnector.retrieve_benchmark_dataframe(malware=True)
+rows = rows[~rows['file'].str.contains('_apk')]
+
+# one row per DEX file, columns (metric, tool)
+dex_files = rows.pivot(index=['md5', 'file'], columns='tool',
+                       values=['file_size', 'analysis_time', 'memory', 'exit_code'])
+
+exit_codes = dex_files['exit_code'].fillna(-1)
+correctly_analyzed = (exit_codes['Androguard'] == 0) & \
+    (exit_codes['Kunai-Linear'] == 0) & (exit_codes['Kunai-Recursive'] == 0)
 
-correct_analysis_of_apks_androguard = 0
-correct_analysis_of_apks_kunai = 0
+for (md5, file), row in exit_codes[~correctly_analyzed].iterrows():
+    print(
+        f"Not correctly analyzed DEX file: pkg_name={md5}, dex file={file}, androguard={row['Androguard']}, Kunai={row['Kunai-Linear']}, Kunai Recursive={row['Kunai-Recursive']}")
 
-correct_analysis_dex_androguard = 0
-correct_analysis_dex_kunai = 0
-correct_analysis_dex_kunai_recursive = 0
+analyzed_dex_files = dex_files[correctly_analyzed]
 
-total_dex_files = 0
-correctly_analyzed_dex_files = 0
-sizes = list()
-md5s = list()
+anomalies = analyzed_dex_files[analyzed_dex_files[('file_size', 'Androguard')] == 17108]
+for _, row in anomalies.iterrows():
+    print("Detected anomaly with 1708 bytes file, avoiding it")
+    print(
+        f"Time Androguard: {row[('analysis_time', 'Androguard')]}, Time Kunai Linear: {row[('analysis_time', 'Kunai-Linear')]}, Time Kunai Recursive: {row[('analysis_time', 'Kunai-Recursive')]}")
+    print(
+        f"Memory Androguard: {row[('memory', 'Androguard')]}, memory Kunai Linear: {row[('memory', 'Kunai-Linear')]}, memory Kunai Recursive: {row[('memory', 'Kunai-Recursive')]}")
+
+analyzed_dex_files = analyzed_dex_files[analyzed_dex_files[('file_size', 'Androguard')] != 17108]
+analyzed_dex_files = analyzed_dex_files.sort_values(('file_size', 'Androguard'), kind='stable')
+
+md5s = analyzed_dex_files.index.get_level_values('md5').tolist()
+sizes = analyzed_dex_files[('file_size', 'Androguard')].tolist()
 # comparison size_time androguard (use a list to keep repetitions)
-size_time_androguard = list()
+size_time_androguard = analyzed_dex_files[('analysis_time', 'Androguard')].tolist()
 # comparison size_time kunai
-size_time_kunai = list()
+size_time_kunai = analyzed_dex_files[('analysis_time', 'Kunai-Linear')].tolist()
 # comparison size_time kunai recursive
-size_time_kunai_recursive = list()
-
-kunai_faster_androguard = 0
-kunai_slower_androguard = 0
-kunai_same_time_androguard = 0
-kunai_bigger_androguard = 0
-kunai_smaller_androguard = 0
-kunai_same_size_androguard = 0
+size_time_kunai_recursive = analyzed_dex_files[('analysis_time', 'Kunai-Recursive')].tolist()
 
 # comparison size_memory androguard
-size_memory_androguard = list()
+size_memory_androguard = analyzed_dex_files[('memory', 'Androguard')].tolist()
 # comparison size_memory kunai
-size_memory_kunai = list()
+size_memory_kunai = analyzed_dex_files[('memory', 'Kunai-Linear')].tolist()
 # comparison size_memory kunai recursive
-size_memory_kunai_recursive = list()
-
-biggest_file = InterestingDexFile()
-smallest_file = InterestingDexFile()
-
-complete_analysis_cursor = databaseconnector.retrieve_all_documents_from_malware_collection()
-
-for doc in complete_analysis_cursor:
-    if 'benchmark' not in doc['analysis'].keys():
-        continue
-
-    for key in doc['analysis']['benchmark'].keys():
-        # we are analyzing the APK...
-        if '_apk' in key:
-            analysis_apk = doc['analysis']['benchmark'][key]
-
-            if analysis_apk['Androguard']['exit_code'] == 0:
-                correct_analysis_of_apks_androguard += 1
-            if analysis_apk['Kunai']['exit_code'] == 0:
-                correct_analysis_of_apks_kunai += 1
-        else:
-            analysis_dex = doc['analysis']['benchmark'][key]
-
-            total_dex_files += 1
-
-            if analysis_dex['Androguard']['exit_code'] == 0:
-                correct_analysis_dex_androguard += 1
-            if analysis_dex['Kunai-Linear']['exit_code'] == 0:
-                correct_analysis_dex_kunai += 1
-            if analysis_dex['Kunai-Recursive']['exit_code'] == 0:
-                correct_analysis_dex_kunai_recursive += 1
-
-            if analysis_dex['Androguard']['exit_code'] != 0 or \
-                analysis_dex['Kunai-Linear']['exit_code'] != 0 or \
-                    analysis_dex['Kunai-Recursive']['exit_code'] != 0:
-                print(
-                    f"Not correctly analyzed DEX file: pkg_name={doc['md5']}, dex file={key}, androguard={analysis_dex['Androguard']['exit_code']}, Kunai={analysis_dex['Kunai-Linear']['exit_code']}, Kunai Recursive={analysis_dex['Kunai-Recursive']['exit_code']}")
-                continue
-
-            correctly_analyzed_dex_files += 1
-
-            size = analysis_dex['Androguard']['file_size']
-            time_androguard = analysis_dex['Androguard']['analysis_time']
-            memory_androguard = analysis_dex['Androguard']['memory']
-
-            time_kunai_linear = analysis_dex['Kunai-Linear']['analysis_time']
-            memory_kunai_linear = analysis_dex['Kunai-Linear']['memory']
-
-            time_kunai_recursive = analysis_dex['Kunai-Recursive']['analysis_time']
-            memory_kunai_recursive = analysis_dex['Kunai-Recursive']['memory']
-
-
-            if time_androguard < time_kunai_linear and time_androguard < time_kunai_recursive:
-                kunai_slower_androguard += 1
-            elif time_androguard == time_kunai_linear or time_androguard == time_kunai_recursive:
-                kunai_same_time_androguard += 1
-            else:
-                kunai_faster_androguard += 1
-
-            if memory_androguard < memory_kunai_linear and memory_androguard < memory_kunai_recursive:
-                kunai_bigger_androguard += 1
-            elif memory_androguard == memory_kunai_linear or memory_androguard == memory_kunai_recursive:
-                kunai_same_size_androguard += 1
-            else:
-                kunai_smaller_androguard += 1
-
-            if analysis_dex['Androguard']['file_size'] == 17108:
-                print("Detected anomaly with 1708 bytes file, avoiding it")
-                print(
-                    f"Time Androguard: {time_androguard}, Time Kunai Linear: {time_kunai_linear}, Time Kunai Recursive: {time_kunai_recursive}")
-                print(
-                    f"Memory Androguard: {memory_androguard}, memory Kunai Linear: {memory_kunai_linear}, memory Kunai Recursive: {memory_kunai_recursive}")
-                continue
-
-            md5s.append(doc['md5'])
-            sizes.append(size)
-
-            size_time_androguard.append(time_androguard)
-            size_time_kunai.append(time_kunai_linear)
-            size_time_kunai_recursive.append(time_kunai_recursive)
-
-            size_memory_androguard.append(memory_androguard)
-            size_memory_kunai.append(memory_kunai_linear)
-            size_memory_kunai_recursive.append(memory_kunai_recursive)
-
-            if size > biggest_file.size:
-                biggest_file.size = size
-                biggest_file.md5 = doc['md5']
-                biggest_file.file = key
-                biggest_file.time_androguard = time_androguard
-                biggest_file.time_kunai = time_kunai_linear
-                biggest_file.time_kunai_recursive = time_kunai_recursive
-                biggest_file.memory_androguard = memory_androguard
-                biggest_file.memory_kunai = memory_kunai_linear
-                biggest_file.memory_kunai_recursive = memory_kunai_recursive
-
-            if smallest_file.size == 0 or size < smallest_file.size:
-                smallest_file.size = size
-                smallest_file.md5 = doc['md5']
-                smallest_file.file = key
-                smallest_file.time_androguard = time_androguard
-                smallest_file.time_kunai = time_kunai_linear
-                smallest_file.time_kunai_recursive = time_kunai_recursive
-                smallest_file.memory_androguard = memory_androguard
-                smallest_file.memory_kunai = memory_kunai_linear
-                smallest_file.memory_kunai_recursive = memory_kunai_recursive
-
+size_memory_kunai_recursive = analyzed_dex_files[('memory', 'Kunai-Recursive')].tolist()
 
 n_analyzed_files = len(sizes)
 
-for i in range(n_analyzed_files):
-    for j in range(0, n_analyzed_files-i-1):
-        if sizes[j] > sizes[j+1]:
-            sizes = flip_index(sizes, j, j+1)
-            size_time_androguard = flip_index(size_time_androguard, j, j+1)
-            size_time_kunai = flip_index(size_time_kunai, j, j+1)
-            size_time_kunai_recursive = flip_index(
-                size_time_kunai_recursive, j, j+1)
-            size_memory_androguard = flip_index(size_memory_androguard, j, j+1)
-            size_memory_kunai = flip_index(size_memory_kunai, j, j+1)
-            size_memory_kunai_recursive = flip_index(
-                size_memory_kunai_recursive, j, j+1)
-
 with open('analysis_malware.csv', 'w', newline='') as csvfile:
     fieldnames = ['size', 'time_androguard', 'time_kunai', 'time_kunai_recursive', 'memory_androguard', 'memory_kunai', 'memory_kunai_recursive',
                   'time_improve_factor', 'time_improve_factor_recursive', 'memory_improve_factor', 'memory_improve_factor_recursive', 'md5']
@@ -470,29 +377,29 @@ fig_size_time, fig_size_mem = create_dot_plot(
 create_plot_line(
     sizes, size_time_androguard, size_time_kunai, size_time_kunai_recursive, size_memory_androguard, size_memory_kunai, size_memory_kunai_recursive)
 
-print_numbers("totalApksMalware", total_apks)
+print_numbers("totalApksMalware", summary.get('total_apks', 0))
 print_numbers("correctAnalysisApksAndroguardMalware",
-              correct_analysis_of_apks_androguard)
+              summary.get('apks_correctly_analyzed_androguard', 0))
 print_numbers("correctAnalysisApksKunaiMalware",
-              correct_analysis_of_apks_kunai)
+              summary.get('apks_correctly_analyzed_kunai', 0))
 print_numbers("correctAnalysisDexAndroguardMalware",
-              correct_analysis_dex_androguard)
+              summary.get('dex_correctly_analyzed_androguard', 0))
 print_numbers("correctAnalysisDexKunaiLinearMalware",
-              correct_analysis_dex_kunai)
+              summary.get('dex_correctly_analyzed_kunai_linear', 0))
 print_numbers("correctAnalysisDexKunaiRecursiveMalware",
-              correct_analysis_dex_kunai_recursive)
-print_numbers("totalDexFilesMalware", total_dex_files)
-print_numbers("correctlyAnalyzedDexFileMalware", correctly_analyzed_dex_files)
+              summary.get('dex_correctly_analyzed_kunai_recursive', 0))
+print_numbers("totalDexFilesMalware", summary.get('total_dex_files', 0))
+print_numbers("correctlyAnalyzedDexFileMalware", summary.get('correctly_analyzed_dex_files', 0))
 print("biggest file: ", str(biggest_file))
 print("Smallest file: ", str(smallest_file))
 
-print_numbers('kunaiFasterAndroguardMalware', kunai_faster_androguard)
-print_numbers('kunaiSlowerAndroguardMalware', kunai_slower_androguard)
-print_numbers('kunaiSameTimeAndroguardMalware', kunai_same_time_androguard)
+print_numbers('kunaiFasterAndroguardMalware', summary.get('kunai_faster_androguard', 0))
+print_numbers('kunaiSlowerAndroguardMalware', summary.get('kunai_slower_androguard', 0))
+print_numbers('kunaiSameTimeAndroguardMalware', summary.get('kunai_same_time_androguard', 0))
 
-print_numbers('kunaiSmallerAndroguardMalware', kunai_smaller_androguard)
-print_numbers('kunaiBiggerAndroguardMalware', kunai_bigger_androguard)
-print_numbers('kunaiSameSizeAndroguardMalware', kunai_same_size_androguard)
+print_numbers('kunaiSmallerAndroguardMalware', summary.get('kunai_smaller_androguard', 0))
+print_numbers('kunaiBiggerAndroguardMalware', summary.get('kunai_bigger_androguard', 0))
+print_numbers('kunaiSameSizeAndroguardMalware', summary.get('kunai_same_memory_androguard', 0))
 
 if SHOW_PLOT:
     fig_size_time.show()
@@ -231,9 +231,13 @@ db_connector = DatabaseConnector()
 db_connector.config(database='INFORMATION',
                     collection='APKs', malware_collection='MALWARE')
 
-all_googleplay_info = db_connector.retrieve_all_the_documents_from_collection()
+all_googleplay_info = db_connector.retrieve_documents_from_collection(
+    projection={'_id': 0, 'package': 1, 'analysis.benchmark': 1},
+    query={'analysis.benchmark': {'$exists': True}})
 
-all_malware_info = db_connector.retrieve_all_documents_from_malware_collection()
+all_malware_info = db_connector.retrieve_documents_from_malware_collection(
+    projection={'_id': 0, 'md5': 1, 'malware_family': 1, 'analysis.benchmark': 1},
+    query={'analysis.benchmark': {'$exists': True}})
 
 androguard_errors = 0
 kunai_errors = 0
@@ -137,20 +137,6 @@ def create_dot_plot(sizes: list, times_androguard: list, times_kunai: list, memo
     return size_time_fig, size_memory_fig
 
 
-def flip_index(l: list, i: int, j: int) -> list:
-    '''
-    Simply flip two index from a list.
-
-    :param l: list where to flip the data.
-    :param i: first index.
-    :param j: second index.
-    '''
-    temp = l[i]
-    l[i] = l[j]
-    l[j] = temp
-    return l
-
-
 def create_plot_line(sizes: list, times_androguard: list, times_kunai: list, memory_androguard: list, memory_kunai: list) -> tuple:
     '''
     Create a plot with a line that represents how it
@@ -267,6 +253,26 @@ class InterestingDexFile(object):
             self.memory_kunai
         )
 
+def interesting_dex_file(values: dict) -> InterestingDexFile:
+    '''
+    Create an InterestingDexFile from one of the extremes
+    of DatabaseConnector.get_benchmark_summary.
+    '''
+    dex_file = InterestingDexFile()
+
+    if values is None:
+        return dex_file
+
+    dex_file.size = values['size']
+    dex_file.package = values['package']
+    dex_file.file = values['file']
+    dex_file.time_androguard = values['time_androguard']
+    dex_file.time_kunai = values['time_kunai']
+    dex_file.memory_androguard = values['memory_androguard']
+    dex_file.memory_kunai = values['memory_kunai']
+
+    return dex_file
+
 # Main code goes here
 
 SHOW_PLOT = False
@@ -285,144 +291,43 @@ databaseconnector.config()
 ##########################################################################################
 # get results in here!!!
 
-total_apks = databaseconnector.get_number_of_values_by_query(
-    {"analysis": {'$exists': True}})
-
-total_apks_downloaded = databaseconnector.get_number_of_values_by_query({
-    'analysis.path_apk': {
-        '$ne': None
-    }
-})
-
-total_apks_analyzed = databaseconnector.get_number_of_values_by_query({
-    'analysis.benchmark': {
-        '$exists': True
-    }
-})
-
-analysis_of_apks_androguard = databaseconnector.get_number_of_values_by_query({
-    'analysis.benchmark.base_apk.Androguard.exit_code': {
-        '$eq': 0
-    }
-})
-
-analysis_of_apks_kunai = databaseconnector.get_number_of_values_by_query({
-    'analysis.benchmark.base_apk.Kunai.exit_code': {
-        '$eq': 0
-    }
-})
-
-complete_analysis_cursor = databaseconnector.retrieve_all_the_documents_from_collection()
-
-# total dex files
-total_dex_files = 0
-# correctly analyzed dex by both tools
-correctly_analyzed_dex_files = 0
-packages = list()
-sizes = list()
-# comparison size_time androguard (use a list to keep repetitions)
-size_time_androguard = list()
-# comparison size_time kunai
-size_time_kunai = list()
+# counters and extremes computed by the database
+summary = databaseconnector.get_benchmark_summary()
 
-# comparison size_memory androguard
-size_memory_androguard = list()
-# comparison size_memory kunai
-size_memory_kunai = list()
+biggest_file = interesting_dex_file(summary.get('biggest_file'))
+smallest_file = interesting_dex_file(summary.get('smallest_file'))
 
-biggest_file = InterestingDexFile()
-smallest_file = InterestingDexFile()
+# one row per package, DEX file and tool, flattened by the database
+rows = databaseconnector.retrieve_benchmark_dataframe()
+rows = rows[rows['file'] != 'base_apk']
 
+# one row per DEX file, columns (metric, tool)
+dex_files = rows.pivot(index=['package', 'file'], columns='tool',
+                       values=['file_size', 'analysis_time', 'memory', 'exit_code'])
 
-kunai_faster_androguard = 0
-kunai_slower_androguard = 0
-kunai_same_time_androguard = 0
-kunai_bigger_androguard = 0
-kunai_smaller_androguard = 0
-kunai_same_memory_androguard = 0
+exit_codes = dex_files['exit_code'].fillna(-1)
+# fair comparison must be both analysis are okay
+correctly_analyzed = (exit_codes['Androguard'] == 0) & (exit_codes['Kunai'] == 0)
 
+for (package, file), row in exit_codes[~correctly_analyzed].iterrows():
+    print(
+        f"Not correctly analyzed DEX file: pkg_name={package}, dex file={file}, androguard={row['Androguard']}, Kunai={row['Kunai']}")
 
-for doc in complete_analysis_cursor:
-    
-    if 'benchmark' not in doc['analysis'].keys():
-        continue
-
-    for key in doc['analysis']['benchmark'].keys():
-        if key == 'base_apk':
-            continue
-
-        analysis_androguard_kunai = doc['analysis']['benchmark'][key]
-        total_dex_files += 1
-        # fair comparison must be both analysis are okay
-        if analysis_androguard_kunai['Androguard']['exit_code'] != 0 or \
-                analysis_androguard_kunai['Kunai']['exit_code'] != 0:
-            print(
-                f"Not correctly analyzed DEX file: pkg_name={doc['package']}, dex file={key}, androguard={analysis_androguard_kunai['Androguard']['exit_code']}, Kunai={analysis_androguard_kunai['Kunai']['exit_code']}")
-            continue
-
-        correctly_analyzed_dex_files += 1
-        
-        size = analysis_androguard_kunai['Androguard']['file_size']
-        time_androguard = analysis_androguard_kunai['Androguard']['analysis_time']
-        memory_androguard = analysis_androguard_kunai['Androguard']['memory']
-
-        time_kunai = analysis_androguard_kunai['Kunai']['analysis_time']
-        memory_kunai = analysis_androguard_kunai['Kunai']['memory']
-
-        packages.append(doc['package'])
-        sizes.append(size)
-
-        size_time_androguard.append(time_androguard)
-        size_time_kunai.append(time_kunai)
-
-        if time_kunai > time_androguard:
-            kunai_slower_androguard += 1
-        elif time_kunai < time_androguard:
-            kunai_faster_androguard += 1
-        else:
-            kunai_same_time_androguard += 1
-
-
-        size_memory_androguard.append(memory_androguard)
-        size_memory_kunai.append(memory_kunai)
-
-        if memory_kunai < memory_androguard:
-            kunai_smaller_androguard += 1
-        elif memory_kunai > memory_androguard:
-            kunai_bigger_androguard += 1
-        else:
-            kunai_same_memory_androguard += 1
-
-        if size > biggest_file.size:
-            biggest_file.size = size
-            biggest_file.package = doc['package']
-            biggest_file.file = key
-            biggest_file.time_androguard = time_androguard
-            biggest_file.time_kunai = time_kunai
-            biggest_file.memory_androguard = memory_androguard
-            biggest_file.memory_kunai = memory_kunai
-
-        if smallest_file.size == 0 or size < smallest_file.size:
-            smallest_file.size = size
-            smallest_file.package = doc['package']
-            smallest_file.file = key
-            smallest_file.time_androguard = time_androguard
-            smallest_file.time_kunai = time_kunai
-            smallest_file.memory_androguard = memory_androguard
-            smallest_file.memory_kunai = memory_kunai
+analyzed_dex_files = dex_files[correctly_analyzed].sort_values(('file_size', 'Androguard'), kind='stable')
 
+packages = analyzed_dex_files.index.get_level_values('package').tolist()
+sizes = analyzed_dex_files[('file_size', 'Androguard')].tolist()
+# comparison size_time androguard (use a list to keep repetitions)
+size_time_androguard = analyzed_dex_files[('analysis_time', 'Androguard')].tolist()
+# comparison size_time kunai
+size_time_kunai = analyzed_dex_files[('analysis_time', 'Kunai')].tolist()
 
-n_analyzed_files = len(sizes)
+# comparison size_memory androguard
+size_memory_androguard = analyzed_dex_files[('memory', 'Androguard')].tolist()
+# comparison size_memory kunai
+size_memory_kunai = analyzed_dex_files[('memory', 'Kunai')].tolist()
 
-for i in range(n_analyzed_files):
-    for j in range(0, n_analyzed_files-i-1):
-        if sizes[j] > sizes[j+1]:
-            sizes = flip_index(sizes, j, j+1)
-            packages = flip_index(packages, j, j+1)
-            size_time_androguard = flip_index(size_time_androguard, j, j+1)
-            size_time_kunai = flip_index(size_time_kunai, j, j+1)
-            size_memory_androguard = flip_index(size_memory_androguard, j, j+1)
-            size_memory_kunai = flip_index(size_memory_kunai, j, j+1)
+n_analyzed_files = len(sizes)
 
 with open('analysis_googleplay.csv', 'w', newline='') as csvfile:
     fieldnames = ['size', 'time_androguard', 'time_kunai', 'memory_androguard', 'memory_kunai', 'time_improve_factor', 'memory_improve_factor', 'package']
@@ -441,14 +346,14 @@ create_plot_line(
 ##########################################################################################
 # Print results in here!
 
-print_numbers('totalApks', total_apks)
-print_numbers('totalApksDownloaded', total_apks_downloaded)
-print_numbers('totalApksAnalyzed', total_apks_analyzed)
+print_numbers('totalApks', summary.get('total_apks', 0))
+print_numbers('totalApksDownloaded', summary.get('total_apks_downloaded', 0))
+print_numbers('totalApksAnalyzed', summary.get('total_apks_analyzed', 0))
 print_numbers('totalApksCorrectlyAnalyzedAndroguard',
-              analysis_of_apks_androguard)
-print_numbers('totalApksCorrectlyAnalyzedKunai', analysis_of_apks_kunai)
-print_numbers('totalDexFiles', total_dex_files)
-print_numbers('totalDexFilesCorrectlyAnalyzed', correctly_analyzed_dex_files)
+              summary.get('apks_correctly_analyzed_androguard', 0))
+print_numbers('totalApksCorrectlyAnalyzedKunai', summary.get('apks_correctly_analyzed_kunai', 0))
+print_numbers('totalDexFiles', summary.get('total_dex_files', 0))
+print_numbers('totalDexFilesCorrectlyAnalyzed', summary.get('correctly_analyzed_dex_files', 0))
 
 print_numbers('androguardMedianSizeTime', statistics.median(size_time_androguard))
 print_numbers('kunaiMedianSizeTime', statistics.median(size_time_kunai))
@@ -456,13 +361,13 @@ print_numbers('kunaiMedianSizeTime', statistics.median(size_time_kunai))
 print_numbers('androguardMedianSizeMemory', statistics.median(size_memory_androguard))
 print_numbers('kunaiMedianSizeMemory', statistics.median(size_memory_kunai))
 
-print_numbers('kunaiFasterAndroguard', kunai_faster_androguard)
-print_numbers('kunaiSlowerAndroguard', kunai_slower_androguard)
-print_numbers('kunaiSameTimeAndroguard', kunai_same_time_androguard)
+print_numbers('kunaiFasterAndroguard', summary.get('kunai_faster_androguard', 0))
+print_numbers('kunaiSlowerAndroguard', summary.get('kunai_slower_androguard', 0))
+print_numbers('kunaiSameTimeAndroguard', summary.get('kunai_same_time_androguard', 0))
 
-print_numbers('kunaiSmallerAndroguard', kunai_smaller_androguard)
-print_numbers('kunaiBiggerAndroguard', kunai_bigger_androguard)
-print_numbers('kunaiSameSizeAndroguard', kunai_same_memory_androguard)
+print_numbers('kunaiSmallerAndroguard', summary.get('kunai_smaller_androguard', 0))
+print_numbers('kunaiBiggerAndroguard', summary.get('kunai_bigger_androguard', 0))
+print_numbers('kunaiSameSizeAndroguard', summary.get('kunai_same_memory_androguard', 0))
 
 
 print("Biggest DEX file: %s" % (str(biggest_file)))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+
+'''
+Parser of the results from kunai-benchmark-results, shared
+by get_analysis_information.py and the benchmark worker of
+the crawler, importing it has no side effects.
+
+Each line of the results of a package is:
+
+    tool;file;[analysis_time:<f>;]cmd:<command> <path>;real:<f>:user:<f>;sys:<f>;memory:<d>;cpu:<d>%;exit-code:<d>
+
+and each line of file_sizes.csv is path:size.
+'''
+
+from os.path import basename
+from scanf import scanf
+
+def retrieve_variables_from_line(line: str) -> tuple:
+    '''
+    Use scanf function in order to retrieve the different variables
+    from the line of the CSV scanned.
+
+    :param line: line to analyze with scanf and extract data.
+    :return: tuple with variables of different data types
+    '''
+    return scanf("%s;%s;cmd:%s %s;real:%f:user:%f;sys:%f;memory:%d;cpu:%d%;exit-code:%d", line)
+
+def retrieve_variables_from_line_with_analysis_time(line: str) -> tuple:
+    '''
+    Use scanf function in order to retrieve the different variables
+    from the line of the CSV scanned.
+
+    :param line: line to analyze with scanf and extract data.
+    :return: tuple with variables of different data types
+    '''
+    return scanf("%s;%s;analysis_time:%f;cmd:%s %s;real:%f:user:%f;sys:%f;memory:%d;cpu:%d%;exit-code:%d", line)
+
+def parse_line(line: str) -> tuple:
+    '''
+    Retrieve the variables of one line of the results, the
+    lines without analysis_time get an analysis_time of 0.0
+
+    :param line: line to analyze with scanf and extract data.
+    :return: tuple (tool, file, analysis_time, analysis_command, path_command,
+             real_time, user_time, sys_time, memory, cpu, exit_code), None
+             if the line does not have the format.
+    '''
+    if 'analysis_time:' in line:
+        return retrieve_variables_from_line_with_analysis_time(line)
+
+    variables = retrieve_variables_from_line(line)
+    if variables is None:
+        return None
+
+    (tool, file, analysis_command, path_command, real_time, user_time, sys_time, memory, cpu, exit_code) = variables
+    return (tool, file, 0.0, analysis_command, path_command, real_time, user_time, sys_time, memory, cpu, exit_code)
+
+def extract_variables_analysis_line(lines: list, sizes: dict) -> dict:
+    '''
+    Extract all the variables from a list of string lines
+    with the information from the analysis, create a dictionary
+    with the results from the analysis, and finish it.
+
+    :param lines: lines of the results of one package.
+    :param sizes: path -> size of the analyzed files, from file_sizes.csv.
+    '''
+    results = {'benchmark':dict()}
+
+    tool = None
+    file = None
+    analysis_time = 0.0
+    analysis_command = None
+    path_command = None
+    real_time = 0.0
+    user_time = 0.0
+    sys_time = 0.0
+    memory = 0
+    cpu = 0
+    exit_code = 0
+
+    for line in lines:
+        line = line.strip()
+        if line == '':
+            continue
+
+        variables = parse_line(line)
+        if variables is None:
+            print(f"Ignoring line: {line}")
+            continue
+
+        (tool, file, analysis_time, analysis_command, path_command, real_time, user_time, sys_time, memory, cpu, exit_code) = variables
+
+        analyzed_file_name = basename(file).replace(".","_")
+
+        if analyzed_file_name not in results['benchmark']:
+            results['benchmark'][analyzed_file_name] = dict()
+
+        if tool not in results['benchmark'][analyzed_file_name].keys():
+            results['benchmark'][analyzed_file_name][tool] = {
+                'analysis_time':analysis_time,
+                'real_time':real_time,
+                'user_time':user_time,
+                'sys_time':sys_time,
+                'memory':memory,
+                'exit_code':exit_code,
+                'file_size':sizes.get(path_command)
+            }
+
+    return results
+
+def read_all_paths_and_sizes(lines: str, sizes: dict = None) -> dict:
+    '''
+    Read the lines of file_sizes.csv (path:size).
+
+    :param sizes: dictionary where the sizes are saved, a new one if None.
+    :return: dictionary path -> size.
+    '''
+    if sizes is None:
+        sizes = dict()
+
+    path = ""
+    size = 0
+    for line in lines:
+        line = line.strip()
+        variables = scanf("%s:%d", line)
+        if variables is None:
+            continue
+        (path, size) = variables
+        sizes[path] = size
+
+    return sizes
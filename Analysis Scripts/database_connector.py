@@ -7,7 +7,10 @@ inserting data, retrieve data, and other
 kind of operations.
 '''
 
+import sys
+import time
 import pymongo
+import pymongo.errors
 import logging
 import configparser
 from pathlib import Path
@@ -18,6 +21,61 @@ class DatabaseConnector(object):
     NAME = "DatabaseConnector"
     VERSION = "0.1"
 
+    # states of the crawl jobs
+    JOB_PENDING = "pending"
+    JOB_CLAIMED = "claimed"
+    JOB_DONE = "done"
+    JOB_FAILED = "failed"
+
+    # indexes of the collection of apks: (keys, options)
+    APK_INDEXES = [
+        ([("package", pymongo.ASCENDING)], {"name": "package_unique", "unique": True}),
+        ([("analysis.path_apk", pymongo.ASCENDING)], {"name": "path_apk"}),
+        # only the documents with a benchmark, used with hint
+        # in the queries on 'analysis.benchmark' $exists
+        ([("package", pymongo.ASCENDING)], {"name": "package_benchmark",
+                                            "partialFilterExpression": {"analysis.benchmark": {"$exists": True}}}),
+        ([("analysis.benchmark.base_apk.Androguard.exit_code", pymongo.ASCENDING)],
+         {"name": "base_apk_androguard_exit_code", "sparse": True}),
+        ([("analysis.benchmark.base_apk.Kunai.exit_code", pymongo.ASCENDING)],
+         {"name": "base_apk_kunai_exit_code", "sparse": True}),
+    ]
+
+    # indexes of the collection of malware: (keys, options)
+    MALWARE_INDEXES = [
+        ([("md5", pymongo.ASCENDING)], {"name": "md5_unique", "unique": True}),
+        ([("malware_family", pymongo.ASCENDING)], {"name": "malware_family"}),
+        ([("md5", pymongo.ASCENDING)], {"name": "md5_benchmark",
+                                        "partialFilterExpression": {"analysis.benchmark": {"$exists": True}}}),
+    ]
+
+    # queries of the analysis scripts shown in the index report:
+    # name -> (malware collection, filter, hint)
+    ANALYTIC_QUERIES = {
+        "package": (False, {"package": ""}, None),
+        "apks_downloaded": (False, {"analysis.path_apk": {"$ne": None}}, None),
+        "apks_analyzed": (False, {"analysis.benchmark": {"$exists": True}}, "package_benchmark"),
+        "apks_androguard_ok": (False, {"analysis.benchmark.base_apk.Androguard.exit_code": {"$eq": 0}}, None),
+        "apks_kunai_ok": (False, {"analysis.benchmark.base_apk.Kunai.exit_code": {"$eq": 0}}, None),
+        "md5": (True, {"md5": ""}, None),
+        "malware_family": (True, {"malware_family": ""}, None),
+        "malware_analyzed": (True, {"analysis.benchmark": {"$exists": True}}, "md5_benchmark"),
+    }
+
+    # metrics of each tool in 'analysis.benchmark' and their dtype
+    BENCHMARK_METRICS = {
+        "file_size": "Int64",
+        "analysis_time": "float64",
+        "real_time": "float64",
+        "user_time": "float64",
+        "sys_time": "float64",
+        "memory": "Int64",
+        "exit_code": "Int64",
+    }
+
+    # code of the write errors for a duplicate key
+    DUPLICATE_KEY_ERROR = 11000
+
     FORMAT = '%(asctime)s [%(levelname)-5.5s] %(message)s'
     config_file = "%s/config.ini" % (Path().absolute())
 
@@ -36,11 +94,18 @@ class DatabaseConnector(object):
         self.connector = None
         self.database = None
         self.collection = None
-
-    def config(self, uri = None, database = None, collection = None, malware_collection = None) -> None:
+        self.jobs_collection = None
+        # documents sent to the database in each bulk_write
+        self.bulk_chunk_size = 1000
+        # documents received from the database in each batch of a cursor
+        self.read_batch_size = 1000
+
+    def config(self, uri = None, database = None, collection = None, malware_collection = None, jobs_collection = None,
+               create_indexes = None) -> None:
         '''
         Configuration of the database as well as the connection
-        to the specific collection.
+        to the specific collection, the indexes are created if
+        they do not exist (CREATE_INDEXES in config.ini).
         '''
         if uri is None:
             uri = self.config_parser["DATABASE"]["URI"]
@@ -50,6 +115,11 @@ class DatabaseConnector(object):
             collection = self.config_parser["DATABASE"]["COLLECTION"]
         if malware_collection is None:
             malware_collection = self.config_parser["DATABASE"]["MALWARE_COLLECTION"]
+        if jobs_collection is None:
+            jobs_collection = self.config_parser["DATABASE"].get("JOBS_COLLECTION", "JOBS")
+
+        self.bulk_chunk_size = self.config_parser["DATABASE"].getint("BULK_CHUNK_SIZE", self.bulk_chunk_size)
+        self.read_batch_size = self.config_parser["DATABASE"].getint("READ_BATCH_SIZE", self.read_batch_size)
 
         self.logger.info("[%s] Connecting to URI: %s" %
                          (DatabaseConnector.NAME, uri))
@@ -69,6 +139,76 @@ class DatabaseConnector(object):
         self.logger.info("[%s] Connecting to collection 'MALWARE'" % (DatabaseConnector.NAME))
         self.malware_collection = self.database[malware_collection]
 
+        self.logger.info("[%s] Connecting to collection 'JOBS'" % (DatabaseConnector.NAME))
+        self.jobs_collection = self.database[jobs_collection]
+
+        if create_indexes is None:
+            create_indexes = self.config_parser["DATABASE"].getboolean("CREATE_INDEXES", True)
+        if create_indexes:
+            self.ensure_indexes()
+
+    def _ensure_collection_indexes(self, collection, indexes: list) -> None:
+        existing = collection.index_information()
+
+        for keys, options in indexes:
+            if options["name"] in existing:
+                continue
+
+            self.logger.info("[%s] Creating index %s in %s" % (DatabaseConnector.NAME, options["name"], collection.name))
+            try:
+                collection.create_index(keys, **options)
+            except pymongo.errors.OperationFailure as e:
+                # e.g. duplicated keys written before the unique index
+                self.logger.error("[%s] Error creating index %s in %s: %s" %
+                                  (DatabaseConnector.NAME, options["name"], collection.name, str(e)))
+
+    def ensure_indexes(self) -> None:
+        '''
+        Create the indexes of APK_INDEXES and MALWARE_INDEXES
+        that do not exist yet.
+        '''
+        self._ensure_collection_indexes(self.collection, DatabaseConnector.APK_INDEXES)
+        self._ensure_collection_indexes(self.malware_collection, DatabaseConnector.MALWARE_INDEXES)
+
+    def _get_plan_indexes(self, plan) -> list:
+        '''
+        Indexes (or COLLSCAN) used by the stages of a plan
+        returned by explain.
+        '''
+        indexes = list()
+
+        if isinstance(plan, dict):
+            if "indexName" in plan:
+                indexes.append(plan["indexName"])
+            elif plan.get("stage") == "COLLSCAN":
+                indexes.append("COLLSCAN")
+            for value in plan.values():
+                indexes.extend(self._get_plan_indexes(value))
+        elif isinstance(plan, list):
+            for value in plan:
+                indexes.extend(self._get_plan_indexes(value))
+
+        return indexes
+
+    def get_index_report(self) -> dict:
+        '''
+        Explain the queries of ANALYTIC_QUERIES.
+
+        :return: dictionary query name -> list of indexes of the winning plan, COLLSCAN if no index is used.
+        '''
+        report = dict()
+
+        for name, (malware, query, hint) in DatabaseConnector.ANALYTIC_QUERIES.items():
+            collection = self.malware_collection if malware else self.collection
+            cursor = collection.find(query)
+            if hint is not None:
+                cursor = cursor.hint(hint)
+
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+            report[name] = sorted(set(self._get_plan_indexes(plan)))
+
+        return report
+
     def insert_analysis_apk(self, pkg_name: str, analysis_results: dict) -> None:
         '''
         Insert an analysis result in the database,
@@ -79,14 +219,56 @@ class DatabaseConnector(object):
         :param pkg_name: hash of the APK, used as key of the collection.
         :param analysis_results: results of the analysis.
         '''
-        result = self.collection.find_one({"package": pkg_name})
-        if result is None:
-            self.collection.insert_one(
-                {"package": pkg_name, "analysis": analysis_results})
-        else:
-            filter = {"package": pkg_name}
-            newvalues = {"$set": {"analysis": analysis_results}}
-            self.collection.update_one(filter=filter, update=newvalues)
+        self.collection.update_one({"package": pkg_name},
+                                   {"$set": {"analysis": analysis_results},
+                                    "$setOnInsert": {"package": pkg_name}},
+                                   upsert=True)
+
+    def insert_analysis_apks(self, analyses, chunk_size: int = None) -> int:
+        '''
+        Same as insert_analysis_apk for many packages, the
+        upserts are sent with unordered bulk writes of
+        chunk_size documents.
+
+        :param analyses: iterable of (package name, analysis results).
+        :param chunk_size: documents per bulk write, bulk_chunk_size if None.
+        :return: number of documents written.
+        '''
+        requests = (pymongo.UpdateOne({"package": pkg_name},
+                                      {"$set": {"analysis": analysis_results},
+                                       "$setOnInsert": {"package": pkg_name}},
+                                      upsert=True)
+                    for pkg_name, analysis_results in analyses)
+        return self._bulk_write(self.collection, requests, chunk_size)
+
+    def update_analysis_apk(self, pkg_name: str, values: dict) -> bool:
+        '''
+        Set some fields of the analysis of a package, without
+        reading and writing back the whole document, so other
+        fields written at the same time are not lost.
+
+        :param pkg_name: package name, key of the collection.
+        :param values: fields of the analysis to set.
+        :return: True if the package was found.
+        '''
+        result = self.collection.update_one(
+            {"package": pkg_name},
+            {"$set": {"analysis.%s" % (key): value for key, value in values.items()}})
+        return result.matched_count == 1
+
+    def update_analysis_apks(self, updates, chunk_size: int = None) -> int:
+        '''
+        Same as update_analysis_apk for many packages, with
+        unordered bulk writes of chunk_size documents.
+
+        :param updates: iterable of (package name, fields of the analysis to set).
+        :param chunk_size: documents per bulk write, bulk_chunk_size if None.
+        :return: number of packages found.
+        '''
+        requests = (pymongo.UpdateOne({"package": pkg_name},
+                                      {"$set": {"analysis.%s" % (key): value for key, value in values.items()}})
+                    for pkg_name, values in updates)
+        return self._bulk_write(self.collection, requests, chunk_size)
 
     def insert_malware_analysis_apk(self, md5: str, malware_family: str, analysis_results: dict) -> None:
         '''
@@ -96,14 +278,77 @@ class DatabaseConnector(object):
         :param md5: hash of the apk, used as key.
         :param malware_family: malware family from the sample.
         '''
-        result = self.malware_collection.find_one({"md5": md5})
-        if result is None:
-            self.malware_collection.insert_one(
-                {"md5": md5, "malware_family": malware_family, "analysis": analysis_results})
-        else:
-            filter = {"md5": md5}
-            newvalues = {"$set": {"analysis": analysis_results}}
-            self.malware_collection.update_one(filter=filter, update=newvalues)
+        self.malware_collection.update_one({"md5": md5},
+                                           {"$set": {"analysis": analysis_results},
+                                            "$setOnInsert": {"md5": md5, "malware_family": malware_family}},
+                                           upsert=True)
+
+    def insert_malware_analysis_apks(self, analyses, chunk_size: int = None) -> int:
+        '''
+        Same as insert_malware_analysis_apk for many samples,
+        with unordered bulk writes of chunk_size documents.
+
+        :param analyses: iterable of (md5, malware family, analysis results).
+        :param chunk_size: documents per bulk write, bulk_chunk_size if None.
+        :return: number of documents written.
+        '''
+        requests = (pymongo.UpdateOne({"md5": md5},
+                                      {"$set": {"analysis": analysis_results},
+                                       "$setOnInsert": {"md5": md5, "malware_family": malware_family}},
+                                      upsert=True)
+                    for md5, malware_family, analysis_results in analyses)
+        return self._bulk_write(self.malware_collection, requests, chunk_size)
+
+    def _bulk_write(self, collection, requests, chunk_size: int = None) -> int:
+        '''
+        Send the requests with unordered bulk writes, the
+        requests are consumed chunk by chunk, so they can be
+        given by a generator.
+
+        :return: number of documents matched or upserted.
+        '''
+        if chunk_size is None:
+            chunk_size = self.bulk_chunk_size
+
+        written = 0
+        chunk = list()
+
+        for request in requests:
+            chunk.append(request)
+            if len(chunk) >= chunk_size:
+                written += self._send_bulk(collection, chunk)
+                chunk = list()
+
+        if len(chunk) > 0:
+            written += self._send_bulk(collection, chunk)
+
+        self.logger.info("[%s] Written %d documents in %s" % (DatabaseConnector.NAME, written, collection.name))
+        return written
+
+    def _send_bulk(self, collection, requests: list) -> int:
+        '''
+        Send one unordered bulk write, an upsert fails with a
+        duplicate key when other writer inserted the same
+        document at the same time, those requests are sent
+        once more and they update the existing document.
+
+        :return: number of documents matched or upserted.
+        '''
+        try:
+            result = collection.bulk_write(requests, ordered=False)
+            return result.matched_count + result.upserted_count
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if len(errors) == 0 or e.details.get("writeConcernErrors") or \
+                    any(error.get("code") != DatabaseConnector.DUPLICATE_KEY_ERROR for error in errors):
+                raise e
+
+            self.logger.info("[%s] %d duplicate keys in %s, sending them again" %
+                             (DatabaseConnector.NAME, len(errors), collection.name))
+
+            written = e.details.get("nMatched", 0) + e.details.get("nUpserted", 0)
+            result = collection.bulk_write([requests[error["index"]] for error in errors], ordered=False)
+            return written + result.matched_count + result.upserted_count
 
     def retrieve_analysis_apk(self, pkg_name: str) -> dict:
         '''
@@ -116,6 +361,27 @@ class DatabaseConnector(object):
         '''
         return self.collection.find_one({"package": pkg_name})
 
+    def retrieve_existing_packages(self, pkg_names: list, chunk_size: int = 10000) -> set:
+        '''
+        Check which packages already have a document in the
+        collection, only the package field is retrieved and
+        the lookup is done with one $in query per chunk.
+
+        :param pkg_names: package names to look for.
+        :param chunk_size: maximum number of package names per query.
+        :return: set with the package names found in the collection.
+        '''
+        found = set()
+        pkg_names = list(pkg_names)
+
+        for i in range(0, len(pkg_names), chunk_size):
+            cursor = self.collection.find({"package": {"$in": pkg_names[i:i+chunk_size]}},
+                                          projection={"package": 1, "_id": 0})
+            for doc in cursor:
+                found.add(doc["package"])
+
+        return found
+
     def retrieve_malware_analysis_apk(self, md5: str) -> dict:
         '''
         Retrieve an analysis from the malware collection.
@@ -140,6 +406,37 @@ class DatabaseConnector(object):
         '''
         return self.malware_collection.find({})
 
+    def _find_documents(self, collection, projection: dict, query: dict, batch_size: int) -> pymongo.cursor.Cursor:
+        if query is None:
+            query = {}
+        if batch_size is None:
+            batch_size = self.read_batch_size
+
+        return collection.find(query, projection=projection, batch_size=batch_size)
+
+    def retrieve_documents_from_collection(self, projection: dict = None, query: dict = None,
+                                           batch_size: int = None) -> pymongo.cursor.Cursor:
+        '''
+        Retrieve the documents from the collection with only
+        the fields needed, so the size of the documents does
+        not matter, e.g. {"package": 1, "analysis.benchmark": 1}
+        skips the metadata of Google Play.
+
+        :param projection: fields to retrieve, all the fields if None.
+        :param query: filter of the documents, all the documents if None.
+        :param batch_size: documents per batch of the cursor, read_batch_size if None.
+        :return: Cursor with the documents.
+        '''
+        return self._find_documents(self.collection, projection, query, batch_size)
+
+    def retrieve_documents_from_malware_collection(self, projection: dict = None, query: dict = None,
+                                                   batch_size: int = None) -> pymongo.cursor.Cursor:
+        '''
+        Same as retrieve_documents_from_collection for the
+        malware collection.
+        '''
+        return self._find_documents(self.malware_collection, projection, query, batch_size)
+
     def execute_a_find_query(self, query: dict) -> pymongo.cursor.Cursor:
         '''
         Run a find query into database, the query
@@ -160,20 +457,407 @@ class DatabaseConnector(object):
         '''
         return self.malware_collection.find(query)
 
-    def get_number_of_values_by_query(self, query: dict) -> int:
+    def get_number_of_values_by_query(self, query: dict, hint: str = None) -> int:
         '''
         Get the number of values that match a query.
 
         :param query: what to find in the database.
+        :param hint: name of the index to use, e.g. a partial index.
         :return: integer with the number of documents that match the query.
         '''
+        if hint is not None:
+            return self.collection.count_documents(query, hint=hint)
         return self.collection.count_documents(query)
 
-    def get_number_of_values_by_query_malware(self, query: dict) -> int:
+    def get_number_of_values_by_query_malware(self, query: dict, hint: str = None) -> int:
         '''
         Get the number of values that match a query.
 
         :param query: what to find in the database.
+        :param hint: name of the index to use, e.g. a partial index.
         :return: integer with the number of documents that match the query.
         '''
-        return self.malware_collection.count_documents(query)
\ No newline at end of file
+        if hint is not None:
+            return self.malware_collection.count_documents(query, hint=hint)
+        return self.malware_collection.count_documents(query)
+
+    def _aggregate_one(self, collection, pipeline: list) -> dict:
+        '''
+        Run a pipeline that returns a single document.
+
+        :return: the document without _id, empty if there are no documents.
+        '''
+        for doc in collection.aggregate(pipeline, allowDiskUse=True):
+            doc.pop("_id", None)
+            return doc
+        return dict()
+
+    def _get_summary_pipeline(self, apk_counters: dict, dex_counters: dict) -> list:
+        '''
+        Pipeline with two facets: the counters of the documents,
+        and the counters of the files of 'analysis.benchmark'
+        ($objectToArray + $unwind, one document per file with
+        'key' and 'tools'), merged in a single document.
+        '''
+        return [
+            {"$facet": {
+                "apks": [{"$group": dict({"_id": None}, **apk_counters)}],
+                "dex": [
+                    {"$match": {"analysis.benchmark": {"$exists": True}}},
+                    {"$project": {"_id": 0, "package": 1, "md5": 1,
+                                  "files": {"$objectToArray": "$analysis.benchmark"}}},
+                    {"$unwind": "$files"},
+                    {"$project": {"package": 1, "md5": 1, "key": "$files.k", "tools": "$files.v"}},
+                    {"$group": dict({"_id": None}, **dex_counters)}
+                ]
+            }},
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": [{"$arrayElemAt": ["$apks", 0]},
+                                                            {"$arrayElemAt": ["$dex", 0]}]}}}
+        ]
+
+    def get_benchmark_summary(self) -> dict:
+        '''
+        Counters and extremes of the benchmark of the Google
+        Play apps, computed by the database in a single
+        aggregation. The counters of the DEX files skip the
+        'base_apk' entry, and the comparisons and extremes
+        only use the DEX files analyzed correctly by both
+        tools. The medians are not computed here, they must
+        be exact and are taken from retrieve_benchmark_dataframe.
+
+        :return: dictionary with the counters, and 'biggest_file' and 'smallest_file'.
+        '''
+        def count(condition):
+            return {"$sum": {"$cond": [condition, 1, 0]}}
+
+        def when_correct(value):
+            return {"$cond": [correct, value, None]}
+
+        androguard = "$tools.Androguard"
+        kunai = "$tools.Kunai"
+        dex = {"$ne": ["$key", "base_apk"]}
+        correct = {"$and": [dex,
+                            {"$eq": [androguard + ".exit_code", 0]},
+                            {"$eq": [kunai + ".exit_code", 0]}]}
+
+        time_androguard = androguard + ".analysis_time"
+        time_kunai = kunai + ".analysis_time"
+        memory_androguard = androguard + ".memory"
+        memory_kunai = kunai + ".memory"
+
+        # compared first by size
+        dex_file = {"size": androguard + ".file_size",
+                    "package": "$package",
+                    "file": "$key",
+                    "time_androguard": time_androguard,
+                    "time_kunai": time_kunai,
+                    "memory_androguard": memory_androguard,
+                    "memory_kunai": memory_kunai}
+
+        apk_counters = {
+            "total_apks": count({"$ne": [{"$type": "$analysis"}, "missing"]}),
+            "total_apks_downloaded": count({"$ne": [{"$ifNull": ["$analysis.path_apk", None]}, None]}),
+            "total_apks_analyzed": count({"$ne": [{"$type": "$analysis.benchmark"}, "missing"]}),
+            "apks_correctly_analyzed_androguard": count({"$eq": ["$analysis.benchmark.base_apk.Androguard.exit_code", 0]}),
+            "apks_correctly_analyzed_kunai": count({"$eq": ["$analysis.benchmark.base_apk.Kunai.exit_code", 0]}),
+        }
+
+        dex_counters = {
+            "total_dex_files": count(dex),
+            "correctly_analyzed_dex_files": count(correct),
+            "kunai_faster_androguard": count({"$and": [correct, {"$lt": [time_kunai, time_androguard]}]}),
+            "kunai_slower_androguard": count({"$and": [correct, {"$gt": [time_kunai, time_androguard]}]}),
+            "kunai_same_time_androguard": count({"$and": [correct, {"$eq": [time_kunai, time_androguard]}]}),
+            "kunai_smaller_androguard": count({"$and": [correct, {"$lt": [memory_kunai, memory_androguard]}]}),
+            "kunai_bigger_androguard": count({"$and": [correct, {"$gt": [memory_kunai, memory_androguard]}]}),
+            "kunai_same_memory_androguard": count({"$and": [correct, {"$eq": [memory_kunai, memory_androguard]}]}),
+            "biggest_file": {"$max": when_correct(dex_file)},
+            "smallest_file": {"$min": when_correct(dex_file)},
+        }
+
+        return self._aggregate_one(self.collection, self._get_summary_pipeline(apk_counters, dex_counters))
+
+    def get_malware_benchmark_summary(self, ignored_size: int = None) -> dict:
+        '''
+        Counters and extremes of the benchmark of the malware
+        samples, computed by the database in a single aggregation.
+        The entries with '_apk' in the name are the analysis of
+        the APK, the others are DEX files; the comparisons and
+        extremes only use the DEX files analyzed correctly by the
+        three tools.
+
+        :param ignored_size: size of DEX file left out of the extremes.
+        :return: dictionary with the counters, and 'biggest_file' and 'smallest_file'.
+        '''
+        def count(condition):
+            return {"$sum": {"$cond": [condition, 1, 0]}}
+
+        androguard = "$tools.Androguard"
+        kunai_linear = "$tools.Kunai-Linear"
+        kunai_recursive = "$tools.Kunai-Recursive"
+        apk = {"$gte": [{"$indexOfCP": ["$key", "_apk"]}, 0]}
+        dex = {"$not": [apk]}
+        correct = {"$and": [dex,
+                            {"$eq": [androguard + ".exit_code", 0]},
+                            {"$eq": [kunai_linear + ".exit_code", 0]},
+                            {"$eq": [kunai_recursive + ".exit_code", 0]}]}
+
+        time_androguard = androguard + ".analysis_time"
+        time_kunai_linear = kunai_linear + ".analysis_time"
+        time_kunai_recursive = kunai_recursive + ".analysis_time"
+        memory_androguard = androguard + ".memory"
+        memory_kunai_linear = kunai_linear + ".memory"
+        memory_kunai_recursive = kunai_recursive + ".memory"
+
+        kunai_slower = {"$and": [{"$lt": [time_androguard, time_kunai_linear]},
+                                 {"$lt": [time_androguard, time_kunai_recursive]}]}
+        kunai_same_time = {"$or": [{"$eq": [time_androguard, time_kunai_linear]},
+                                   {"$eq": [time_androguard, time_kunai_recursive]}]}
+        kunai_bigger = {"$and": [{"$lt": [memory_androguard, memory_kunai_linear]},
+                                 {"$lt": [memory_androguard, memory_kunai_recursive]}]}
+        kunai_same_memory = {"$or": [{"$eq": [memory_androguard, memory_kunai_linear]},
+                                     {"$eq": [memory_androguard, memory_kunai_recursive]}]}
+
+        in_extremes = correct
+        if ignored_size is not None:
+            in_extremes = {"$and": [correct, {"$ne": [androguard + ".file_size", ignored_size]}]}
+
+        # compared first by size
+        dex_file = {"$cond": [in_extremes,
+                              {"size": androguard + ".file_size",
+                               "md5": "$md5",
+                               "file": "$key",
+                               "time_androguard": time_androguard,
+                               "time_kunai": time_kunai_linear,
+                               "time_kunai_recursive": time_kunai_recursive,
+                               "memory_androguard": memory_androguard,
+                               "memory_kunai": memory_kunai_linear,
+                               "memory_kunai_recursive": memory_kunai_recursive},
+                              None]}
+
+        apk_counters = {
+            "total_apks": count({"$ne": [{"$type": "$analysis"}, "missing"]}),
+        }
+
+        dex_counters = {
+            "apks_correctly_analyzed_androguard": count({"$and": [apk, {"$eq": [androguard + ".exit_code", 0]}]}),
+            "apks_correctly_analyzed_kunai": count({"$and": [apk, {"$eq": ["$tools.Kunai.exit_code", 0]}]}),
+            "total_dex_files": count(dex),
+            "dex_correctly_analyzed_androguard": count({"$and": [dex, {"$eq": [androguard + ".exit_code", 0]}]}),
+            "dex_correctly_analyzed_kunai_linear": count({"$and": [dex, {"$eq": [kunai_linear + ".exit_code", 0]}]}),
+            "dex_correctly_analyzed_kunai_recursive": count({"$and": [dex, {"$eq": [kunai_recursive + ".exit_code", 0]}]}),
+            "correctly_analyzed_dex_files": count(correct),
+            "kunai_slower_androguard": count({"$and": [correct, kunai_slower]}),
+            "kunai_same_time_androguard": count({"$and": [correct, {"$not": [kunai_slower]}, kunai_same_time]}),
+            "kunai_faster_androguard": count({"$and": [correct, {"$not": [kunai_slower]}, {"$not": [kunai_same_time]}]}),
+            "kunai_bigger_androguard": count({"$and": [correct, kunai_bigger]}),
+            "kunai_same_memory_androguard": count({"$and": [correct, {"$not": [kunai_bigger]}, kunai_same_memory]}),
+            "kunai_smaller_androguard": count({"$and": [correct, {"$not": [kunai_bigger]}, {"$not": [kunai_same_memory]}]}),
+            "biggest_file": {"$max": dex_file},
+            "smallest_file": {"$min": dex_file},
+        }
+
+        return self._aggregate_one(self.malware_collection, self._get_summary_pipeline(apk_counters, dex_counters))
+
+    def iterate_benchmark_rows(self, malware: bool = False, metrics: dict = None, query: dict = None,
+                               batch_size: int = None):
+        '''
+        Flatten 'analysis.benchmark' in the database, one row per
+        document, analyzed file and tool, with the same fields in
+        every row: the key of the document ('package', or 'md5' and
+        'malware_family'), 'file', 'tool' and the metrics (None if
+        missing).
+
+        :param malware: read the malware collection.
+        :param metrics: metrics of each tool, BENCHMARK_METRICS if None.
+        :param query: filter of the documents, the ones with a benchmark if None.
+        :param batch_size: rows per batch, read_batch_size if None.
+        :return: generator of lists of rows.
+        '''
+        if metrics is None:
+            metrics = DatabaseConnector.BENCHMARK_METRICS
+        if query is None:
+            query = {"analysis.benchmark": {"$exists": True}}
+        if batch_size is None:
+            batch_size = self.read_batch_size
+
+        collection = self.malware_collection if malware else self.collection
+        keys = ["md5", "malware_family"] if malware else ["package"]
+
+        row = {key: 1 for key in keys}
+        row.update({"file": 1, "tool": "$tools.k"})
+        row.update({metric: {"$ifNull": ["$tools.v.%s" % (metric), None]} for metric in metrics})
+
+        pipeline = [
+            {"$match": query},
+            {"$project": dict({"_id": 0, "files": {"$objectToArray": "$analysis.benchmark"}},
+                              **{key: 1 for key in keys})},
+            {"$unwind": "$files"},
+            {"$project": dict({"file": "$files.k", "tools": {"$objectToArray": "$files.v"}},
+                              **{key: 1 for key in keys})},
+            {"$unwind": "$tools"},
+            {"$project": row}
+        ]
+
+        batch = list()
+        for doc in collection.aggregate(pipeline, batchSize=batch_size, allowDiskUse=True):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = list()
+
+        if len(batch) > 0:
+            yield batch
+
+    def retrieve_benchmark_dataframe(self, malware: bool = False, metrics: dict = None, query: dict = None,
+                                     batch_size: int = None, arrow: bool = False):
+        '''
+        Rows of iterate_benchmark_rows in a pandas DataFrame, built
+        batch by batch with the dtypes of the metrics, 'tool' is a
+        category.
+
+        :param arrow: return a pyarrow Table instead of a DataFrame.
+        :return: DataFrame (or Table) with one row per document, analyzed file and tool.
+        '''
+        import pandas as pd
+
+        if metrics is None:
+            metrics = DatabaseConnector.BENCHMARK_METRICS
+
+        keys = ["md5", "malware_family"] if malware else ["package"]
+        columns = keys + ["file", "tool"] + list(metrics.keys())
+        dtypes = dict({column: "string" for column in keys + ["file", "tool"]}, **metrics)
+
+        frames = [pd.DataFrame.from_records(batch, columns=columns).astype(dtypes)
+                  for batch in self.iterate_benchmark_rows(malware, metrics, query, batch_size)]
+
+        if len(frames) == 0:
+            df = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+        else:
+            df = pd.concat(frames, ignore_index=True)
+        df["tool"] = df["tool"].astype("category")
+
+        if arrow:
+            import pyarrow as pa
+            return pa.Table.from_pandas(df, preserve_index=False)
+
+        return df
+
+    def create_job_indexes(self) -> None:
+        '''
+        Indexes used to claim the crawl jobs, one job per
+        package, and the pending or expired jobs are found
+        in the order of the list.
+        '''
+        self.jobs_collection.create_index("package", unique=True)
+        self.jobs_collection.create_index([("status", pymongo.ASCENDING),
+                                           ("lease_expires", pymongo.ASCENDING),
+                                           ("position", pymongo.ASCENDING)])
+
+    def insert_jobs(self, jobs: list, chunk_size: int = 1000) -> int:
+        '''
+        Insert crawl jobs in the jobs collection, the jobs of
+        packages already in the collection are not modified,
+        so the list can be loaded again without losing the
+        state of the crawl.
+
+        :param jobs: list of dictionaries with 'package', 'position' and 'data' (row of the list).
+        :param chunk_size: jobs sent to the database at once.
+        :return: number of new jobs.
+        '''
+        inserted = 0
+        jobs = list(jobs)
+
+        for i in range(0, len(jobs), chunk_size):
+            requests = [pymongo.UpdateOne({"package": job["package"]},
+                                          {"$setOnInsert": {
+                                              "package": job["package"],
+                                              "position": job["position"],
+                                              "data": job["data"],
+                                              "status": DatabaseConnector.JOB_PENDING,
+                                              "worker": None,
+                                              "lease_expires": 0,
+                                              "attempts": 0
+                                          }},
+                                          upsert=True)
+                        for job in jobs[i:i+chunk_size]]
+            result = self.jobs_collection.bulk_write(requests, ordered=False)
+            inserted += result.upserted_count
+
+        return inserted
+
+    def claim_job(self, worker_id: str, lease_seconds: float) -> dict:
+        '''
+        Claim atomically the first job that is pending, or
+        whose lease expired (the worker died), the lease must
+        be renewed with heartbeat_jobs before it expires.
+
+        :param worker_id: identifier of the worker claiming the job.
+        :param lease_seconds: seconds the job belongs to the worker.
+        :return: the claimed job, or None if there are no jobs left.
+        '''
+        now = time.time()
+
+        return self.jobs_collection.find_one_and_update(
+            {"$or": [{"status": DatabaseConnector.JOB_PENDING},
+                     {"status": DatabaseConnector.JOB_CLAIMED, "lease_expires": {"$lt": now}}]},
+            {"$set": {"status": DatabaseConnector.JOB_CLAIMED,
+                      "worker": worker_id,
+                      "claimed_at": now,
+                      "lease_expires": now + lease_seconds},
+             "$inc": {"attempts": 1}},
+            sort=[("position", pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER)
+
+    def heartbeat_jobs(self, pkg_names: list, worker_id: str, lease_seconds: float) -> int:
+        '''
+        Renew the lease of the jobs claimed by a worker.
+
+        :return: number of jobs renewed, the other jobs are not owned by the worker anymore.
+        '''
+        result = self.jobs_collection.update_many(
+            {"package": {"$in": list(pkg_names)},
+             "worker": worker_id,
+             "status": DatabaseConnector.JOB_CLAIMED},
+            {"$set": {"lease_expires": time.time() + lease_seconds}})
+        return result.matched_count
+
+    def finish_job(self, pkg_name: str, worker_id: str, status: str, reason: str = None) -> bool:
+        '''
+        Set the final status of a job (JOB_DONE, JOB_FAILED) or
+        give it back (JOB_PENDING), only if the job is still
+        owned by the worker.
+
+        :return: True if the job was updated.
+        '''
+        result = self.jobs_collection.update_one(
+            {"package": pkg_name, "worker": worker_id, "status": DatabaseConnector.JOB_CLAIMED},
+            {"$set": {"status": status,
+                      "reason": reason,
+                      "finished_at": time.time(),
+                      "lease_expires": 0}})
+        return result.matched_count == 1
+
+    def get_job_counts(self) -> dict:
+        '''
+        :return: dictionary status -> number of jobs.
+        '''
+        cursor = self.jobs_collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+        return {doc["_id"]: doc["count"] for doc in cursor}
+
+
+def main():
+    '''
+    Create the indexes, and with --index-report show
+    the indexes used by the queries of the analysis.
+    '''
+    database_connector = DatabaseConnector()
+    database_connector.config()
+
+    if "--index-report" in sys.argv:
+        for name, indexes in database_connector.get_index_report().items():
+            print("%s: %s" % (name, ", ".join(indexes)))
+
+
+if __name__ == "__main__":
+    main()
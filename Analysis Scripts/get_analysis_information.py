@@ -10,89 +10,29 @@ be used for other files.
 
 import os
 import sys
-from os.path import basename
 from database_connector import DatabaseConnector
-from scanf import scanf
+from benchmark_results import extract_variables_analysis_line, read_all_paths_and_sizes
 
 size_of_files = dict()
 database_connector = DatabaseConnector()
 
-def retrieve_variables_from_line(line: str) -> tuple:
+def read_benchmark_results():
     '''
-    Use scanf function in order to retrieve the different variables
-    from the line of the CSV scanned.
+    Read the results of each package from kunai-benchmark-results,
+    one file per package.
 
-    :param line: line to analyze with scanf and extract data.
-    :return: tuple with variables of different data types
+    :return: generator of (package name, fields of the analysis).
     '''
-    return scanf("%s;%s;cmd:%s %s;real:%f:user:%f;sys:%f;memory:%d;cpu:%d%;exit-code:%d", line)
-
-def retrieve_variables_from_line_with_analysis_time(line: str) -> tuple:
-    '''
-    Use scanf function in order to retrieve the different variables
-    from the line of the CSV scanned.
-
-    :param line: line to analyze with scanf and extract data.
-    :return: tuple with variables of different data types
-    '''
-    return scanf("%s;%s;analysis_time:%f;cmd:%s %s;real:%f:user:%f;sys:%f;memory:%d;cpu:%d%;exit-code:%d", line)
-
-
-def extract_variables_analysis_line(lines: list) -> dict:
-    '''
-    Extract all the variables from a list of string lines
-    with the information from the analysis, create a dictionary
-    with the results from the analysis, and finish it.
-    '''
-    results = {'benchmark':dict()}
-
-    tool = None
-    file = None
-    analysis_time = 0.0
-    analysis_command = None
-    path_command = None
-    real_time = 0.0
-    user_time = 0.0
-    sys_time = 0.0
-    memory = 0
-    cpu = 0
-    exit_code = 0
-
-    for line in lines:
-        line = line.strip()
-        if 'analysis_time:' in line:
-            (tool, file, analysis_time, analysis_command, path_command, real_time, user_time, sys_time, memory, cpu, exit_code) = retrieve_variables_from_line_with_analysis_time(line)
-        else:
-            (tool, file, analysis_command, path_command, real_time, user_time, sys_time, memory, cpu, exit_code) = retrieve_variables_from_line(line)
-
-        analyzed_file_name = basename(file).replace(".","_")
-
-        if analyzed_file_name not in results['benchmark']:
-            results['benchmark'][analyzed_file_name] = dict()
-
-        if tool not in results['benchmark'][analyzed_file_name].keys():
-            results['benchmark'][analyzed_file_name][tool] = {
-                'analysis_time':analysis_time,
-                'real_time':real_time,
-                'user_time':user_time,
-                'sys_time':sys_time,
-                'memory':memory,
-                'exit_code':exit_code,
-                'file_size':size_of_files[path_command]
-            }
-
-    return results
-        
-def read_all_paths_and_sizes(lines: str):
-    global size_of_files
-
-    path = ""
-    size = 0
-    for line in lines:
-        line = line.strip()
-        (path, size) = scanf("%s:%d", line)
-        size_of_files[path] = size
+    for root, dirs, files in os.walk('./kunai-benchmark-results/'):
+        for filename in files:
+            if filename == 'file_sizes.csv':
+                continue
+            path = os.path.join(root, filename)
+            with open(path, 'r') as f_:
+                lines = f_.readlines()
+                result = extract_variables_analysis_line(lines, size_of_files)
 
+            yield (filename.replace('.csv',''), {'benchmark': result['benchmark']})
 
 def main():
     global database_connector
@@ -101,25 +41,20 @@ def main():
 
     with open('./kunai-benchmark-results/file_sizes.csv', 'r') as f_:
         lines = f_.readlines()
-        read_all_paths_and_sizes(lines)
-    
-    for root, dirs, files in os.walk('./kunai-benchmark-results/'):
-        for filename in files:
-            if filename == 'file_sizes.csv':
-                continue
-            path = os.path.join(root, filename)
-            with open(path, 'r') as f_:
-                lines = f_.readlines()
-                result = extract_variables_analysis_line(lines)
+        read_all_paths_and_sizes(lines, size_of_files)
+
+    package_names = [filename.replace('.csv','')
+                     for root, dirs, files in os.walk('./kunai-benchmark-results/')
+                     for filename in files if filename != 'file_sizes.csv']
+
+    existing_packages = database_connector.retrieve_existing_packages(package_names)
+    for pkg_name in package_names:
+        if pkg_name not in existing_packages:
+            print(f"Error for packagename {pkg_name}")
+            sys.exit(1)
 
-                current_data = database_connector.retrieve_analysis_apk(filename.replace('.csv',''))
-                if current_data is None:
-                    print(f"Error for packagename {filename.replace('.csv','')}")
-                    sys.exit(1)
-                
-                current_data['analysis']['benchmark'] = result['benchmark']
-                
-                database_connector.insert_analysis_apk(filename.replace('.csv',''), dict(current_data['analysis']))
+    # only analysis.benchmark is set, the rest of the document is kept
+    database_connector.update_analysis_apks(read_benchmark_results())
 
 if __name__ == '__main__':
     main()
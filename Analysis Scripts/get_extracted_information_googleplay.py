@@ -163,11 +163,13 @@ def analyze_lines(lines: list):
 
     return results
 
-def main():
-    global database_connector
-
-    database_connector.config()
+def read_extracted_information():
+    '''
+    Read the information extracted from each package,
+    one file per package.
 
+    :return: generator of (package name, analysis results).
+    '''
     for root, dirs, files in os.walk('./extract-information-googleplay/'):
         for filename in files:
             path = os.path.join(root, filename)
@@ -175,8 +177,15 @@ def main():
                 print(f"Analyzing file '{path}'")
                 lines = f_.readlines()
                 result = analyze_lines(lines)
-                pkg_name = filename.replace('.csv', '')
-                database_connector.insert_analysis_apk(pkg_name=pkg_name,analysis_results=result)
-            
+            pkg_name = filename.replace('.csv', '')
+            yield (pkg_name, result)
+
+def main():
+    global database_connector
+
+    database_connector.config()
+
+    database_connector.insert_analysis_apks(read_extracted_information())
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -166,20 +166,29 @@ def analyze_lines(lines: list):
 
     return results
 
-def main():
-    global database_connector
-
-    database_connector.config()
+def read_extracted_information():
+    '''
+    Read the information extracted from each sample, one
+    file per sample in the folder of its malware family.
 
+    :return: generator of (md5, malware family, analysis results).
+    '''
     for root, dirs, files in os.walk('./extract-information-malware/'):
         for filename in files:
             path = os.path.join(root, filename)
             with open(path, 'r') as f_:
                 lines = f_.readlines()
                 result = analyze_lines(lines)
-                md5 = filename.split('.')[0]
-                malware_family = os.path.basename(root)
-                database_connector.insert_malware_analysis_apk(md5, malware_family, result)
+            md5 = filename.split('.')[0]
+            malware_family = os.path.basename(root)
+            yield (md5, malware_family, result)
+
+def main():
+    global database_connector
+
+    database_connector.config()
+
+    database_connector.insert_malware_analysis_apks(read_extracted_information())
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -96,20 +96,29 @@ def extract_variables_analysis_line(lines: list) -> dict:
 
     return results
 
-def main():
-    global database_connector
-
-    database_connector.config()
+def read_benchmark_results():
+    '''
+    Read the results of each sample, one file per sample
+    in the folder of its malware family.
 
+    :return: generator of (md5, malware family, analysis results).
+    '''
     for root, dirs, files in os.walk('./malware-benchmark-results/'):
         for filename in files:
             path = os.path.join(root, filename)
             with open(path, 'r') as f_:
                 lines = f_.readlines()
                 result = extract_variables_analysis_line(lines)
-                md5 = filename.split('.')[0]
-                malware_family = os.path.basename(root)
-                database_connector.insert_malware_analysis_apk(md5, malware_family, result)
+            md5 = filename.split('.')[0]
+            malware_family = os.path.basename(root)
+            yield (md5, malware_family, result)
+
+def main():
+    global database_connector
+
+    database_connector.config()
+
+    database_connector.insert_malware_analysis_apks(read_benchmark_results())
 
 if __name__ == '__main__':
     main()
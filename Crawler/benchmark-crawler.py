@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Measure the throughput of the crawler without emulators
+and without network, the crawler runs against a fake adb
+server with fake devices and a fake Google Play, with the
+latencies and failure rates of tools/fake_adb_server.py
+and tools/fake_play_store.py. The apps per hour and the
+latency of each stage are printed and written as JSON.
+
+Usage:
+    benchmark-crawler.py [number of apps] [number of devices] [time scale]
+'''
+
+import sys
+import json
+import time
+import logging
+import tempfile
+
+from tools.google_meta_inf import GoogleMetaInf
+from tools.emulator_manager import AdbUtilities
+from tools.device_pool import DevicePool
+from tools.apk_store import ApkStore
+from tools.stage_timer import StageTimer
+from tools.fake_adb_server import FakeAdbServer
+from tools.fake_play_store import FakePlayStore
+
+
+FORMAT = '%(asctime)s [%(levelname)-5.5s] %(message)s'
+logging.basicConfig(level=logging.INFO, format=FORMAT, handlers=[
+    logging.FileHandler("debug.log"),
+    logging.StreamHandler()
+])
+
+logger = logging.getLogger()
+
+NUMBER_OF_APPS = 50
+NUMBER_OF_DEVICES = 2
+# factor applied to the latencies of the fake devices
+TIME_SCALE = 0.2
+# ports of the fakes, not the ones of the real services
+FAKE_ADB_PORT = 5038
+FAKE_PLAY_STORE_PORT = 8088
+BENCHMARK_RESULTS = "./crawler_benchmark.json"
+
+if len(sys.argv) > 1:
+    NUMBER_OF_APPS = int(sys.argv[1])
+if len(sys.argv) > 2:
+    NUMBER_OF_DEVICES = int(sys.argv[2])
+if len(sys.argv) > 3:
+    TIME_SCALE = float(sys.argv[3])
+
+
+def configure_google_meta_inf(google_meta_inf: GoogleMetaInf, base_url: str):
+    '''
+    Point the scrapper to the fake Google Play, without
+    cache and without rate limit.
+    '''
+    google_meta_inf.config_parser["MetadataCache"] = {"PATH": ""}
+    google_meta_inf.config_parser["GoogleScrapper"] = {
+        "WAITTIME": "0",
+        "MAX_WORKERS": "8",
+        "MAX_RETRIES": "3",
+        "RETRY_BASE_DELAY": "0.1",
+        "BASE_URL": base_url
+    }
+    google_meta_inf.config()
+
+def main():
+    '''
+    Main function of the script
+    '''
+    play_store = FakePlayStore(port=FAKE_PLAY_STORE_PORT)
+    play_store.start()
+
+    adb_server = FakeAdbServer(port=FAKE_ADB_PORT, number_of_devices=NUMBER_OF_DEVICES, time_scale=TIME_SCALE)
+    adb_server.start()
+
+    stage_timer = StageTimer()
+
+    google_meta_inf = GoogleMetaInf()
+    configure_google_meta_inf(google_meta_inf, play_store.get_base_url())
+    google_meta_inf.stage_timer = stage_timer
+
+    adbutilities = AdbUtilities(port=FAKE_ADB_PORT)
+    adbutilities.stage_timer = stage_timer
+
+    apk_store = ApkStore(tempfile.mkdtemp(prefix="crawler-benchmark-"))
+
+    package_names = ["com.fake.app%d" % (i) for i in range(NUMBER_OF_APPS)]
+
+    start = time.time()
+
+    metadata_by_package = google_meta_inf.run_many(package_names)
+
+    def install_job(pkg_name, device_id):
+        return adbutilities.install_apk_from_googleplay(pkg_name, device_id)
+
+    def finish_job(pkg_name, device_id, apk_paths):
+        if apk_paths is None:
+            return False
+        record = adbutilities.retrieve_and_uninstall_apk(pkg_name, apk_paths, apk_store, device_id,
+                                                         metadata_by_package[pkg_name].get('version'))
+        return record is not None
+
+    device_pool = DevicePool(adbutilities)
+    results = device_pool.run_pipelined(package_names, install_job, finish_job)
+
+    elapsed = time.time() - start
+    downloaded = len([ret for ret in results.values() if ret])
+
+    report = {
+        'apps': NUMBER_OF_APPS,
+        'devices': NUMBER_OF_DEVICES,
+        'time_scale': TIME_SCALE,
+        'downloaded': downloaded,
+        'elapsed': elapsed,
+        'apps_per_hour': NUMBER_OF_APPS / elapsed * 3600,
+        'downloads_per_hour': downloaded / elapsed * 3600,
+        'stages': stage_timer.get_summary(),
+        'steps': adbutilities.get_step_latencies()
+    }
+
+    with open(BENCHMARK_RESULTS, 'w') as f_:
+        json.dump(report, f_, indent=4)
+
+    logger.info("Crawled %d apps (%d downloaded) with %d devices in %.1f seconds: %.1f apps/hour" %
+                (NUMBER_OF_APPS, downloaded, NUMBER_OF_DEVICES, elapsed, report['apps_per_hour']))
+    for stage, summary in report['stages'].items():
+        logger.info("Stage %s: p50 %.3f, p95 %.3f, p99 %.3f seconds (%d runs)" %
+                    (stage, summary['p50'], summary['p95'], summary['p99'], summary['count']))
+
+    adbutilities.close_sessions()
+    adb_server.stop()
+    play_store.stop()
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,28 @@
 '''
 Crawl in the Google Play from an Android emulator
 for applications to download.
+
+Usage:
+    crawl-top-free-apps.py              crawl the applications from the CSV
+    crawl-top-free-apps.py --load-jobs  load the CSV in the jobs collection
+    crawl-top-free-apps.py --jobs       crawl the jobs claimed from the jobs
+                                        collection, several hosts can run it
 '''
 
+import sys
+import json
 import logging
 import pandas as pd
 from tools.google_meta_inf import GoogleMetaInf
 from tools.emulator_manager import AdbUtilities
+from tools.emulator_lifecycle import EmulatorLifecycle
+from tools.device_pool import DevicePool, DeviceFailure
+from tools.crawl_journal import CrawlJournal
+from tools.apk_store import ApkStore
+from tools.stage_timer import StageTimer
+from tools.retry_scheduler import RetryScheduler, CrawlFailure
+from tools.job_queue import CrawlJobQueue
+from tools.benchmark_worker import BenchmarkWorker
 from database_connector import DatabaseConnector
 
 
@@ -23,28 +39,58 @@ logger = logging.getLogger()
 
 # https://androidrank.org/android-most-popular-google-play-apps?category=all&sort=4&price=free
 TOP_FREE_APPS_CSV = "./applist.csv"
+# rows of the CSV processed at once
+CSV_CHUNK_SIZE = 1000
+# state of each package, used to resume the crawl
+CRAWL_JOURNAL = "./crawl_journal.jsonl"
+# number of apps installed in a device before pulling all
+# of them in one stream, 0 pulls each app while the next
+# one is installed (pipelined mode)
+BULK_EXPORT_BATCH_SIZE = 0
+# time of each stage of the crawl, exported after each
+# chunk of the CSV as JSON (p50/p95/p99) and as a textfile
+# for the Prometheus node exporter
+CRAWL_TIMINGS_JSON = "./crawl_timings.json"
+CRAWL_TIMINGS_PROMETHEUS = "./crawler_metrics.prom"
+# packages that failed and will not be retried, the transient
+# failures are retried up to MAX_ATTEMPTS times waiting
+# RETRY_BASE_DELAY seconds (doubled on each attempt)
+DEAD_LETTER = "./dead_letter.jsonl"
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 30
+# jobs claimed at once from the jobs collection
+JOBS_CLAIM_SIZE = 20
 google_meta_inf = GoogleMetaInf()
 adbutilities = AdbUtilities()
+emulator_lifecycle = EmulatorLifecycle()
 database_connector = DatabaseConnector()
+crawl_journal = CrawlJournal(CRAWL_JOURNAL)
+stage_timer = StageTimer()
+google_meta_inf.stage_timer = stage_timer
+adbutilities.stage_timer = stage_timer
+retry_scheduler = RetryScheduler(DEAD_LETTER, MAX_ATTEMPTS, RETRY_BASE_DELAY)
+benchmark_worker = BenchmarkWorker(database_connector)
 
 
 path_for_apks = "apks/" # path where to download the APK files
+apk_store = ApkStore(path_for_apks)
 
-def read_apps_information_from_csv() -> pd.DataFrame:
+def read_apps_information_from_csv():
     '''
     Read the CSV with information from the CSV of
-    TOP_FREE_APPS, this will be transformed into
-    a DataFrame, and from here the information will
-    be obtained.
+    TOP_FREE_APPS, the CSV is read in chunks of
+    CSV_CHUNK_SIZE rows, so it can have any size,
+    each chunk is a DataFrame.
     '''
     global TOP_FREE_APPS_CSV
     global logger
 
     logger.info("Reading top downloaded apps from [%s]" % (TOP_FREE_APPS_CSV))
-    data_top_apps = pd.read_csv(TOP_FREE_APPS_CSV)
-    logger.info("Obtained data from 500 top free apps by downloads.")
-
-    return data_top_apps
+    total_rows = 0
+    for data_top_apps in pd.read_csv(TOP_FREE_APPS_CSV, chunksize=CSV_CHUNK_SIZE):
+        total_rows += len(data_top_apps)
+        yield data_top_apps
+    logger.info("Obtained data from %d apps." % (total_rows))
 
 def obtain_meta_inf_from_pkg_name(pkg_name: str) -> dict:
     '''
@@ -67,64 +113,418 @@ def obtain_packages_from_googleplay(pkg_names: list):
     play from an emulator.
     '''
     global adbutilities
+    global apk_store
+
+    adbutilities.download_apks_from_emulator(pkg_names, path_for_apks, apk_store=apk_store)
+
+def obtain_meta_inf_from_pkg_names(pkg_names: list) -> dict:
+    '''
+    Obtain the meta-information from all the packages at
+    once before using the emulators, so the emulators do
+    not wait for the scrapper.
+    '''
+    global google_meta_inf
+    global logger
+
+    logger.info("Obtaining meta-information from %d packages" % (len(pkg_names)))
+    information = google_meta_inf.run_many(pkg_names)
+    logger.info("Obtained information from %d packages" % (len(information)))
+    return information
+
+def install_package(app_row: pd.Series, device_id: str, data_from_google: dict = None) -> tuple:
+    '''
+    First stage of the crawl of an application from the CSV,
+    obtain the metadata and install it with the given device.
+
+    :param app_row: row from the CSV with the information of the app.
+    :param device_id: device used to download the application.
+    :param data_from_google: metadata already retrieved, if None it is retrieved now.
+    :return: tuple with the data of the app, the paths of the apk files in the device (or None),
+             the record from the store if the apk was not downloaded because it was
+             already stored with the same version (or None) and the reason of the
+             failure (CrawlFailure) if it could not be installed.
+    '''
+    global adbutilities
+    global crawl_journal
+    global apk_store
+
+    pkg_name = app_row['pkg_name']
+
+    app_name = app_row['app_name']
+    category = app_row['category']
+    downloads = int(app_row['downloads'])
+    ratings = int(app_row['ratings'])
+    average_rating = float(app_row['average_rating'])
+    price = str(app_row['price'])
+    growth_30_days = float(app_row['growth_30_days'])
+    growth_60_days = float(app_row['growth_60_days'])
+
+    if data_from_google is None:
+        print(f"Obtaining metadata from google play for {pkg_name}")
+        data_from_google = obtain_meta_inf_from_pkg_name(pkg_name)
+
+    path_where_apk_should_be = apk_store.get_package_path(pkg_name)
+
+    app_data = {
+            'app_name':app_name,
+            'category':category,
+            'downloads':downloads,
+            'ratings':ratings,
+            'average_rating':average_rating,
+            'price':price,
+            'growth_30_days':growth_30_days,
+            'growth_60_dats':growth_60_days,
+            'google_meta_data':data_from_google,
+            'path_apk':path_where_apk_should_be
+        }
+
+    crawl_journal.record(pkg_name, CrawlJournal.METADATA_DONE, device_id)
+
+    version = data_from_google.get('version')
+    if apk_store.has_version(pkg_name, version):
+        print(f"Version {version} of {pkg_name} already stored, not downloading it")
+        return (app_data, None, apk_store.get_record(pkg_name), None)
+
+    # the store will not have it either
+    if data_from_google.get('ERROR') == "NOT_FOUND":
+        print(f"{pkg_name} not found in google play, not installing it")
+        return (app_data, None, None, CrawlFailure.NOT_FOUND)
+
+    print(f"Install apk in emulator {device_id}")
+    apk_paths = adbutilities.install_apk_from_googleplay(pkg_name, device_id)
+
+    if apk_paths is None:
+        return (app_data, None, None, adbutilities.get_last_failure(device_id) or CrawlFailure.EXCEPTION)
+
+    crawl_journal.record(pkg_name, CrawlJournal.INSTALLED, device_id)
+
+    return (app_data, apk_paths, None, None)
+
+def save_package_result(pkg_name: str, device_id: str, app_data: dict, record: dict, reason: str) -> bool:
+    '''
+    Store in the database and in the journal the result
+    of the crawl of an application. A failed application
+    is stored only if it will not be retried.
+
+    :param record: record of the apk in the store, None if it could not be downloaded.
+    :param reason: reason of the failure (CrawlFailure), in case record is None.
+    :return: True if the apk was downloaded.
+    '''
+    global database_connector
+    global crawl_journal
+    global stage_timer
+    global retry_scheduler
+    global benchmark_worker
+
+    ret = record is not None
+
+    if not ret and retry_scheduler.schedule(pkg_name, device_id, reason):
+        crawl_journal.record(pkg_name, CrawlJournal.RETRYING, device_id, reason)
+        return False
+
+    if ret:
+        app_data['sha256'] = record['sha256']
+        app_data['md5'] = record['md5']
+        app_data['apk_size'] = record['size']
+        app_data['version_code'] = record['version_code']
+        app_data['path_blob'] = record['path']
+        app_data['apk_files'] = record['files']
+    else:
+        app_data['path_apk'] = None
+        app_data['failure'] = reason
+        app_data['attempts'] = retry_scheduler.get_attempts(pkg_name)
+
+    # time spent in each stage of the crawl of the package
+    app_data['crawl_timings'] = stage_timer.pop_package_timings(pkg_name)
+
+    database_connector.insert_analysis_apk(pkg_name, app_data)
+
+    if ret:
+        crawl_journal.record(pkg_name, CrawlJournal.PULLED, device_id)
+        # the document exists, the benchmark can start now
+        if benchmark_worker.is_enabled():
+            benchmark_worker.submit(pkg_name, app_data['path_apk'])
+    else:
+        crawl_journal.record(pkg_name, CrawlJournal.FAILED, device_id, reason)
+
+    return ret
+
+def finish_package(pkg_name: str, device_id: str, installed: tuple) -> bool:
+    '''
+    Second stage of the crawl of an application, pull the
+    apk to the host, uninstall it and store the results in
+    the database, this runs while the next application is
+    installed in the same device.
+
+    :param installed: return value from install_package, None if it failed.
+    :return: True if the apk was downloaded, raises DeviceFailure if it failed because of the device.
+    '''
+    global adbutilities
+    global crawl_journal
+    global apk_store
+    global stage_timer
+    global retry_scheduler
+
+    if installed is None:
+        if not retry_scheduler.schedule(pkg_name, device_id, CrawlFailure.EXCEPTION):
+            crawl_journal.record(pkg_name, CrawlJournal.FAILED, device_id, CrawlFailure.EXCEPTION)
+            stage_timer.pop_package_timings(pkg_name)
+        return False
+
+    app_data, apk_paths, record, reason = installed
+
+    if apk_paths is not None:
+        print(f"Download apk from emulator {device_id}")
+        record = adbutilities.retrieve_and_uninstall_apk(pkg_name, apk_paths, apk_store, device_id,
+                                                         app_data['google_meta_data'].get('version'))
+        reason = CrawlFailure.PULL_ERROR
+
+    ret = save_package_result(pkg_name, device_id, app_data, record, reason)
+
+    # only these failures count for disabling the device
+    if not ret and CrawlFailure.is_device_failure(reason):
+        raise DeviceFailure(reason)
+
+    return ret
+
+def finish_packages_bulk(batch: list, device_id: str) -> dict:
+    '''
+    Finish a batch of applications installed in the same
+    device, all of them are pulled in a single stream.
+
+    :param batch: list of (pkg_name, installed, error) from the device pool.
+    :return: dictionary package name -> True if the apk was downloaded, False if it failed,
+             or DeviceFailure if it failed because of the device.
+    '''
+    global adbutilities
+    global crawl_journal
+    global apk_store
+    global stage_timer
+    global retry_scheduler
 
-    adbutilities.download_apks_from_emulator(pkg_names, path_for_apks)
+    results = dict()
+    to_export = dict()
+    versions = dict()
+
+    for pkg_name, installed, error in batch:
+        if installed is None:
+            if not retry_scheduler.schedule(pkg_name, device_id, CrawlFailure.EXCEPTION):
+                crawl_journal.record(pkg_name, CrawlJournal.FAILED, device_id, CrawlFailure.EXCEPTION)
+                stage_timer.pop_package_timings(pkg_name)
+            results[pkg_name] = False
+            continue
+
+        app_data, apk_paths, record, reason = installed
+
+        if apk_paths is None:
+            results[pkg_name] = save_package_result(pkg_name, device_id, app_data, record, reason)
+            if not results[pkg_name] and CrawlFailure.is_device_failure(reason):
+                results[pkg_name] = DeviceFailure(reason)
+        else:
+            to_export[pkg_name] = apk_paths
+            versions[pkg_name] = app_data['google_meta_data'].get('version')
+
+    if len(to_export) == 0:
+        return results
+
+    records = adbutilities.export_apks_bulk(to_export, apk_store, device_id, versions)
+
+    for pkg_name, installed, error in batch:
+        if pkg_name in to_export:
+            results[pkg_name] = save_package_result(pkg_name, device_id, installed[0],
+                                                    records.get(pkg_name), CrawlFailure.PULL_ERROR)
+            if not results[pkg_name]:
+                results[pkg_name] = DeviceFailure(CrawlFailure.PULL_ERROR)
+
+    return results
+
+def export_crawl_timings():
+    '''
+    Write the summary of the time spent in each stage,
+    to know if the bottleneck is the scrapper, the UI of
+    the store or the pulls through adb.
+    '''
+    global stage_timer
+
+    stage_timer.write_summary(CRAWL_TIMINGS_JSON)
+    stage_timer.write_prometheus(CRAWL_TIMINGS_PROMETHEUS)
+
+def crawl_packages(packages_data: pd.DataFrame, device_pool: DevicePool):
+    '''
+    Crawl a chunk of applications with the devices of the
+    pool, the packages already crawled are skipped.
+    '''
+    global database_connector
+    global crawl_journal
+    global retry_scheduler
+
+    # packages completed in a previous run are skipped
+    # without going to the database.
+    pending_data = packages_data[~packages_data['pkg_name'].map(crawl_journal.is_completed)]
+
+    # one query to know which packages were already crawled
+    crawled_packages = database_connector.retrieve_existing_packages(pending_data['pkg_name'])
+    logger.info("%d packages already crawled" % (len(packages_data) - len(pending_data) + len(crawled_packages)))
+
+    pending_data = pending_data[~pending_data['pkg_name'].isin(crawled_packages)]
+
+    # next time they will be skipped by the journal
+    for pkg_name in crawled_packages:
+        crawl_journal.record(pkg_name, CrawlJournal.IN_DATABASE)
+
+    if len(pending_data) == 0:
+        return
+
+    rows_by_package = dict()
+    for _, app_row in pending_data.iterrows():
+        rows_by_package[app_row['pkg_name']] = app_row
+
+    metadata_by_package = obtain_meta_inf_from_pkg_names(list(rows_by_package.keys()))
+
+    install_job = lambda pkg_name, device_id: install_package(rows_by_package[pkg_name], device_id,
+                                                              metadata_by_package.get(pkg_name))
+
+    # the packages with transient failures are crawled
+    # again once their backoff expires
+    packages_to_crawl = list(rows_by_package.keys())
+    while len(packages_to_crawl) > 0:
+        if BULK_EXPORT_BATCH_SIZE > 0:
+            device_pool.run_batched(packages_to_crawl, install_job,
+                                    finish_packages_bulk, BULK_EXPORT_BATCH_SIZE)
+        else:
+            device_pool.run_pipelined(packages_to_crawl, install_job, finish_package)
+
+        export_crawl_timings()
+
+        packages_to_crawl = retry_scheduler.pop_due()
+
+def load_jobs_from_csv():
+    '''
+    Load the CSV in the jobs collection, the position of
+    each application in the CSV is kept, so the jobs are
+    claimed in the same order.
+    '''
+    global database_connector
+
+    job_queue = CrawlJobQueue(database_connector)
+
+    position = 0
+    inserted = 0
+    for packages_data in read_apps_information_from_csv():
+        # through JSON to have python types instead of numpy ones
+        rows = json.loads(packages_data.to_json(orient='records'))
+        jobs = list()
+        for row in rows:
+            jobs.append({'package': row['pkg_name'], 'position': position, 'data': row})
+            position += 1
+        inserted += job_queue.load(jobs)
+
+    logger.info("Loaded %d new jobs from %d applications" % (inserted, position))
+
+def crawl_from_job_queue(device_pool: DevicePool):
+    '''
+    Claim jobs from the jobs collection and crawl them until
+    there are no jobs left, the result of each package is
+    taken from the journal.
+    '''
+    global database_connector
+    global crawl_journal
+
+    job_queue = CrawlJobQueue(database_connector)
+    job_queue.start()
+
+    try:
+        while True:
+            if len(device_pool.get_enabled_device_ids()) == 0:
+                logger.error("No devices left to crawl the jobs")
+                break
+
+            jobs = job_queue.claim(JOBS_CLAIM_SIZE)
+            if len(jobs) == 0:
+                break
+
+            crawl_packages(pd.DataFrame([job['data'] for job in jobs]), device_pool)
+
+            for job in jobs:
+                record = crawl_journal.get_record(job['package'])
+                state = record['state'] if record is not None else None
+
+                if state in [CrawlJournal.PULLED, CrawlJournal.IN_DATABASE]:
+                    job_queue.complete(job['package'], True)
+                elif state == CrawlJournal.FAILED:
+                    job_queue.complete(job['package'], False, record['reason'])
+                else:
+                    job_queue.release(job['package'])
+    finally:
+        job_queue.stop()
+
+    logger.info("State of the jobs: %s" % (str(job_queue.get_counts())))
 
 def main():
     '''
     Main function of the script
     '''
     global database_connector
+    global adbutilities
+    global google_meta_inf
+    global crawl_journal
+    global emulator_lifecycle
+    global retry_scheduler
+    global benchmark_worker
 
     database_connector.config()
 
-    packages_data = read_apps_information_from_csv()
-
-    for i in range(0,500,10):
-        print(f"Analyzing from {i} to {i+9}")
-        for j in range(0,10):
-            index = i+j
-            pkg_name = packages_data['pkg_name'][index]
-
-            found = database_connector.retrieve_analysis_apk(pkg_name)
-            
-            if found is not None:
-                continue
-
-            app_name = packages_data['app_name'][index]
-            category = packages_data['category'][index]
-            downloads = int(packages_data['downloads'][index])
-            ratings = int(packages_data['ratings'][index])
-            average_rating = float(packages_data['average_rating'][index])
-            price = str(packages_data['price'][index])
-            growth_30_days = float(packages_data['growth_30_days'][index])
-            growth_60_days = float(packages_data['growth_60_days'][index])
-
-            print("Obtaining metadata from google play")
-            data_from_google = obtain_meta_inf_from_pkg_name(pkg_name)
-
-            path_where_apk_should_be = "%s/%s/base.apk" % (path_for_apks, pkg_name)
-
-            app_data = {
-                    'app_name':app_name,
-                    'category':category,
-                    'downloads':downloads,
-                    'ratings':ratings,
-                    'average_rating':average_rating,
-                    'price':price,
-                    'growth_30_days':growth_30_days,
-                    'growth_60_dats':growth_60_days,
-                    'google_meta_data':data_from_google,
-                    'path_apk':path_where_apk_should_be
-                }
-            
-            print("Download apk from emulator")
-            ret = adbutilities.download_apks_from_emulator(pkg_name, path_for_apks)
-
-            if not ret:
-                app_data['path_apk'] = None
-            
-            database_connector.insert_analysis_apk(pkg_name, app_data)
+    if "--load-jobs" in sys.argv:
+        load_jobs_from_csv()
+        return
+
+    google_meta_inf.config()
+    emulator_lifecycle.config()
+    benchmark_worker.config()
+
+    # the APKs are benchmarked while the crawl goes on
+    if benchmark_worker.is_enabled():
+        benchmark_worker.start()
+
+    # boot the warm pool of emulators from the snapshot,
+    # without a pool the connected devices are used.
+    if emulator_lifecycle.pool_size > 0:
+        devices = emulator_lifecycle.run({})["devices"]
+        logger.info("%d emulators ready: %s" % (len(devices), ", ".join(devices)))
+        adbutilities.emulator_lifecycle = emulator_lifecycle
+    elif emulator_lifecycle.is_rollback_enabled():
+        # the snapshot is loaded in the emulators connected to adb
+        logger.warning("Rollback with POOL_SIZE=0, the snapshot %s is loaded in the connected devices, "
+                       "they must be emulators with that snapshot" % (emulator_lifecycle.snapshot))
+        adbutilities.emulator_lifecycle = emulator_lifecycle
+
+    # every ready emulator takes the next package as soon
+    # as it finishes installing the previous one, the pull
+    # and uninstall of one package overlaps with the install
+    # of the next one.
+    device_pool = DevicePool(adbutilities)
+    # retries go, when possible, to a device where they did not fail
+    device_pool.avoid_device = retry_scheduler.has_failed_on
+
+    if "--jobs" in sys.argv:
+        crawl_from_job_queue(device_pool)
+    else:
+        for packages_data in read_apps_information_from_csv():
+            crawl_packages(packages_data, device_pool)
+
+    if benchmark_worker.is_enabled():
+        logger.info("Waiting for the benchmarks")
+        benchmark_worker.stop()
+
+    logger.info("State of the crawl: %s" % (str(crawl_journal.get_counts())))
+
+    export_crawl_timings()
+    for stage, summary in stage_timer.get_summary().items():
+        logger.info("Time of stage %s: %s" % (stage, str(summary)))
+
+    # latencies of the UI steps, used to tune the timeouts
+    for step, histogram in adbutilities.get_step_latencies().items():
+        logger.info("Latency of step %s: %s" % (step, str(histogram)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Fixtures shared by the tests, the crawler runs against
+the fake adb server and the fake Google Play.
+'''
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tools.fake_adb_server import FakeAdbServer
+from tools.fake_play_store import FakePlayStore
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    '''
+    The tools write debug.log in the working directory.
+    '''
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def adb_server():
+    '''
+    Factory of fake adb servers on a free port, without
+    failures unless they are given, stopped at the end.
+    '''
+    servers = list()
+
+    def create(number_of_devices: int = 2, failure_rates: dict = None, time_scale: float = 0.01):
+        rates = {name: 0.0 for name in FakeAdbServer.FAILURE_RATES}
+        rates.update(failure_rates or dict())
+        server = FakeAdbServer(port=0, number_of_devices=number_of_devices,
+                               failure_rates=rates, time_scale=time_scale)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield create
+
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def play_store():
+    '''
+    Factory of fake Google Play servers on a free port.
+    '''
+    servers = list()
+
+    def create(not_found_rate: float = 0.0, error_rate: float = 0.0):
+        server = FakePlayStore(port=0, latency=0.0, not_found_rate=not_found_rate, error_rate=error_rate)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield create
+
+    for server in servers:
+        server.stop()
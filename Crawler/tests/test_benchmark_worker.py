@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+from tools.benchmark_worker import BenchmarkWorker
+
+
+LINES = [
+    "Kunai;/apks/app/classes.dex;analysis_time:1.5;cmd:kunai /apks/app/classes.dex;"
+    "real:2.0:user:1.0;sys:0.1;memory:100;cpu:99%;exit-code:0\n",
+    "Androguard;/apks/app/classes.dex;cmd:androguard /apks/app/classes.dex;"
+    "real:3.0:user:1.0;sys:0.1;memory:200;cpu:99%;exit-code:0\n",
+    "\n",
+    "Killed\n",
+    "Androguard;/apks/app/classes2.dex;cmd:androguard /apks/app/classes2.dex;"
+    "real:3.0:user:1.0;sys:0.1;memory:200;cpu:99%;exit-code:1\n",
+]
+
+
+def test_parse_results(tmp_path):
+    benchmark_worker = BenchmarkWorker(None)
+    benchmark_worker.results_path = str(tmp_path)
+    with open(os.path.join(str(tmp_path), BenchmarkWorker.FILE_SIZES), 'w') as f_:
+        f_.write("/apks/app/classes.dex:1234\n")
+
+    benchmark = benchmark_worker.parse_results(LINES)
+
+    assert benchmark == {
+        'classes_dex': {
+            'Kunai': {'analysis_time': 1.5, 'real_time': 2.0, 'user_time': 1.0, 'sys_time': 0.1,
+                      'memory': 100, 'exit_code': 0, 'file_size': 1234},
+            'Androguard': {'analysis_time': 0.0, 'real_time': 3.0, 'user_time': 1.0, 'sys_time': 0.1,
+                           'memory': 200, 'exit_code': 0, 'file_size': 1234},
+        },
+        # the size is not in file_sizes.csv
+        'classes2_dex': {
+            'Androguard': {'analysis_time': 0.0, 'real_time': 3.0, 'user_time': 1.0, 'sys_time': 0.1,
+                           'memory': 200, 'exit_code': 1, 'file_size': None},
+        }
+    }
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Bulk writes of DatabaseConnector against an in-memory
+collection, it applies the UpdateOne requests as MongoDB
+does ($set with dotted keys, $setOnInsert and upsert).
+'''
+
+import copy
+from types import SimpleNamespace
+
+import pytest
+import pymongo
+import pymongo.errors
+
+from database_connector import DatabaseConnector
+
+
+class FakeCollection(object):
+
+    def __init__(self, name: str, key: str) -> None:
+        '''
+        :param key: field with a unique index.
+        '''
+        self.name = name
+        self.key = key
+        self.documents = dict()
+        # keys inserted by other writer during the next upsert
+        self.racing = set()
+        # keys whose writes fail with other error than a duplicate key
+        self.failing = set()
+        self.bulk_writes = list()
+
+    def find_one(self, query: dict) -> dict:
+        document = self.documents.get(query[self.key])
+        return copy.deepcopy(document)
+
+    def _set(self, document: dict, values: dict) -> None:
+        for path, value in values.items():
+            fields = path.split(".")
+            for field in fields[:-1]:
+                document = document.setdefault(field, dict())
+            document[fields[-1]] = copy.deepcopy(value)
+
+    def bulk_write(self, requests: list, ordered: bool = True):
+        assert not ordered
+        self.bulk_writes.append(len(requests))
+
+        matched = 0
+        upserted = 0
+        errors = list()
+
+        for index, request in enumerate(requests):
+            key = request._filter[self.key]
+
+            if key in self.failing:
+                errors.append({"index": index, "code": 2, "errmsg": "bad value"})
+                continue
+
+            if key in self.racing and key not in self.documents:
+                self.racing.discard(key)
+                self.documents[key] = {self.key: key, "analysis": {"other": True}}
+                errors.append({"index": index, "code": DatabaseConnector.DUPLICATE_KEY_ERROR,
+                               "errmsg": "E11000 duplicate key error"})
+                continue
+
+            document = self.documents.get(key)
+            if document is None:
+                if not request._upsert:
+                    continue
+                document = {self.key: key}
+                self._set(document, request._doc.get("$setOnInsert", dict()))
+                self.documents[key] = document
+                upserted += 1
+            else:
+                matched += 1
+
+            self._set(document, request._doc.get("$set", dict()))
+
+        if len(errors) > 0:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors, "writeConcernErrors": [],
+                                                 "nMatched": matched, "nUpserted": upserted})
+
+        return SimpleNamespace(matched_count=matched, upserted_count=upserted)
+
+
+@pytest.fixture
+def database_connector():
+    database_connector = DatabaseConnector()
+    database_connector.collection = FakeCollection("APKs", "package")
+    database_connector.malware_collection = FakeCollection("MALWARE", "md5")
+    return database_connector
+
+
+def test_insert_analysis_apks(database_connector):
+    collection = database_connector.collection
+    analyses = (("com.fake.app%d" % (i), {"benchmark": {"classes_dex": i}}) for i in range(5))
+
+    assert database_connector.insert_analysis_apks(analyses, chunk_size=2) == 5
+    assert collection.bulk_writes == [2, 2, 1]
+    assert collection.find_one({"package": "com.fake.app3"}) == {
+        "package": "com.fake.app3", "analysis": {"benchmark": {"classes_dex": 3}}}
+
+    # the documents that exist are replaced, not duplicated
+    analyses = (("com.fake.app%d" % (i), {"benchmark": {"classes_dex": i * 10}}) for i in range(3, 7))
+    assert database_connector.insert_analysis_apks(analyses) == 4
+    assert len(collection.documents) == 7
+    assert collection.find_one({"package": "com.fake.app3"})["analysis"] == {"benchmark": {"classes_dex": 30}}
+
+
+def test_update_analysis_apks(database_connector):
+    collection = database_connector.collection
+    database_connector.insert_analysis_apks([("com.fake.app0", {"permissions": ["INTERNET"]}),
+                                             ("com.fake.app1", {"permissions": []})])
+
+    updates = [("com.fake.app0", {"benchmark": {"classes_dex": 1}}),
+               ("com.fake.app1", {"benchmark": {"classes_dex": 2}}),
+               ("com.fake.missing", {"benchmark": {"classes_dex": 3}})]
+
+    # only the packages found are counted, no document is created
+    assert database_connector.update_analysis_apks(iter(updates)) == 2
+    assert "com.fake.missing" not in collection.documents
+    # the other fields of the analysis are kept
+    assert collection.find_one({"package": "com.fake.app0"})["analysis"] == {
+        "permissions": ["INTERNET"], "benchmark": {"classes_dex": 1}}
+
+
+def test_insert_malware_analysis_apks(database_connector):
+    collection = database_connector.malware_collection
+    analyses = [("md5-%d" % (i), "family", {"benchmark": {}}) for i in range(3)]
+
+    assert database_connector.insert_malware_analysis_apks(analyses) == 3
+    assert collection.find_one({"md5": "md5-1"}) == {"md5": "md5-1", "malware_family": "family",
+                                                     "analysis": {"benchmark": {}}}
+
+
+def test_bulk_write_duplicate_key(database_connector):
+    collection = database_connector.collection
+    collection.racing = {"com.fake.app1", "com.fake.app2"}
+    analyses = [("com.fake.app%d" % (i), {"benchmark": {"classes_dex": i}}) for i in range(4)]
+
+    # the upserts that lost the race update the inserted document
+    assert database_connector.insert_analysis_apks(analyses) == 4
+    assert collection.bulk_writes == [4, 2]
+    assert len(collection.documents) == 4
+    assert collection.find_one({"package": "com.fake.app1"})["analysis"] == {"benchmark": {"classes_dex": 1}}
+
+
+def test_bulk_write_other_errors(database_connector):
+    collection = database_connector.collection
+    collection.racing = {"com.fake.app1"}
+    collection.failing = {"com.fake.app2"}
+    analyses = [("com.fake.app%d" % (i), {"benchmark": {}}) for i in range(4)]
+
+    with pytest.raises(pymongo.errors.BulkWriteError):
+        database_connector.insert_analysis_apks(analyses)
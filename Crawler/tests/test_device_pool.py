@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from tools.apk_store import ApkStore
+from tools.device_pool import DevicePool, DeviceFailure
+from tools.emulator_manager import AdbUtilities
+
+
+PACKAGE_NAMES = ["com.fake.app%d" % (i) for i in range(6)]
+
+
+def run_pipelined(server, apk_store: ApkStore) -> tuple:
+    adbutilities = AdbUtilities(port=server.server_address[1])
+
+    def install_job(pkg_name, device_id):
+        return adbutilities.install_apk_from_googleplay(pkg_name, device_id)
+
+    def finish_job(pkg_name, device_id, apk_paths):
+        if apk_paths is None:
+            return None
+        record = adbutilities.retrieve_and_uninstall_apk(pkg_name, apk_paths, apk_store, device_id)
+        if record is None:
+            raise DeviceFailure("pull_error")
+        return record
+
+    device_pool = DevicePool(adbutilities)
+    try:
+        results = device_pool.run_pipelined(PACKAGE_NAMES, install_job, finish_job)
+    finally:
+        adbutilities.close_sessions()
+
+    return (device_pool, results)
+
+
+def test_run_pipelined_stores_every_package(adb_server, tmp_path):
+    server = adb_server()
+    apk_store = ApkStore(str(tmp_path / "store"))
+
+    device_pool, results = run_pipelined(server, apk_store)
+
+    assert sorted(results.keys()) == sorted(PACKAGE_NAMES)
+    assert sorted(device_pool.get_enabled_device_ids()) == ["emulator-5554", "emulator-5556"]
+
+    for pkg_name in PACKAGE_NAMES:
+        record = results[pkg_name]
+        assert record is not None
+        assert record == apk_store.get_record(pkg_name)
+
+        # the split apks are pulled together with base.apk
+        paths = server.get_apk_paths(pkg_name)
+        assert sorted(file['name'] for file in record['files']) == sorted(path.split('/')[-1] for path in paths)
+
+        for path in paths:
+            file = [file for file in record['files'] if file['name'] == path.split('/')[-1]][0]
+            content = server.get_file_content(path)
+            assert file['sha256'] == hashlib.sha256(content).hexdigest()
+            assert file['size'] == len(content)
+            with open(file['path'], 'rb') as f_:
+                assert f_.read() == content
+
+    # at least one of the packages has a split apk
+    assert any(len(results[pkg_name]['files']) > 1 for pkg_name in PACKAGE_NAMES)
+
+    for device in server.devices.values():
+        assert device.installed == dict()
+
+
+def test_run_pipelined_pull_error(adb_server, tmp_path):
+    server = adb_server(number_of_devices=1, failure_rates={"pull_error": 1.0})
+    apk_store = ApkStore(str(tmp_path / "store"))
+
+    device_pool, results = run_pipelined(server, apk_store)
+
+    assert sorted(results.keys()) == sorted(PACKAGE_NAMES)
+    for pkg_name in PACKAGE_NAMES:
+        assert results[pkg_name] is None
+        assert apk_store.get_record(pkg_name) is None
+
+    # the packages are uninstalled even if they could not be pulled
+    for device in server.devices.values():
+        assert device.installed == dict()
+
+    # a failure of the device, it leaves the pool
+    assert device_pool.get_enabled_device_ids() == []
+
+
+def test_run_pipelined_incompatible_device(adb_server, tmp_path):
+    server = adb_server(number_of_devices=1, failure_rates={"incompatible": 1.0})
+    apk_store = ApkStore(str(tmp_path / "store"))
+
+    device_pool, results = run_pipelined(server, apk_store)
+
+    assert all(results[pkg_name] is None for pkg_name in PACKAGE_NAMES)
+    # the packages fail by themselves, the device stays in the pool
+    assert device_pool.get_enabled_device_ids() == ["emulator-5554"]
+    assert device_pool.health["emulator-5554"].failures == len(PACKAGE_NAMES)
+    assert device_pool.health["emulator-5554"].consecutive_failures == 0
+
+
+def test_run_pipelined_error_before_install(adb_server, tmp_path):
+    server = adb_server(number_of_devices=1)
+    adbutilities = AdbUtilities(port=server.server_address[1])
+    needs_rollback = adbutilities.needs_rollback
+
+    def failing_needs_rollback(device_id):
+        if adbutilities.failing:
+            adbutilities.failing = False
+            raise RuntimeError("device offline")
+        return needs_rollback(device_id)
+
+    adbutilities.failing = True
+    adbutilities.needs_rollback = failing_needs_rollback
+
+    device_pool = DevicePool(adbutilities)
+    results = device_pool.run_pipelined(PACKAGE_NAMES, lambda pkg_name, device_id: pkg_name,
+                                        lambda pkg_name, device_id, installed: installed)
+    adbutilities.close_sessions()
+
+    # the package is not lost and the worker goes on with the rest
+    assert results == dict({PACKAGE_NAMES[0]: None}, **{pkg_name: pkg_name for pkg_name in PACKAGE_NAMES[1:]})
+    assert device_pool.health["emulator-5554"].failures == 1
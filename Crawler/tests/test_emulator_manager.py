@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from tools.apk_store import ApkStore, ExecOutStream
+from tools.emulator_manager import AdbUtilities
+from tools.emulator_lifecycle import EmulatorLifecycle
+
+
+PACKAGE_NAMES = ["com.fake.app%d" % (i) for i in range(4)]
+DEVICE_ID = "emulator-5554"
+
+
+def install_packages(adbutilities: AdbUtilities) -> dict:
+    packages = dict()
+    for pkg_name in PACKAGE_NAMES:
+        packages[pkg_name] = adbutilities.install_apk_from_googleplay(pkg_name, DEVICE_ID)
+        assert packages[pkg_name] is not None
+    return packages
+
+
+def test_export_apks_bulk(adb_server, tmp_path):
+    server = adb_server(number_of_devices=1)
+    adbutilities = AdbUtilities(port=server.server_address[1])
+    apk_store = ApkStore(str(tmp_path / "store"))
+
+    packages = install_packages(adbutilities)
+    records = adbutilities.export_apks_bulk(packages, apk_store, DEVICE_ID)
+    adbutilities.close_sessions()
+
+    assert sorted(records.keys()) == PACKAGE_NAMES
+    for pkg_name, record in records.items():
+        assert len(record['files']) == len(packages[pkg_name])
+    assert server.devices[DEVICE_ID].installed == dict()
+
+
+def test_export_apks_bulk_pull_error(adb_server, tmp_path, capsys):
+    server = adb_server(number_of_devices=1, failure_rates={"pull_error": 1.0})
+    adbutilities = AdbUtilities(port=server.server_address[1])
+    apk_store = ApkStore(str(tmp_path / "store"))
+
+    packages = install_packages(adbutilities)
+    records = adbutilities.export_apks_bulk(packages, apk_store, DEVICE_ID)
+    adbutilities.close_sessions()
+
+    # the status of tar is checked, the packages that failed are not in the result
+    assert "tar exited with 1" in capsys.readouterr().out
+    assert records == dict()
+    for pkg_name in PACKAGE_NAMES:
+        assert apk_store.get_record(pkg_name) is None
+
+
+def test_export_apks_bulk_without_packages(adb_server, tmp_path):
+    server = adb_server(number_of_devices=1)
+    adbutilities = AdbUtilities(port=server.server_address[1])
+
+    assert adbutilities.export_apks_bulk(dict(), ApkStore(str(tmp_path / "store")), DEVICE_ID) == dict()
+
+
+def test_exec_out_stream_exit_code(adb_server):
+    server = adb_server(number_of_devices=1)
+    adbutilities = AdbUtilities(port=server.server_address[1])
+    device = adbutilities.client.device(DEVICE_ID)
+
+    # the status of tar, not the one of the echo after it
+    with ExecOutStream(device, "tar -C / -cf - data/app/missing.apk 2>/dev/null", exit_code=True) as stream:
+        assert stream.get_exit_code() == 1
+
+
+def test_download_apks_from_emulator(adb_server, tmp_path):
+    server = adb_server(number_of_devices=1)
+    adbutilities = AdbUtilities(port=server.server_address[1])
+
+    assert adbutilities.download_apks_from_emulator(PACKAGE_NAMES[0], str(tmp_path / "store"), DEVICE_ID)
+    adbutilities.close_sessions()
+
+    apk_store = ApkStore(str(tmp_path / "store"))
+    assert apk_store.get_record(PACKAGE_NAMES[0]) is not None
+    apk_store.close()
+
+
+def test_rollback_without_pool(adb_server):
+    server = adb_server(number_of_devices=2)
+    adbutilities = AdbUtilities(port=server.server_address[1])
+
+    emulator_lifecycle = EmulatorLifecycle(port=server.server_address[1])
+    emulator_lifecycle.rollback_every = 1
+    adbutilities.emulator_lifecycle = emulator_lifecycle
+
+    # without a pool the connected devices are used, and rolled back
+    assert adbutilities.get_ready_devices() == ["emulator-5554", "emulator-5556"]
+    assert adbutilities.is_rollback_enabled()
+
+    adbutilities.apps_since_rollback[DEVICE_ID] = 1
+    assert adbutilities.needs_rollback(DEVICE_ID)
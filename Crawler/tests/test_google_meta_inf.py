@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from tools.google_meta_inf import GoogleMetaInf
+
+
+PACKAGE_NAMES = ["com.fake.app%d" % (i) for i in range(20)]
+
+
+def create_google_meta_inf(play_store, max_retries: int) -> GoogleMetaInf:
+    '''
+    Scrapper pointed to the fake Google Play, without
+    cache and without rate limit.
+    '''
+    google_meta_inf = GoogleMetaInf()
+    google_meta_inf.config_parser["MetadataCache"] = {"PATH": ""}
+    google_meta_inf.config_parser["GoogleScrapper"] = {
+        "WAITTIME": "0",
+        "MAX_WORKERS": "4",
+        "MAX_RETRIES": str(max_retries),
+        "RETRY_BASE_DELAY": "0.01",
+        "BASE_URL": play_store.get_base_url()
+    }
+    google_meta_inf.config()
+    return google_meta_inf
+
+
+def test_run_many(play_store):
+    store = play_store()
+    google_meta_inf = create_google_meta_inf(store, 0)
+
+    outputs = google_meta_inf.run_many(PACKAGE_NAMES)
+
+    assert list(outputs.keys()) == PACKAGE_NAMES
+    for package_name, output in outputs.items():
+        assert "ERROR" not in output
+        assert output["appId"] == package_name
+        assert output["version"] == store.get_app_data(package_name)[1][2][140][0][0][0]
+        assert "screenshots" not in output
+
+
+def test_run_many_retries_transient_errors(play_store):
+    store = play_store(error_rate=0.5)
+    google_meta_inf = create_google_meta_inf(store, 20)
+
+    outputs = google_meta_inf.run_many(PACKAGE_NAMES)
+
+    for package_name, output in outputs.items():
+        assert "ERROR" not in output and "EXCEPTION" not in output
+        assert output["appId"] == package_name
+
+
+def test_run_many_transient_errors_without_retries(play_store):
+    store = play_store(error_rate=1.0)
+    google_meta_inf = create_google_meta_inf(store, 0)
+
+    outputs = google_meta_inf.run_many(PACKAGE_NAMES)
+
+    for output in outputs.values():
+        assert "EXCEPTION" in output
+        assert output.get("ERROR") != "NOT_FOUND"
+
+
+def test_run_many_not_found(play_store):
+    store = play_store(not_found_rate=1.0)
+    google_meta_inf = create_google_meta_inf(store, 3)
+
+    outputs = google_meta_inf.run_many(PACKAGE_NAMES)
+
+    for output in outputs.values():
+        assert output["ERROR"] == "NOT_FOUND"
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Content-addressed store for the APK files, each file is
+saved only once under a sharded directory named by its
+sha256 hash:
+
+    <root>/objects/ab/cd/abcd...ef.apk
+
+An index in SQLite keeps for each package the hashes
+and the version of the APK, so an APK is not downloaded
+again if the version in Google Play did not change.
+
+Applications distributed as bundles are installed as
+several files (base.apk and split_config.*.apk), all of
+them are pulled in parallel and stored.
+
+The hashes are calculated while the file is pulled from
+the device, so the file is read only once. For batches,
+the files of several packages can be read from a single
+tar stream ('exec-out tar') instead of one sync per file.
+'''
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ppadb.sync import Sync
+from ppadb.protocol import Protocol
+
+
+class HashingSync(Sync):
+    '''
+    Sync protocol from ppadb, but the pulled file is
+    written to a stream and hashed at the same time.
+    '''
+
+    def pull_to_stream(self, src: str, stream, hashers: list) -> int:
+        '''
+        :param src: path of the file in the device.
+        :param stream: file object where to write the data.
+        :param hashers: hashlib objects updated with the data.
+        :return: number of bytes written.
+        '''
+        size = 0
+
+        # RECV
+        self._send_str(Protocol.RECV, src)
+
+        # DATA
+        while True:
+            flag = self.connection.read(4).decode('utf-8')
+
+            if flag == Protocol.DATA:
+                data = self._read_data()
+                stream.write(data)
+                for hasher in hashers:
+                    hasher.update(data)
+                size += len(data)
+            elif flag == Protocol.DONE:
+                self.connection.read(4)
+                return size
+            elif flag == Protocol.FAIL:
+                raise IOError("Error pulling %s: %s" % (src, self._read_data().decode('utf-8')))
+            else:
+                raise IOError("Unexpected flag pulling %s: %s" % (src, flag))
+
+
+class ExecOutStream(object):
+    '''
+    File object over an 'exec:' connection of ppadb, the
+    output of the command is read as it arrives.
+
+    'exec:' has no separate stderr and no exit status, so
+    the command must send its stderr away, and with
+    exit_code the status is echoed after the output and
+    read with get_exit_code once the output is consumed.
+    '''
+
+    EXIT_MARKER = b"\nKUNAI_EXIT_CODE:"
+    # bytes kept from the end of the stream to find the status
+    TAIL_SIZE = 4096
+
+    def __init__(self, device, cmd: str, exit_code: bool = False) -> None:
+        if exit_code:
+            # $? is saved before the echo changes it
+            cmd = "%s; rc=$?; echo; echo KUNAI_EXIT_CODE:$rc" % (cmd)
+
+        self.tail = b""
+        self.connection = device.create_connection()
+        self.connection.send("exec:%s" % (cmd))
+
+    def read(self, size: int = 65536) -> bytes:
+        data = self.connection.read(size)
+        self.tail = (self.tail + data)[-ExecOutStream.TAIL_SIZE:]
+        return data
+
+    def get_exit_code(self) -> int:
+        '''
+        Read the rest of the stream and return the exit status
+        echoed by the command, None if it was not found.
+        '''
+        while self.read():
+            pass
+
+        index = self.tail.rfind(ExecOutStream.EXIT_MARKER)
+        if index == -1:
+            return None
+
+        try:
+            return int(self.tail[index + len(ExecOutStream.EXIT_MARKER):].strip())
+        except ValueError:
+            return None
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class ApkStore(object):
+
+    NAME = "ApkStore"
+    VERSION = "0.1"
+
+    # Google Play returns this when there is one APK per device
+    UNKNOWN_VERSIONS = [None, "", "Varies with device"]
+
+    # files of one package pulled at the same time
+    MAX_PARALLEL_PULLS = 4
+    # bytes read at once from a tar stream
+    TAR_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, root: str) -> None:
+        '''
+        :param root: directory of the store, created if it does not exist.
+        '''
+        self.root = root
+        self.objects_path = os.path.join(root, "objects")
+        self.tmp_path = os.path.join(root, "tmp")
+        os.makedirs(self.objects_path, exist_ok=True)
+        os.makedirs(self.tmp_path, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS apks (
+                package TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                md5 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                version TEXT,
+                version_code INTEGER,
+                stored_at REAL NOT NULL
+            )''')
+        self.connection.execute("CREATE INDEX IF NOT EXISTS apks_sha256 ON apks (sha256)")
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS apk_files (
+                package TEXT NOT NULL,
+                name TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                md5 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (package, name)
+            )''')
+        self.connection.commit()
+
+    def get_blob_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_path, sha256[0:2], sha256[2:4], "%s.apk" % (sha256))
+
+    def get_package_path(self, pkg_name: str, name: str = "base.apk") -> str:
+        '''
+        Path with the old layout <root>/<package>/base.apk,
+        it is a hard link to the blob, kept for the scripts
+        that run the benchmarks.
+        '''
+        return os.path.join(self.root, pkg_name, name)
+
+    def get_record(self, pkg_name: str) -> dict:
+        '''
+        :return: last APK stored for the package, None if there is none.
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT package, sha256, md5, size, version, version_code, stored_at FROM apks WHERE package = ?",
+                (pkg_name,)).fetchone()
+            files = self.connection.execute(
+                "SELECT name, sha256, md5, size FROM apk_files WHERE package = ? ORDER BY name",
+                (pkg_name,)).fetchall()
+
+        if row is None:
+            return None
+
+        return self._row_to_record(row, [self._file_row_to_dict(file_row) for file_row in files])
+
+    def _file_row_to_dict(self, row: tuple) -> dict:
+        return {
+            'name': row[0],
+            'sha256': row[1],
+            'md5': row[2],
+            'size': row[3],
+            'path': self.get_blob_path(row[1])
+        }
+
+    def _row_to_record(self, row: tuple, files: list) -> dict:
+        '''
+        The hashes and size of the record are the ones from
+        base.apk, the information of every file (base.apk
+        included) is in 'files'.
+        '''
+        return {
+            'package': row[0],
+            'sha256': row[1],
+            'md5': row[2],
+            'size': row[3],
+            'version': row[4],
+            'version_code': row[5],
+            'stored_at': row[6],
+            'path': self.get_blob_path(row[1]),
+            'files': files
+        }
+
+    def has_version(self, pkg_name: str, version: str) -> bool:
+        '''
+        Check if the APK stored for the package has the
+        given version (as shown by Google Play), unknown
+        versions never match.
+        '''
+        if version in ApkStore.UNKNOWN_VERSIONS:
+            return False
+
+        record = self.get_record(pkg_name)
+
+        if record is None or record['version'] != version:
+            return False
+
+        return all(os.path.exists(file['path']) for file in record['files'])
+
+    def _link_package(self, pkg_name: str, name: str, blob_path: str) -> None:
+        package_path = self.get_package_path(pkg_name, name)
+        os.makedirs(os.path.dirname(package_path), exist_ok=True)
+
+        if os.path.exists(package_path):
+            os.remove(package_path)
+
+        try:
+            os.link(blob_path, package_path)
+        except OSError:
+            shutil.copyfile(blob_path, package_path)
+
+    def _unlink_stale_files(self, pkg_name: str, names: list) -> None:
+        '''
+        Remove from <root>/<package>/ the links of the APKs
+        that are not part of the last version stored (e.g.
+        splits of the previous version), so the directory
+        has the same files as apk_files.
+        '''
+        package_dir = os.path.dirname(self.get_package_path(pkg_name))
+
+        if not os.path.isdir(package_dir):
+            return
+
+        for name in os.listdir(package_dir):
+            if name.endswith(".apk") and name not in names:
+                os.remove(os.path.join(package_dir, name))
+
+    def _write_blob(self, pkg_name: str, name: str, write_data) -> dict:
+        '''
+        Write one file into the store, hashing it while it is
+        written, the file is written to a temporary file and
+        moved to its place once complete, if the content is
+        already in the store the new copy is discarded.
+
+        :param pkg_name: package name.
+        :param name: name of the file (base.apk, split_config.*.apk).
+        :param write_data: callable write_data(stream, hashers) that writes the file and returns its size.
+        :return: dictionary with name, hashes, size and path of the blob.
+        '''
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5()
+
+        fd, tmp_file = tempfile.mkstemp(dir=self.tmp_path, suffix=".apk")
+
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                size = write_data(stream, [sha256, md5])
+
+            blob_path = self.get_blob_path(sha256.hexdigest())
+
+            if os.path.exists(blob_path):
+                print(f"Content of {pkg_name}/{name} already in the store")
+                os.remove(tmp_file)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(tmp_file, blob_path)
+        except Exception as e:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise e
+
+        self._link_package(pkg_name, name, blob_path)
+
+        return {
+            'name': name,
+            'sha256': sha256.hexdigest(),
+            'md5': md5.hexdigest(),
+            'size': size,
+            'path': blob_path
+        }
+
+    def _store_file(self, device, path_on_device: str, pkg_name: str) -> dict:
+        '''
+        Pull one file from the device into the store.
+        '''
+        def write_data(stream, hashers):
+            sync_conn = device.sync()
+            with sync_conn:
+                return HashingSync(sync_conn).pull_to_stream(path_on_device, stream, hashers)
+
+        return self._write_blob(pkg_name, os.path.basename(path_on_device), write_data)
+
+    def _index_package(self, pkg_name: str, files: list, version: str, version_code: int) -> dict:
+        '''
+        Save in the index the files stored for a package.
+
+        :return: record of the stored APK.
+        '''
+        files.sort(key=lambda file: file['name'])
+
+        base = files[0]
+        for file in files:
+            if file['name'] == "base.apk":
+                base = file
+
+        record = (pkg_name, base['sha256'], base['md5'], base['size'], version, version_code, time.time())
+
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO apks VALUES (?, ?, ?, ?, ?, ?, ?)", record)
+            self.connection.execute("DELETE FROM apk_files WHERE package = ?", (pkg_name,))
+            self.connection.executemany("INSERT INTO apk_files VALUES (?, ?, ?, ?, ?)",
+                                        [(pkg_name, file['name'], file['sha256'], file['md5'], file['size'])
+                                         for file in files])
+            self.connection.commit()
+
+        self._unlink_stale_files(pkg_name, [file['name'] for file in files])
+
+        return self._row_to_record(record, files)
+
+    def store_from_device(self, device, paths_on_device: list, pkg_name: str,
+                          version: str = None, version_code: int = None) -> dict:
+        '''
+        Pull all the files of a package (base.apk and the
+        split APKs) into the store, the files are pulled in
+        parallel, each one through its own sync connection.
+
+        :param device: ppadb device.
+        :param paths_on_device: paths of the files in the device, as returned by 'pm path'.
+        :param pkg_name: package name.
+        :param version: version from Google Play.
+        :param version_code: versionCode from the package manager.
+        :return: record of the stored APK.
+        '''
+        with ThreadPoolExecutor(max_workers=min(ApkStore.MAX_PARALLEL_PULLS, len(paths_on_device))) as executor:
+            files = list(executor.map(lambda path: self._store_file(device, path, pkg_name), paths_on_device))
+
+        return self._index_package(pkg_name, files, version, version_code)
+
+    def store_from_tar_stream(self, stream, packages: dict, versions: dict = None, version_codes: dict = None) -> dict:
+        '''
+        Store the files of several packages from a tar stream
+        (for example 'tar -C / -cf -' running in the device), the
+        stream is read only once, each member is written and
+        hashed while it is read.
+
+        :param stream: file object with the tar stream.
+        :param packages: package name -> paths of its files in the device.
+        :param versions: package name -> version from Google Play.
+        :param version_codes: package name -> versionCode.
+        :return: package name -> record of the stored APK, only packages with all their files.
+        '''
+        versions = versions or dict()
+        version_codes = version_codes or dict()
+
+        # the members have no leading '/' (tar -C /)
+        package_of_member = dict()
+        for pkg_name, paths in packages.items():
+            for path in paths:
+                package_of_member[path.lstrip('/')] = pkg_name
+
+        files_of_package = {pkg_name: list() for pkg_name in packages.keys()}
+
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                pkg_name = package_of_member.get(member.name.lstrip('/'))
+                if pkg_name is None or not member.isfile():
+                    continue
+
+                member_stream = tar.extractfile(member)
+
+                def write_data(output, hashers):
+                    size = 0
+                    while True:
+                        data = member_stream.read(ApkStore.TAR_CHUNK_SIZE)
+                        if not data:
+                            return size
+                        output.write(data)
+                        for hasher in hashers:
+                            hasher.update(data)
+                        size += len(data)
+
+                files_of_package[pkg_name].append(
+                    self._write_blob(pkg_name, os.path.basename(member.name), write_data))
+
+        records = dict()
+        for pkg_name, files in files_of_package.items():
+            if len(files) != len(packages[pkg_name]):
+                print(f"[-] Missing files of {pkg_name} in the tar stream")
+                continue
+            records[pkg_name] = self._index_package(pkg_name, files,
+                                                    versions.get(pkg_name), version_codes.get(pkg_name))
+
+        return records
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Run the benchmark of the analysis tools on each APK as
+soon as the crawler stores it, instead of waiting for the
+crawl to finish. The crawler submits the pulled APKs to
+a local queue, the workers run the benchmark COMMAND for
+each one of them and save the results directly in the
+document of the package ('analysis.benchmark'), with the
+same format as get_analysis_information.py.
+
+The command writes the results of the tools in the
+output file, one line per run:
+
+    tool;file;analysis_time:<f>;cmd:<command> <path>;real:<f>:user:<f>;sys:<f>;memory:<d>;cpu:<d>%;exit-code:<d>
+
+and the size of the analyzed files in file_sizes.csv in
+the results path (path:size), one line per file.
+'''
+
+import os
+import sys
+import queue
+import shlex
+import threading
+import subprocess
+
+from tools.base import BaseTool
+
+# directory of benchmark_results.py, the parser shared with
+# get_analysis_information.py
+ANALYSIS_SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Analysis Scripts")
+
+
+def import_benchmark_results():
+    '''
+    Import the shared parser only when the benchmark runs, so
+    the crawler does not need it (nor scanf) otherwise.
+    '''
+    if ANALYSIS_SCRIPTS_PATH not in sys.path:
+        sys.path.append(ANALYSIS_SCRIPTS_PATH)
+
+    import benchmark_results
+    return benchmark_results
+
+
+class BenchmarkWorker(BaseTool):
+
+    NAME = "BenchmarkWorker"
+    VERSION = "0.1"
+
+    # sizes of the analyzed files (path:size), in the results path
+    FILE_SIZES = "file_sizes.csv"
+
+    def __init__(self, database_connector) -> None:
+        '''
+        :param database_connector: DatabaseConnector where the results are saved.
+        '''
+        super().__init__()
+        self.logger.info("[%s] Started tool" % (BenchmarkWorker.NAME))
+
+        self.database_connector = database_connector
+        # command with {apk} and {output}, empty disables the benchmark
+        self.command = ""
+        self.results_path = "kunai-benchmark-results/"
+        self.workers = 1
+        self.timeout = 3600
+
+        self.apks = queue.Queue()
+        self.threads = list()
+
+    def config(self) -> None:
+        if "Benchmark" not in self.config_parser:
+            return
+
+        benchmark_config = self.config_parser["Benchmark"]
+
+        self.command = benchmark_config.get("COMMAND", "").strip()
+        self.results_path = benchmark_config.get("RESULTS_PATH", self.results_path)
+        self.workers = benchmark_config.getint("WORKERS", self.workers)
+        self.timeout = benchmark_config.getfloat("TIMEOUT", self.timeout)
+
+    def is_enabled(self) -> bool:
+        return self.command != ""
+
+    def read_file_sizes(self) -> dict:
+        '''
+        Read the sizes of the analyzed files from file_sizes.csv
+        in the results path, as get_analysis_information.py does.
+
+        :return: dictionary path -> size.
+        '''
+        path = os.path.join(self.results_path, BenchmarkWorker.FILE_SIZES)
+        if not os.path.exists(path):
+            return dict()
+
+        with open(path, 'r') as f_:
+            return import_benchmark_results().read_all_paths_and_sizes(f_.readlines())
+
+    def parse_results(self, lines: list) -> dict:
+        '''
+        Parse the lines written by the benchmark command.
+
+        :return: dictionary analyzed file -> tool -> times and memory.
+        '''
+        return import_benchmark_results().extract_variables_analysis_line(lines, self.read_file_sizes())['benchmark']
+
+    def run(self, args: dict) -> dict:
+        '''
+        Run the benchmark on one APK and save the results in
+        the document of the package.
+
+        :param args: {"package_name":<package name>, "path_apk":<path of the apk>}
+        :return: results of the benchmark, or {"ERROR": ...}.
+        '''
+        package_name = args["package_name"]
+        path_apk = args["path_apk"]
+        output = os.path.join(self.results_path, "%s.csv" % (package_name))
+
+        os.makedirs(self.results_path, exist_ok=True)
+
+        command = self.command.format(apk=shlex.quote(path_apk), output=shlex.quote(output))
+        self.logger.info("[%s] Running benchmark: %s" % (BenchmarkWorker.NAME, command))
+
+        try:
+            subprocess.run(command, shell=True, timeout=self.timeout,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except subprocess.TimeoutExpired:
+            self.logger.info("[%s] Timeout running the benchmark of %s" % (BenchmarkWorker.NAME, package_name))
+            return {"ERROR": "TIMEOUT"}
+
+        if not os.path.exists(output):
+            return {"ERROR": "NO_RESULTS"}
+
+        with open(output, 'r') as f_:
+            benchmark = self.parse_results(f_.readlines())
+
+        self.database_connector.update_analysis_apk(package_name, {'benchmark': benchmark})
+        self.logger.info("[%s] Benchmark of %s saved" % (BenchmarkWorker.NAME, package_name))
+
+        return benchmark
+
+    def _worker(self) -> None:
+        while True:
+            item = self.apks.get()
+
+            if item is None:
+                self.apks.task_done()
+                return
+
+            try:
+                self.run(item)
+            except Exception as e:
+                self.logger.error("[%s] Exception running the benchmark of %s: %s" %
+                                  (BenchmarkWorker.NAME, item["package_name"], str(e)))
+            finally:
+                self.apks.task_done()
+
+    def start(self) -> None:
+        # fail now and not with the first APK
+        import_benchmark_results()
+
+        for i in range(max(1, self.workers)):
+            thread = threading.Thread(target=self._worker,
+                                      name="%s-%d" % (BenchmarkWorker.NAME, i),
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, package_name: str, path_apk: str) -> None:
+        '''
+        Queue an APK already saved in the database.
+        '''
+        self.apks.put({"package_name": package_name, "path_apk": path_apk})
+
+    def stop(self) -> None:
+        '''
+        Wait for the queued APKs and stop the workers.
+        '''
+        for _ in self.threads:
+            self.apks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = list()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Journal of the crawl, an append-only file with one JSON
+line each time a package changes its state, on start the
+file is read to know the last state of every package, so
+a restarted crawl skips the work already done.
+'''
+
+import os
+import json
+import time
+import threading
+
+
+class CrawlJournal(object):
+
+    NAME = "CrawlJournal"
+    VERSION = "0.1"
+
+    # states of a package
+    METADATA_DONE = "metadata_done"
+    INSTALLED = "installed"
+    PULLED = "pulled"
+    FAILED = "failed"
+    # failed, but it will be retried
+    RETRYING = "retrying"
+    # crawled by a previous run without journal (or by other host)
+    IN_DATABASE = "in_database"
+
+    # states where nothing else has to be done
+    COMPLETED_STATES = [PULLED, FAILED, IN_DATABASE]
+
+    def __init__(self, path: str) -> None:
+        '''
+        :param path: path of the journal file, created if it does not exist.
+        '''
+        self.path = path
+        self.lock = threading.Lock()
+        # package name -> last record of the package
+        self.last_record = dict()
+
+        self._load()
+
+        self.file = open(self.path, 'a')
+        # finish a line truncated by a crash, so the next
+        # record starts in a new line.
+        if self.file.tell() > 0:
+            with open(self.path, 'rb') as f_:
+                f_.seek(-1, os.SEEK_END)
+                if f_.read(1) != b'\n':
+                    self.file.write("\n")
+                    self.file.flush()
+
+    def _load(self) -> None:
+        '''
+        Replay the journal keeping the last record of
+        each package, a truncated last line (crash while
+        writing) is ignored.
+        '''
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r') as f_:
+            for line in f_:
+                line = line.strip()
+                if line == '':
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"[-] Ignoring corrupted line in journal: {line}")
+                    continue
+                self.last_record[record['package']] = record
+
+    def record(self, pkg_name: str, state: str, device_id: str = None, reason: str = None) -> None:
+        '''
+        Append a new state of a package to the journal.
+
+        :param pkg_name: package name.
+        :param state: one of the states of the journal.
+        :param device_id: device that processed the package.
+        :param reason: reason of the failure, if any.
+        '''
+        record = {
+            'package': pkg_name,
+            'state': state,
+            'time': time.time(),
+            'device': device_id,
+            'reason': reason
+        }
+
+        with self.lock:
+            self.last_record[pkg_name] = record
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def get_state(self, pkg_name: str) -> str:
+        '''
+        :return: last state of the package, None if it was never processed.
+        '''
+        record = self.last_record.get(pkg_name)
+        if record is None:
+            return None
+        return record['state']
+
+    def get_record(self, pkg_name: str) -> dict:
+        return self.last_record.get(pkg_name)
+
+    def is_completed(self, pkg_name: str) -> bool:
+        return self.get_state(pkg_name) in CrawlJournal.COMPLETED_STATES
+
+    def get_counts(self) -> dict:
+        '''
+        :return: dictionary state -> number of packages in that state.
+        '''
+        counts = dict()
+        with self.lock:
+            for record in self.last_record.values():
+                counts[record['state']] = counts.get(record['state'], 0) + 1
+        return counts
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
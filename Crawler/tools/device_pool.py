@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Pool of Android devices (emulators) used to crawl
+Google Play concurrently, each device has its own
+worker thread which takes the next package from a
+shared queue once the device is idle.
+
+In pipelined mode each device has two threads, one
+that drives the store (install) and one that pulls
+and uninstalls the installed packages, both connected
+by a bounded queue.
+
+In batched mode each device installs several packages
+and then finishes all of them at once (bulk export).
+
+When the emulators are rolled back to a snapshot instead
+of uninstalling the packages, the rollback is done only
+when the device is idle (all its packages finished).
+
+Only the failures of the device (exceptions of the jobs,
+DeviceFailure) disable a device, a package that fails
+by itself (not found, incompatible...) does not.
+'''
+
+import queue
+import logging
+import threading
+
+
+class DeviceFailure(Exception):
+    '''
+    Raised by the jobs (or returned as result of a package
+    by the batch jobs) when the package failed because of
+    the device: adb errors, focus lost, timeouts...
+    '''
+    pass
+
+
+class DeviceHealth(object):
+    '''
+    Health information from one of the devices of
+    the pool, used to disable a device that keeps
+    failing (emulator frozen, adb offline...).
+    '''
+
+    def __init__(self, device_id: str) -> None:
+        self.device_id = device_id
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.current_package = None
+        self.enabled = True
+
+    def is_busy(self) -> bool:
+        return self.current_package is not None
+
+    def to_dict(self) -> dict:
+        return {
+            'device_id': self.device_id,
+            'successes': self.successes,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+            'current_package': self.current_package,
+            'enabled': self.enabled
+        }
+
+    def __str__(self) -> str:
+        return "Device: %s, successes: %d, failures: %d, consecutive failures: %d, enabled: %s" % (
+            self.device_id,
+            self.successes,
+            self.failures,
+            self.consecutive_failures,
+            self.enabled
+        )
+
+
+class SequentialStep(object):
+    '''
+    Step of DevicePool.run, the job processes the whole
+    package on the device.
+    '''
+
+    def __init__(self, pool, device_id: str, results: dict, job) -> None:
+        self.pool = pool
+        self.device_id = device_id
+        self.results = results
+        self.job = job
+
+    def before(self, pkg_name: str) -> None:
+        self.pool._rollback_if_needed(self.device_id)
+
+    def process(self, pkg_name: str) -> None:
+        self.pool.logger.info("[%s] Device %s processing %s" %
+                              (DevicePool.NAME, self.device_id, pkg_name))
+        try:
+            ret = self.job(pkg_name, self.device_id)
+            self.results[pkg_name] = ret
+            self.pool._record_result(self.device_id, pkg_name, bool(ret),
+                                     None if ret else "job returned %s" % (str(ret)), device_failure=False)
+        except Exception as e:
+            self.pool.logger.error("[%s] Exception on device %s with %s: %s" %
+                                   (DevicePool.NAME, self.device_id, pkg_name, str(e)))
+            self.results[pkg_name] = None
+            self.pool._record_result(self.device_id, pkg_name, False, str(e))
+
+    def close(self) -> None:
+        pass
+
+
+class PipelinedStep(object):
+    '''
+    Step of DevicePool.run_pipelined, the package is
+    installed and queued for the finish thread of the
+    device, the bounded queue stops the installation
+    when the finish thread is behind.
+    '''
+
+    def __init__(self, pool, device_id: str, results: dict, install_job, finish_job) -> None:
+        self.pool = pool
+        self.device_id = device_id
+        self.install_job = install_job
+        self.pending = queue.Queue(maxsize=DevicePool.PIPELINE_QUEUE_SIZE)
+
+        self.finisher = threading.Thread(target=pool._finish_worker,
+                                         args=(device_id, self.pending, finish_job, results),
+                                         name="%s-%s-finish" % (DevicePool.NAME, device_id),
+                                         daemon=True)
+        self.finisher.start()
+
+    def before(self, pkg_name: str) -> None:
+        self.pool._rollback_if_needed(self.device_id, self.pending)
+        self.pool._wait_for_storage(self.device_id, self.pending)
+
+    def process(self, pkg_name: str) -> None:
+        installed, error = self.pool._install(self.install_job, pkg_name, self.device_id)
+        # blocks while the queue is full
+        self.pending.put((pkg_name, installed, error))
+
+    def close(self) -> None:
+        self.pending.put(None)
+        self.finisher.join()
+
+
+class BatchedStep(object):
+    '''
+    Step of DevicePool.run_batched, packages are installed
+    until the batch is full (or there is not enough free
+    storage) and then all of them are finished at once.
+    '''
+
+    def __init__(self, pool, device_id: str, results: dict, install_job, batch_finish_job,
+                 batch_size: int) -> None:
+        self.pool = pool
+        self.device_id = device_id
+        self.results = results
+        self.install_job = install_job
+        self.batch_finish_job = batch_finish_job
+        self.batch_size = batch_size
+        self.batch = list()
+
+    def _finish(self) -> None:
+        self.pool._finish_batch(self.device_id, self.batch, self.batch_finish_job, self.results)
+        self.batch = list()
+
+    def before(self, pkg_name: str) -> None:
+        if len(self.batch) > 0:
+            free_storage = self.pool.adbutilities.get_free_storage(self.device_id)
+            if free_storage is not None and free_storage < DevicePool.PIPELINE_MIN_FREE_STORAGE:
+                self.pool.logger.info("[%s] Device %s has %d free bytes, finishing the batch" %
+                                      (DevicePool.NAME, self.device_id, free_storage))
+                self._finish()
+
+        if len(self.batch) == 0:
+            self.pool._rollback_if_needed(self.device_id)
+
+    def process(self, pkg_name: str) -> None:
+        installed, error = self.pool._install(self.install_job, pkg_name, self.device_id)
+        self.batch.append((pkg_name, installed, error))
+
+        if len(self.batch) >= self.batch_size:
+            self._finish()
+
+    def close(self) -> None:
+        if len(self.batch) > 0:
+            self._finish()
+
+
+class DevicePool(object):
+
+    NAME = "DevicePool"
+    VERSION = "0.1"
+
+    # after this number of failures in a row, the
+    # device is removed from the pool.
+    MAX_CONSECUTIVE_FAILURES = 5
+
+    # installed packages waiting to be pulled on each device
+    PIPELINE_QUEUE_SIZE = 2
+    # free space in /data needed to install a new package
+    # while others are waiting to be pulled (bytes)
+    PIPELINE_MIN_FREE_STORAGE = 1024 * 1024 * 1024
+
+    def __init__(self, adbutilities, device_ids: list = None) -> None:
+        '''
+        :param adbutilities: AdbUtilities object connected to the adb server.
+        :param device_ids: devices to use, if None all the ready devices are used.
+        '''
+        self.logger = logging.getLogger("DevicePool")
+        self.adbutilities = adbutilities
+
+        if device_ids is None:
+            device_ids = self.adbutilities.get_ready_devices()
+
+        self.health = dict()
+        for device_id in device_ids:
+            self.health[device_id] = DeviceHealth(device_id)
+
+        self.lock = threading.Lock()
+
+        # callable avoid_device(pkg_name, device_id), True if the
+        # package should run in other device (it failed there).
+        self.avoid_device = None
+
+        self.logger.info("[%s] Pool created with devices: %s" %
+                         (DevicePool.NAME, ", ".join(self.health.keys())))
+
+    def get_device_ids(self) -> list:
+        return list(self.health.keys())
+
+    def get_enabled_device_ids(self) -> list:
+        with self.lock:
+            return [device_id for device_id, health in self.health.items() if health.enabled]
+
+    def _record_result(self, device_id: str, pkg_name: str, success: bool, error: str = None,
+                       device_failure: bool = True) -> None:
+        '''
+        Update the health of a device with the result
+        of the last package it processed.
+
+        :param device_failure: the failure was caused by the device, only
+                               these ones count for MAX_CONSECUTIVE_FAILURES.
+        '''
+        with self.lock:
+            health = self.health[device_id]
+            if health.current_package == pkg_name:
+                health.current_package = None
+            if success:
+                health.successes += 1
+                health.consecutive_failures = 0
+                return
+
+            health.failures += 1
+            health.last_error = error
+
+            if not device_failure:
+                return
+
+            health.consecutive_failures += 1
+
+            if health.consecutive_failures >= DevicePool.MAX_CONSECUTIVE_FAILURES:
+                health.enabled = False
+                self.logger.warning("[%s] Disabling device %s after %d consecutive failures" %
+                                    (DevicePool.NAME, device_id, health.consecutive_failures))
+
+    def _next_package(self, device_id: str, packages: queue.Queue) -> str:
+        '''
+        Take the next package from the queue, if the package
+        must be avoided in this device and there are more
+        packages, it is left in the queue for other device.
+        Raises queue.Empty if there are no more packages.
+        '''
+        pkg_name = packages.get_nowait()
+
+        if self.avoid_device is None or not self.avoid_device(pkg_name, device_id):
+            return pkg_name
+
+        try:
+            other_pkg_name = packages.get_nowait()
+        except queue.Empty:
+            return pkg_name
+
+        packages.put(pkg_name)
+        packages.task_done()
+        return other_pkg_name
+
+    def _rollback_if_needed(self, device_id: str, pending: queue.Queue = None) -> None:
+        '''
+        Roll back the device to the snapshot if it needs it,
+        first waiting until the installed packages have been
+        pulled.
+        '''
+        if not self.adbutilities.needs_rollback(device_id):
+            return
+
+        if pending is not None:
+            pending.join()
+
+        if not self.adbutilities.rollback_device(device_id):
+            self.logger.warning("[%s] Rollback of device %s failed" % (DevicePool.NAME, device_id))
+
+    def _worker(self, device_id: str, packages: queue.Queue, results: dict, step) -> None:
+        '''
+        Take packages from the queue while the device
+        is healthy, and run the step of the mode on each
+        one of them.
+        '''
+        health = self.health[device_id]
+
+        try:
+            while health.enabled:
+                try:
+                    pkg_name = self._next_package(device_id, packages)
+                except queue.Empty:
+                    return
+
+                with self.lock:
+                    health.current_package = pkg_name
+
+                try:
+                    step.before(pkg_name)
+                    step.process(pkg_name)
+                except Exception as e:
+                    # e.g. the rollback or the storage check failed
+                    self.logger.error("[%s] Exception on device %s with %s: %s" %
+                                      (DevicePool.NAME, device_id, pkg_name, str(e)))
+                    results[pkg_name] = None
+                    self._record_result(device_id, pkg_name, False, str(e))
+                finally:
+                    packages.task_done()
+        finally:
+            step.close()
+
+    def _install(self, install_job, pkg_name: str, device_id: str) -> tuple:
+        '''
+        Run the install job of a package.
+
+        :return: (return value of install_job or None, error or None).
+        '''
+        self.logger.info("[%s] Device %s installing %s" %
+                         (DevicePool.NAME, device_id, pkg_name))
+        try:
+            return (install_job(pkg_name, device_id), None)
+        except Exception as e:
+            self.logger.error("[%s] Exception on device %s installing %s: %s" %
+                              (DevicePool.NAME, device_id, pkg_name, str(e)))
+            return (None, str(e))
+
+    def _wait_for_storage(self, device_id: str, pending: queue.Queue) -> None:
+        '''
+        Back-pressure on the storage of the emulator, if there
+        is not enough free space wait until all the installed
+        packages have been pulled and uninstalled.
+        '''
+        free_storage = self.adbutilities.get_free_storage(device_id)
+
+        if free_storage is None or free_storage >= DevicePool.PIPELINE_MIN_FREE_STORAGE:
+            return
+
+        self.logger.info("[%s] Device %s has %d free bytes, waiting for pending pulls" %
+                         (DevicePool.NAME, device_id, free_storage))
+        pending.join()
+
+    def _finish_worker(self, device_id: str, pending: queue.Queue, finish_job, results: dict) -> None:
+        '''
+        Second stage of the pipeline, take the installed
+        packages and run the finish job on them, a None in
+        the queue means there are no more packages.
+        '''
+        while True:
+            item = pending.get()
+
+            if item is None:
+                pending.task_done()
+                return
+
+            pkg_name, installed, error = item
+
+            try:
+                ret = finish_job(pkg_name, device_id, installed)
+                results[pkg_name] = ret
+                # an exception of the install job is a failure of the device
+                self._record_result(device_id, pkg_name, bool(ret),
+                                    error if error is not None else "job returned %s" % (str(ret)),
+                                    device_failure=error is not None)
+            except Exception as e:
+                self.logger.error("[%s] Exception on device %s finishing %s: %s" %
+                                  (DevicePool.NAME, device_id, pkg_name, str(e)))
+                results[pkg_name] = None
+                self._record_result(device_id, pkg_name, False, str(e))
+            finally:
+                pending.task_done()
+
+    def _finish_batch(self, device_id: str, batch: list, batch_finish_job, results: dict) -> None:
+        '''
+        Run the finish job on a batch of installed packages
+        and record the result of each one of them.
+        '''
+        try:
+            batch_results = batch_finish_job(batch, device_id)
+        except Exception as e:
+            self.logger.error("[%s] Exception on device %s finishing a batch: %s" %
+                              (DevicePool.NAME, device_id, str(e)))
+            batch_results = {pkg_name: DeviceFailure(str(e)) for pkg_name, _, _ in batch}
+
+        for pkg_name, installed, error in batch:
+            ret = batch_results.get(pkg_name)
+
+            if isinstance(ret, DeviceFailure):
+                results[pkg_name] = None
+                self._record_result(device_id, pkg_name, False, str(ret))
+                continue
+
+            results[pkg_name] = ret
+            # an exception of the install job is a failure of the device
+            self._record_result(device_id, pkg_name, bool(ret),
+                                error if error is not None else "job returned %s" % (str(ret)),
+                                device_failure=error is not None)
+
+    def _run(self, package_names: list, create_step) -> dict:
+        '''
+        Start one worker per enabled device and wait until
+        all the packages are processed.
+
+        :param create_step: callable create_step(device_id, results) returning the step of the mode.
+        :return: dictionary package name -> result, None for the packages
+                 not processed because all the devices were disabled.
+        '''
+        packages = queue.Queue()
+        for pkg_name in package_names:
+            packages.put(pkg_name)
+
+        results = dict()
+        threads = list()
+
+        for device_id in self.get_enabled_device_ids():
+            thread = threading.Thread(target=self._worker,
+                                      args=(device_id, packages, results, create_step(device_id, results)),
+                                      name="%s-%s" % (DevicePool.NAME, device_id),
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        if len(threads) == 0:
+            self.logger.error("[%s] No devices available in the pool" % (DevicePool.NAME))
+
+        for thread in threads:
+            thread.join()
+
+        unprocessed = list()
+        while True:
+            try:
+                unprocessed.append(packages.get_nowait())
+            except queue.Empty:
+                break
+
+        if len(unprocessed) > 0:
+            self.logger.error("[%s] No devices enabled, %d packages not processed: %s" %
+                              (DevicePool.NAME, len(unprocessed), ", ".join(unprocessed)))
+            for pkg_name in unprocessed:
+                results[pkg_name] = None
+
+        for health in self.health.values():
+            self.logger.info("[%s] %s" % (DevicePool.NAME, str(health)))
+
+        return results
+
+    def run(self, package_names: list, job) -> dict:
+        '''
+        Distribute the packages among all the enabled
+        devices of the pool, each device takes a new
+        package as soon as it finishes the previous one.
+
+        :param package_names: list of packages to process.
+        :param job: callable with signature job(pkg_name, device_id), a falsy return is a failure
+                    of the package, an exception (e.g. DeviceFailure) is a failure of the device.
+        :return: dictionary package name -> return value of job (None on exception or not processed).
+        '''
+        return self._run(package_names,
+                         lambda device_id, results: SequentialStep(self, device_id, results, job))
+
+    def run_pipelined(self, package_names: list, install_job, finish_job) -> dict:
+        '''
+        Same as run, but each package is processed in two
+        stages, so the finish job of one package runs while
+        the next package is being installed on the same device.
+
+        :param package_names: list of packages to process.
+        :param install_job: callable install_job(pkg_name, device_id), it must not fail on the host side.
+        :param finish_job: callable finish_job(pkg_name, device_id, installed), installed is the
+                           return value of install_job (None on exception), a falsy return is a
+                           failure of the package, an exception (e.g. DeviceFailure) is a failure
+                           of the device.
+        :return: dictionary package name -> return value of finish_job (None on exception).
+        '''
+        return self._run(package_names,
+                         lambda device_id, results: PipelinedStep(self, device_id, results,
+                                                                  install_job, finish_job))
+
+    def run_batched(self, package_names: list, install_job, batch_finish_job, batch_size: int) -> dict:
+        '''
+        Same as run, but each device installs up to batch_size
+        packages before finishing all of them in one call.
+
+        :param package_names: list of packages to process.
+        :param install_job: callable install_job(pkg_name, device_id).
+        :param batch_finish_job: callable batch_finish_job(batch, device_id), batch is a list of
+                                 (pkg_name, installed, error) where installed is the return value
+                                 of install_job (None on exception), it returns a dictionary
+                                 package name -> result, a falsy or missing result is a failure
+                                 of the package, a DeviceFailure is a failure of the device.
+        :param batch_size: maximum number of packages in a batch.
+        :return: dictionary package name -> result from batch_finish_job.
+        '''
+        return self._run(package_names,
+                         lambda device_id, results: BatchedStep(self, device_id, results, install_job,
+                                                                batch_finish_job, batch_size))
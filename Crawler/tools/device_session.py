@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Session with one device, it keeps the handle of the
+device and a long-lived shell ('exec:sh', no PTY) where
+the commands are written one after the other, so each
+command does not need to open a new connection with the
+adb server. In case of error the session is opened again
+with the next command. The shell has no PTY, commands
+that need one (e.g. 'uiautomator dump /dev/tty') use a
+'shell:' connection.
+'''
+
+import time
+import uuid
+import socket
+import threading
+
+
+class DeviceSession(object):
+
+    NAME = "DeviceSession"
+    VERSION = "0.1"
+
+    # maximum time of a command (seconds)
+    SHELL_TIMEOUT = 120
+    # bytes read at once from the shell
+    READ_SIZE = 65536
+
+    def __init__(self, client, device_id: str, persistent: bool = True) -> None:
+        '''
+        :param client: ppadb client.
+        :param device_id: serial of the device.
+        :param persistent: keep a long-lived shell for the commands.
+        '''
+        self.client = client
+        self.device_id = device_id
+        self.persistent = persistent
+
+        self._device = None
+        self.connection = None
+        # printed after each command, the output ends there
+        self.marker = "__KUNAI_%s__" % (uuid.uuid4().hex)
+        self.lock = threading.Lock()
+
+    @property
+    def device(self):
+        '''
+        Handle of the device, resolved only the first time
+        or after an error.
+        '''
+        device = self._device
+        if device is None:
+            device = self.client.device(self.device_id)
+            if device is None:
+                raise RuntimeError("Device %s not found" % (self.device_id))
+            self._device = device
+        return device
+
+    def _open(self) -> None:
+        self.connection = self.device.create_connection(timeout=DeviceSession.SHELL_TIMEOUT)
+        self.connection.send("exec:sh")
+
+    def _close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def reconnect(self) -> None:
+        '''
+        Forget the handle and the shell, they will be created
+        again with the next command.
+        '''
+        with self.lock:
+            self._close()
+            self._device = None
+
+    def _read_until(self, connection, done, timeout: float) -> bytes:
+        '''
+        Read from a connection until done(data) is True or
+        the connection is closed, raises TimeoutError if it
+        takes more than timeout seconds in total.
+        '''
+        deadline = time.time() + timeout
+        data = bytearray()
+
+        while not done(data):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError("Command on %s took more than %.1f seconds" % (self.device_id, timeout))
+
+            connection.socket.settimeout(remaining)
+            try:
+                recv = connection.read(DeviceSession.READ_SIZE)
+            except socket.timeout:
+                raise TimeoutError("Command on %s took more than %.1f seconds" % (self.device_id, timeout))
+
+            if not recv:
+                break
+            data += recv
+
+        return bytes(data)
+
+    def _write_in_session(self, cmd: str) -> None:
+        '''
+        Write the command in the persistent shell, followed
+        by the marker, the marker is printed after a new line
+        so the output of the command is not modified.
+        '''
+        if self.connection is None:
+            self._open()
+
+        self.connection.write(("%s\nprintf '\\n%s %%d\\n' $?\n" % (cmd, self.marker)).encode('utf-8'))
+
+    def _read_in_session(self, timeout: float) -> str:
+        '''
+        Read the output of the last command written in the
+        persistent shell, until the marker.
+        '''
+        end = ("\n%s " % (self.marker)).encode('utf-8')
+
+        def done(data):
+            position = data.find(end)
+            return position != -1 and data.find(b"\n", position + len(end)) != -1
+
+        data = self._read_until(self.connection, done, timeout)
+
+        position = data.find(end)
+        if position == -1 or not done(data):
+            raise ConnectionError("Shell of %s closed" % (self.device_id))
+
+        return data[:position].decode('utf-8', errors='replace')
+
+    def _run_one_shot(self, cmd: str, timeout: float) -> str:
+        '''
+        Run the command through its own 'shell:' connection
+        (with PTY), the connection is opened again only if it
+        could not be opened, the command is never sent twice.
+        '''
+        try:
+            connection = self.device.create_connection(timeout=timeout)
+        except Exception as e:
+            print(f"[-] Error connecting to {self.device_id}, resolving the device again: {str(e)}")
+            with self.lock:
+                self._device = None
+            connection = self.device.create_connection(timeout=timeout)
+
+        with connection:
+            connection.send("shell:%s" % (cmd))
+            return self._read_until(connection, lambda data: False, timeout).decode('utf-8', errors='replace')
+
+    def shell(self, cmd: str, timeout: float = None, persistent: bool = True) -> str:
+        '''
+        Run a command in the device, if the persistent shell
+        is being used by other thread, a new connection is
+        used for this command instead of waiting.
+
+        The command is sent again only when it could not be
+        written, once written an error is raised, as commands
+        like 'input tap' or 'pm uninstall' must not run twice.
+
+        :param timeout: maximum time for the command, SHELL_TIMEOUT if None.
+        :param persistent: False to use a 'shell:' connection (with PTY).
+        :return: output of the command.
+        '''
+        if timeout is None:
+            timeout = DeviceSession.SHELL_TIMEOUT
+
+        if persistent and self.persistent and self.lock.acquire(blocking=False):
+            try:
+                try:
+                    self._write_in_session(cmd)
+                except Exception as e:
+                    # nothing was sent, the command goes through a new connection
+                    print(f"[-] Persistent shell of {self.device_id} not available: {str(e)}")
+                    self._close()
+                    self._device = None
+                else:
+                    try:
+                        return self._read_in_session(timeout)
+                    except Exception:
+                        # the command may have run, the shell is
+                        # opened again with the next command
+                        self._close()
+                        raise
+            finally:
+                self.lock.release()
+
+        return self._run_one_shot(cmd, timeout)
+
+    def close(self) -> None:
+        with self.lock:
+            self._close()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Manage the life of the emulators used for crawling, a
+warm pool of POOL_SIZE emulators of the same AVD is
+started, each one in its own port, booting from a
+snapshot where the Play Store has already a logged in
+account. The emulators are started read-only, so all of
+them can share the AVD and nothing is saved back to the
+snapshot; going back to a clean state is just loading
+the snapshot again, instead of wiping the data.
+
+Optionally the crawler does not uninstall the packages,
+the emulator is rolled back to the snapshot every
+ROLLBACK_EVERY packages or when the free storage goes
+below ROLLBACK_MIN_FREE_STORAGE_MB, so the caches of the
+store and the dalvik-cache do not grow during the crawl.
+'''
+
+import time
+import shutil
+import threading
+import subprocess
+
+from ppadb.client import Client as AdbClient
+from tools.base import BaseTool
+
+
+class EmulatorLifecycle(BaseTool):
+
+    NAME = "EmulatorLifecycle"
+    VERSION = "0.1"
+
+    # the console port of each emulator must be even,
+    # adb uses the next one.
+    PORT_STEP = 2
+    # polling of the boot of the emulators (seconds)
+    BOOT_POLL = 1
+
+    def __init__(self, host='127.0.0.1', port=5037) -> None:
+        super().__init__()
+        self.logger.info("[%s] Started tool" % (EmulatorLifecycle.NAME))
+
+        self.client = AdbClient(host=host, port=port)
+
+        self.emulator_binary = "emulator"
+        self.adb_binary = "adb"
+        self.avd = "CrawlerGPlay"
+        self.snapshot = "crawler_ready"
+        self.pool_size = 0
+        self.base_port = 5554
+        self.boot_timeout = 300
+        self.headless = True
+        self.emulator_args = ["-memory", "4096", "-partition-size", "2048",
+                              "-prop", "dalvik.vm.heapsize=512m"]
+        # packages installed before going back to the snapshot,
+        # and free storage (bytes) that forces it, 0 disables them
+        self.rollback_every = 0
+        self.rollback_min_free_storage = 0
+
+        self.lock = threading.Lock()
+        # device id -> Popen of the emulator
+        self.processes = dict()
+        # devices that finished booting
+        self.ready_devices = set()
+
+    def config(self) -> None:
+        '''
+        Read the [Emulator] section of the configuration,
+        with POOL_SIZE=0 no emulator is started and the
+        crawler uses the devices already connected to adb.
+        '''
+        if "Emulator" not in self.config_parser:
+            return
+
+        emulator_config = self.config_parser["Emulator"]
+
+        self.emulator_binary = emulator_config.get("EMULATOR", self.emulator_binary)
+        self.adb_binary = emulator_config.get("ADB", self.adb_binary)
+        self.avd = emulator_config.get("AVD", self.avd)
+        self.snapshot = emulator_config.get("SNAPSHOT", self.snapshot)
+        self.pool_size = emulator_config.getint("POOL_SIZE", 0)
+        self.base_port = emulator_config.getint("BASE_PORT", self.base_port)
+        self.boot_timeout = emulator_config.getfloat("BOOT_TIMEOUT", self.boot_timeout)
+        self.headless = emulator_config.getboolean("HEADLESS", self.headless)
+        self.rollback_every = emulator_config.getint("ROLLBACK_EVERY", 0)
+        self.rollback_min_free_storage = emulator_config.getint("ROLLBACK_MIN_FREE_STORAGE_MB", 0) * 1024 * 1024
+
+        extra_args = emulator_config.get("EXTRA_ARGS", "").strip()
+        if extra_args != "":
+            self.emulator_args = extra_args.split()
+
+    def is_rollback_enabled(self) -> bool:
+        '''
+        With rollback the packages are not uninstalled, the
+        emulators go back to the snapshot instead.
+        '''
+        return self.rollback_every > 0 or self.rollback_min_free_storage > 0
+
+    def get_device_id(self, port: int) -> str:
+        return "emulator-%d" % (port)
+
+    def _get_command(self, port: int) -> list:
+        '''
+        Command line of one emulator of the pool, it boots
+        from the snapshot and does not save the state on exit.
+        '''
+        command = [self.emulator_binary, "-avd", self.avd, "-port", str(port),
+                   "-snapshot", self.snapshot, "-no-snapshot-save", "-read-only"]
+
+        if self.headless:
+            command += ["-no-window", "-no-audio", "-no-boot-anim"]
+
+        return command + self.emulator_args
+
+    def _is_booted(self, device_id: str) -> bool:
+        device = self.client.device(device_id)
+        if device is None:
+            return False
+
+        try:
+            if device.shell("getprop sys.boot_completed").strip() != "1":
+                return False
+            return device.shell("getprop init.svc.bootanim").strip() in ["stopped", ""]
+        except Exception:
+            return False
+
+    def wait_for_boot(self, device_id: str, timeout: float = None) -> bool:
+        '''
+        Wait until the device has finished booting, with a
+        snapshot this takes a few seconds.
+
+        :return: True if the device is ready before the timeout.
+        '''
+        if timeout is None:
+            timeout = self.boot_timeout
+
+        start = time.time()
+
+        while time.time() - start < timeout:
+            process = self.processes.get(device_id)
+            if process is not None and process.poll() is not None:
+                self.logger.info("[%s] Emulator %s exited with code %d" %
+                                 (EmulatorLifecycle.NAME, device_id, process.returncode))
+                return False
+
+            if self._is_booted(device_id):
+                self.logger.info("[%s] %s ready in %.1f seconds" %
+                                 (EmulatorLifecycle.NAME, device_id, time.time() - start))
+                with self.lock:
+                    self.ready_devices.add(device_id)
+                return True
+
+            time.sleep(EmulatorLifecycle.BOOT_POLL)
+
+        self.logger.info("[%s] Timeout waiting for the boot of %s" % (EmulatorLifecycle.NAME, device_id))
+        return False
+
+    def start_emulator(self, port: int) -> str:
+        '''
+        Start one emulator in the given port, it keeps running
+        in its own session if this process finishes.
+
+        :return: device id of the emulator.
+        '''
+        device_id = self.get_device_id(port)
+
+        process = self.processes.get(device_id)
+        if process is not None and process.poll() is None:
+            return device_id
+
+        command = self._get_command(port)
+        self.logger.info("[%s] Starting emulator: %s" % (EmulatorLifecycle.NAME, " ".join(command)))
+
+        with self.lock:
+            self.ready_devices.discard(device_id)
+            self.processes[device_id] = subprocess.Popen(command,
+                                                         stdout=subprocess.DEVNULL,
+                                                         stderr=subprocess.DEVNULL,
+                                                         start_new_session=True)
+
+        return device_id
+
+    def start_pool(self, pool_size: int = None) -> list:
+        '''
+        Start the pool of emulators and wait for all of them
+        at the same time, the ones that do not boot are
+        stopped.
+
+        :param pool_size: number of emulators, POOL_SIZE from config if None.
+        :return: device ids of the ready emulators.
+        '''
+        if pool_size is None:
+            pool_size = self.pool_size
+
+        if shutil.which(self.emulator_binary) is None:
+            raise RuntimeError("The binary %s must be accessible" % (self.emulator_binary))
+
+        device_ids = [self.start_emulator(self.base_port + i * EmulatorLifecycle.PORT_STEP)
+                      for i in range(pool_size)]
+
+        threads = [threading.Thread(target=self.wait_for_boot, args=(device_id,)) for device_id in device_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for device_id in device_ids:
+            if device_id not in self.ready_devices:
+                self.stop_emulator(device_id)
+
+        return self.get_ready_devices()
+
+    def ensure_pool(self) -> list:
+        '''
+        Start again the emulators of the pool that died.
+
+        :return: device ids of the ready emulators.
+        '''
+        for device_id, process in list(self.processes.items()):
+            if process.poll() is not None:
+                self.logger.info("[%s] Emulator %s died, starting it again" % (EmulatorLifecycle.NAME, device_id))
+                port = int(device_id.split("-")[1])
+                self.start_emulator(port)
+                self.wait_for_boot(device_id)
+
+        return self.get_ready_devices()
+
+    def get_ready_devices(self) -> list:
+        with self.lock:
+            return sorted(self.ready_devices)
+
+    def _emu(self, device_id: str, args: list) -> str:
+        '''
+        Run a command in the console of the emulator through adb.
+        '''
+        output = subprocess.run([self.adb_binary, "-s", device_id, "emu"] + args,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                timeout=self.boot_timeout)
+        return output.stdout.decode('utf-8', errors='replace')
+
+    def restore_snapshot(self, device_id: str, snapshot: str = None) -> bool:
+        '''
+        Load the clean snapshot in a running emulator, this
+        undoes everything done since the snapshot was taken.
+
+        :return: True if the device is ready after loading the snapshot.
+        '''
+        if snapshot is None:
+            snapshot = self.snapshot
+
+        self.logger.info("[%s] Loading snapshot %s in %s" % (EmulatorLifecycle.NAME, snapshot, device_id))
+
+        with self.lock:
+            self.ready_devices.discard(device_id)
+
+        try:
+            output = self._emu(device_id, ["avd", "snapshot", "load", snapshot])
+        except subprocess.TimeoutExpired:
+            output = "KO: timeout"
+
+        if "KO" in output:
+            self.logger.info("[%s] Error loading snapshot in %s: %s" %
+                             (EmulatorLifecycle.NAME, device_id, output.strip()))
+            return False
+
+        return self.wait_for_boot(device_id)
+
+    def stop_emulator(self, device_id: str) -> None:
+        with self.lock:
+            self.ready_devices.discard(device_id)
+            process = self.processes.pop(device_id, None)
+
+        try:
+            self._emu(device_id, ["kill"])
+        except Exception:
+            pass
+
+        if process is not None:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def stop_pool(self) -> None:
+        for device_id in list(self.processes.keys()):
+            self.stop_emulator(device_id)
+
+    def run(self, args: dict) -> dict:
+        '''
+        Start the pool of emulators.
+
+        :param args: {"pool_size":<number of emulators (optional)>}
+        :return: {"devices": <device ids of the ready emulators>}
+        '''
+        self.logger.info("[%s] Running tool" % (EmulatorLifecycle.NAME))
+        return {"devices": self.start_pool(args.get("pool_size"))}
+
+
+def main():
+    '''
+    Start the pool and print the ready devices, the
+    emulators keep running once this finishes.
+    '''
+    emulator_lifecycle = EmulatorLifecycle()
+    emulator_lifecycle.config()
+
+    output = emulator_lifecycle.run({"pool_size": max(1, emulator_lifecycle.pool_size)})
+
+    for device_id in output["devices"]:
+        print(device_id)
+
+
+if __name__ == '__main__':
+    main()
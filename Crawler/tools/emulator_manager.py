@@ -3,15 +3,45 @@
 
 import os
 import sys
+import shlex
 import time
+import threading
 
-from bs4 import BeautifulSoup
 from ppadb.client import Client as AdbClient
+from tools.latency_histogram import LatencyHistogram
+from tools.screen_state import ScreenSnapshot
+from tools.apk_store import ApkStore, ExecOutStream
+from tools.device_session import DeviceSession
+from tools.stage_timer import StageTimer
+from tools.retry_scheduler import CrawlFailure
 
 DEBUG_SANDBOX = True
 
 class AdbUtilities():
 
+    # maximum time waiting for an installation (seconds)
+    INSTALL_TIMEOUT = 300
+    # time without install events before aborting (seconds)
+    INSTALL_STALL_TIMEOUT = 60
+    # backoff for the 'pm path' polling (seconds)
+    INSTALL_POLL_MIN = 0.5
+    INSTALL_POLL_MAX = 8
+    # logcat tags from Play Store and PackageManager
+    INSTALL_LOG_TAGS = ["Finsky:I", "PackageManager:I"]
+    INSTALL_FAILURE_MARKERS = ["INSTALL_FAILED", "Download failed", "Install failed", "Error while downloading"]
+
+    # polling of the screen while waiting for an UI state (seconds),
+    # the interval grows while the screen does not change.
+    UI_POLL_MIN = 0.25
+    UI_POLL_MAX = 2
+    UI_POLL_FACTOR = 1.5
+    # deadlines for each one of the UI steps (seconds)
+    UI_TIMEOUT_OPEN_STORE = 20
+    UI_TIMEOUT_CLICK_INSTALL = 10
+    UI_TIMEOUT_DISMISS_DIALOG = 10
+    # coordinates used when the button is not found on the screen
+    DEFAULT_INSTALL_TAP = (800, 800)
+
     def __init__(self, host='127.0.0.1', port=5037):
         self.client = None
 
@@ -21,6 +51,27 @@ class AdbUtilities():
         # name of the emulator to boot up
         self.emulator_name = "CrawlerGPlay"
 
+        # EmulatorLifecycle managing the emulators, if None
+        # the devices already connected to adb are used.
+        self.emulator_lifecycle = None
+
+        # device id -> packages installed since the last rollback
+        self.apps_since_rollback = dict()
+
+        # device id -> reason of the last failed installation (CrawlFailure)
+        self.last_failure = dict()
+
+        # device id -> DeviceSession
+        self.sessions = dict()
+        self.sessions_lock = threading.Lock()
+
+        # time of each stage of the crawl for each package
+        self.stage_timer = StageTimer()
+
+        # latency of each UI step, step name -> LatencyHistogram
+        self.step_latencies = dict()
+        self.step_latencies_lock = threading.Lock()
+
         self._connect_to_adb_client()
 
     def _connect_to_adb_client(self):
@@ -34,90 +85,338 @@ class AdbUtilities():
             print(f"[-] Exception connecting to Adbclient: {str(e)}")
             raise e
 
+    def _get_session(self, device_id: str) -> DeviceSession:
+        '''
+        Get the session of a device, it keeps the handle of the
+        device and a persistent shell, so the commands do not
+        resolve the device and open a connection each time.
+        '''
+        with self.sessions_lock:
+            if device_id not in self.sessions:
+                self.sessions[device_id] = DeviceSession(self.client, device_id)
+            return self.sessions[device_id]
+
+    def close_sessions(self) -> None:
+        with self.sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = dict()
+
+    def is_rollback_enabled(self) -> bool:
+        '''
+        Check if the devices are rolled back to the snapshot,
+        in that case the packages are not uninstalled.
+        '''
+        return self.emulator_lifecycle is not None and self.emulator_lifecycle.is_rollback_enabled()
+
+    def needs_rollback(self, device_id: str) -> bool:
+        '''
+        Check if the device must go back to the snapshot, because
+        ROLLBACK_EVERY packages were installed since the last
+        rollback, or because the free storage is too low.
+        '''
+        if not self.is_rollback_enabled():
+            return False
+
+        apps = self.apps_since_rollback.get(device_id, 0)
+        if apps == 0:
+            return False
+
+        if self.emulator_lifecycle.rollback_every > 0 and apps >= self.emulator_lifecycle.rollback_every:
+            return True
+
+        if self.emulator_lifecycle.rollback_min_free_storage > 0:
+            free_storage = self.get_free_storage(device_id)
+            if free_storage is not None and free_storage < self.emulator_lifecycle.rollback_min_free_storage:
+                print(f"Device {device_id} has {free_storage} free bytes, rolling back")
+                return True
+
+        return False
+
+    def rollback_device(self, device_id: str) -> bool:
+        '''
+        Load the clean snapshot in the device, nothing must be
+        running in the device (installs or pulls) while this
+        is done.
+
+        :return: True if the device is ready again.
+        '''
+        print(f"Rolling back {device_id} after {self.apps_since_rollback.get(device_id, 0)} packages")
+
+        # the shell of the session does not survive the snapshot
+        self._get_session(device_id).reconnect()
+
+        start = time.time()
+        ret = self.emulator_lifecycle.restore_snapshot(device_id)
+        self._record_step_latency("rollback", time.time() - start, not ret)
+
+        if ret:
+            self.apps_since_rollback[device_id] = 0
+
+        return ret
+
+    def get_last_failure(self, device_id: str) -> str:
+        '''
+        Reason why the last installation in the device failed,
+        one of the values from CrawlFailure.
+        '''
+        return self.last_failure.get(device_id)
+
+    def get_ready_devices(self) -> list:
+        '''
+        Get the serial of every device connected to the
+        adb server that has finished booting, these are
+        the devices that can be used for crawling. If the
+        emulators are started by an EmulatorLifecycle (pool),
+        only the ready emulators of its pool are returned.
+        '''
+        if self.emulator_lifecycle is not None and self.emulator_lifecycle.pool_size > 0:
+            return self.emulator_lifecycle.get_ready_devices()
+
+        ready_devices = list()
+
+        for device in self.client.devices():
+            try:
+                boot_completed = device.shell("getprop sys.boot_completed").strip()
+            except Exception as e:
+                print(f"[-] Device {device.serial} not reachable: {str(e)}")
+                continue
+
+            if boot_completed == "1":
+                ready_devices.append(device.serial)
+            else:
+                print(f"Device {device.serial} has not finished booting")
+
+        return ready_devices
+
+    def _record_step_latency(self, step: str, seconds: float, timeout: bool):
+        '''
+        Record the latency of an UI step in its histogram.
+        '''
+        with self.step_latencies_lock:
+            if step not in self.step_latencies:
+                self.step_latencies[step] = LatencyHistogram(step)
+            histogram = self.step_latencies[step]
+
+        histogram.record(seconds, timeout)
+
+    def get_step_latencies(self) -> dict:
+        '''
+        Get the histograms of latencies of the UI steps,
+        useful to tune the UI_TIMEOUT_* values.
+
+        :return: dictionary step name -> histogram as a dictionary.
+        '''
+        with self.step_latencies_lock:
+            histograms = list(self.step_latencies.values())
+
+        return {histogram.name: histogram.to_dict() for histogram in histograms}
+
+    def wait_until(self, step: str, condition, timeout: float):
+        '''
+        Call condition until it returns a value that is not
+        None or False, or until the deadline is reached.
+        The polling starts fast and slows down on each
+        unsuccessful try.
+
+        :param step: name of the step, used for the latency histogram.
+        :param condition: callable without parameters.
+        :param timeout: deadline in seconds.
+        :return: value returned by condition, or None on timeout.
+        '''
+        start = time.time()
+        deadline = start + timeout
+        delay = AdbUtilities.UI_POLL_MIN
+
+        while True:
+            ret = condition()
+
+            if ret is not None and ret is not False:
+                self._record_step_latency(step, time.time() - start, False)
+                return ret
+
+            if time.time() + delay > deadline:
+                break
+
+            time.sleep(delay)
+            delay = min(delay * AdbUtilities.UI_POLL_FACTOR, AdbUtilities.UI_POLL_MAX)
+
+        print(f"Timeout waiting for step '{step}' after {timeout} seconds")
+        self._record_step_latency(step, time.time() - start, True)
+        return None
+
+    def wait_for_screen(self, step: str, device_id: str, predicate, timeout: float):
+        '''
+        Wait until the current screen matches the predicate.
+
+        :param step: name of the step, used for the latency histogram.
+        :param device_id: device to check.
+        :param predicate: callable that receives the screen (ScreenSnapshot) and returns a bool.
+        :param timeout: deadline in seconds.
+        :return: the screen that matched the predicate, or None on timeout.
+        '''
+        def condition():
+            data = self.get_current_screen(device_id)
+            if predicate(data):
+                return data
+            return None
+
+        return self.wait_until(step, condition, timeout)
+
+    def is_store_page_loaded(self, data: ScreenSnapshot):
+        '''
+        Check if the page of the application in google play
+        has been loaded, this is true once the install button
+        or one of the known messages appears.
+        '''
+        return data.state != ScreenSnapshot.UNKNOWN
+
     def _start_googleplay_with_package_name(self, pkg_name: str, device_id: str):
         '''
         Start google play through an intent with the package name
-        of the application to download.
+        of the application to download, and wait until the page
+        of the application has been loaded.
+
+        :return: screen with the page of the application, None if it was not loaded.
         '''
-        device = self.client.device(device_id)
+        session = self._get_session(device_id)
 
         print("Running 'am start -a android.intent.action.VIEW -d market://details?id=%s'" % (pkg_name))
 
-        device.shell("am start -a android.intent.action.VIEW -d https://play.google.com/store/apps/details?id=%s" % (pkg_name))
+        session.shell("am start -a android.intent.action.VIEW -d https://play.google.com/store/apps/details?id=%s" % (pkg_name))
 
-        time.sleep(2)
+        return self.wait_for_screen("open_store", device_id, self.is_store_page_loaded,
+                                    AdbUtilities.UI_TIMEOUT_OPEN_STORE)
 
-    def _click_googleplay_on_install(self, device_id: str):
+    def _click_googleplay_on_install(self, device_id: str, data: ScreenSnapshot):
         '''
-        Click on the button install in the google play.
+        Click on the button install in the google play, and
+        wait until the button has been replaced (download
+        started). The position of the button is taken from
+        the screen.
         '''
-        device = self.client.device(device_id)
+        session = self._get_session(device_id)
 
-        print("Running 'input tap 800 800'")
+        x, y = data.tap_target("install", AdbUtilities.DEFAULT_INSTALL_TAP)
 
-        device.shell("input tap 800 800")
+        print("Running 'input tap %d %d'" % (x, y))
 
-        time.sleep(2)
-    
-    def _get_path_to_apk(self, pkg_name: str, device_id: str) -> str:
+        session.shell("input tap %d %d" % (x, y))
+
+        self.wait_for_screen("click_install", device_id,
+                             lambda data: not data.has_state(ScreenSnapshot.STORE_PAGE),
+                             AdbUtilities.UI_TIMEOUT_CLICK_INSTALL)
+
+    def _clear_install_events(self, device_id: str):
+        '''
+        Clear the logcat buffer of the device, this is done
+        before clicking on install so the events read while
+        waiting belong only to the current installation.
+        '''
+        session = self._get_session(device_id)
+
+        session.shell("logcat -c")
+
+    def _get_install_events(self, pkg_name: str, device_id: str) -> list:
         '''
-        Get the path to the APK file given the package name
-        we need to check for the output of an ADB command.
+        Get the lines from logcat written by the Play Store
+        (Finsky) and the PackageManager about the package,
+        the filtering is done in the device to keep the
+        output small.
         '''
-        device = self.client.device(device_id)
+        session = self._get_session(device_id)
+
+        output = session.shell("logcat -d -s %s | grep -F %s" %
+                              (" ".join(AdbUtilities.INSTALL_LOG_TAGS), pkg_name))
+
+        return [line for line in output.splitlines() if line.strip() != '']
+
+    def _get_paths_to_apk(self, pkg_name: str, device_id: str) -> list:
+        '''
+        Get the paths to the APK files given the package name,
+        applications distributed as bundles are installed as
+        base.apk plus split APKs, all of them are returned.
+        Wait for the installation checking the output of
+        'pm path' with an exponential backoff, so the paths
+        are returned as soon as the package is installed.
+
+        While waiting, the install events from logcat are
+        checked, if the Play Store reports an error or there
+        is no activity for INSTALL_STALL_TIMEOUT seconds,
+        the download is considered failed.
+        '''
+        session = self._get_session(device_id)
 
         print("Running 'pm path %s'" % (pkg_name))
 
-        for i in range(30): # up to 5 minutes of waiting
-            time.sleep(10)
-            print("Retrieving application from package %s" % (pkg_name))
-            output = device.shell("pm path %s" % (pkg_name))
-            
-            if output != '':
-                apk = output.split('package:')[1].strip()
-                print(f"Retrieved path to apk from {pkg_name}: {apk}")
-                return apk
-        
+        start = time.time()
+        last_activity = start
+        seen_events = 0
+        delay = AdbUtilities.INSTALL_POLL_MIN
+
+        while time.time() - start < AdbUtilities.INSTALL_TIMEOUT:
+            output = session.shell("pm path %s" % (pkg_name))
+
+            if 'package:' in output:
+                apks = [line.split('package:')[1].strip() for line in output.splitlines() if 'package:' in line]
+                print(f"Retrieved paths to apk from {pkg_name} in {time.time() - start:.1f} seconds: {', '.join(apks)}")
+                return apks
+
+            events = self._get_install_events(pkg_name, device_id)
+
+            if len(events) > seen_events:
+                new_events = events[seen_events:]
+                seen_events = len(events)
+                last_activity = time.time()
+                # any activity means the download is progressing,
+                # so poll fast again.
+                delay = AdbUtilities.INSTALL_POLL_MIN
+
+                for event in new_events:
+                    if any(marker in event for marker in AdbUtilities.INSTALL_FAILURE_MARKERS):
+                        print(f"Installation of {pkg_name} failed: {event.strip()}")
+                        self.last_failure[device_id] = CrawlFailure.INSTALL_ERROR
+                        return None
+
+            if time.time() - last_activity > AdbUtilities.INSTALL_STALL_TIMEOUT:
+                print(f"Download of {pkg_name} stalled, no activity in {AdbUtilities.INSTALL_STALL_TIMEOUT} seconds")
+                self.last_failure[device_id] = CrawlFailure.INSTALL_TIMEOUT
+                return None
+
+            time.sleep(delay)
+            delay = min(delay * 2, AdbUtilities.INSTALL_POLL_MAX)
+
         print(f"It wasn't possible to retrieve {pkg_name}")
+        self.last_failure[device_id] = CrawlFailure.INSTALL_TIMEOUT
         return None
     
     def _uninstall_apk(self, pkg_name: str, device_id: str):
         '''
         Uninstall everything from the APK!
         '''
-        device = self.client.device(device_id)
+        session = self._get_session(device_id)
 
         print(f"Uninstalling apk with package name {pkg_name}")
 
-        ret = device.shell("pm uninstall %s" % (pkg_name))
+        with self.stage_timer.stage(pkg_name, device_id, StageTimer.UNINSTALL):
+            ret = session.shell("pm uninstall %s" % (pkg_name))
 
         if "Success" in ret:
             print("Success uninstalling the application!")
         else:
             print("Something weird happened...")
 
-    def _retrieve_apk(self, device_id: str, path_on_device: str, path_on_host: str):
-        '''
-        Download from the device an apk to the host
-        path specified.
-        '''    
-        device = self.client.device(device_id)
-
-        print(f"Retrieving apk from {path_on_device} to {path_on_host}")
-
-        device.pull(path_on_device, path_on_host)
-
     def _is_current_focus_googleplay(self, device_id: str):
         '''
         Get what activity is currently on the focus
         on the system, this must be 'com.android.vending'
         in other case, cannot continue downloading...
         '''
-        device = self.client.device(device_id)
+        session = self._get_session(device_id)
 
         print(f"Retrieving current focus application")
 
-        ret = device.shell("dumpsys activity | grep top-activity")
+        ret = session.shell("dumpsys activity | grep top-activity")
 
         if not "com.android.vending" in ret:
             print("Current focus is not google play")
@@ -126,117 +425,289 @@ class AdbUtilities():
             print("Current focus is google play!")
             return True
 
-    def get_current_screen_xml(self, device_id: str):
+    def get_current_screen_xml(self, device_id: str) -> str:
         '''
         Get the XML of the current screen, this can be useful
         to know if there has been some problem downloading the
         apk.
         '''
-        device = self.client.device(device_id)
+        session = self._get_session(device_id)
 
-        data = device.shell('uiautomator dump /dev/tty')
+        # /dev/tty needs the PTY of a 'shell:' connection
+        data = session.shell('uiautomator dump /dev/tty', persistent=False)
         data = data.replace('UI hierchary dumped to: /dev/tty\n','')
 
-        return BeautifulSoup(data,"lxml")
+        return data
 
-    def is_content_available_in_country(self, data: BeautifulSoup):
+    def get_current_screen(self, device_id: str) -> ScreenSnapshot:
+        '''
+        Get a snapshot of the current screen already classified,
+        take only one snapshot for each state of the screen
+        as each dump takes one or two seconds.
+        '''
+        return ScreenSnapshot(self.get_current_screen_xml(device_id))
+
+    def is_content_available_in_country(self, data: ScreenSnapshot):
         '''
         Check if the text "This item isn't available in your country."
         appears in a Node, in that case, it means content isn't available.
         '''
+        return not data.has_state(ScreenSnapshot.NOT_AVAILABLE_IN_COUNTRY)
 
-        ret = data.find("node",{'content-desc':"This item isn't available in your country."})
-        
-        # if None, it means content is available
-        return (ret is None) 
-
-    def is_device_compatible(self, data: BeautifulSoup):
+    def is_device_compatible(self, data: ScreenSnapshot):
         '''
         Check if current device is compatible
         '''
-        ret = data.find("node",{'content-desc':"Your device isn\'t compatible with this version."})
-
-        # if None, it means device is compatible
-        return (ret is None)
+        return not data.has_state(ScreenSnapshot.INCOMPATIBLE_DEVICE)
 
-    def check_cannot_install_apk_press_got_it(self, device_id: str):
+    def check_cannot_install_apk_press_got_it(self, device_id: str, data: ScreenSnapshot = None) -> ScreenSnapshot:
         '''
         Check if there's an screen of cannot uninstall, and
         in that case, press the button of "Got it"
 
-        we will press:
-        adb shell input tap 882 1757
-
-        This is taken from the bounds, in this way: bounds="[816,1135][948,1245]"
+        The button is taken from the bounds of the node, in
+        case it is not found the old coordinates are used:
+        bounds="[816,1135][948,1245]"
         (816+948)/2 = 882
-        (1135+1245)/2 = 1757
-        '''
-        device = self.client.device(device_id)
+        (1135+1245)/2 = 1190
 
-        data = self.get_current_screen_xml(device_id)
+        :param data: screen already taken, if None a new one is taken.
+        :return: last snapshot of the screen.
+        '''
+        session = self._get_session(device_id)
+
+        if data is None:
+            data = self.get_current_screen(device_id)
+
+        if data.has_state(ScreenSnapshot.TRY_AGAIN):
+            x, y = data.tap_target("dialog", ((816+948)//2, (1135+1245)//2))
+            session.shell("input tap %d %d" % (x, y))
+            new_data = self.wait_for_screen("dismiss_try_again", device_id,
+                                            lambda data: not data.has_state(ScreenSnapshot.TRY_AGAIN),
+                                            AdbUtilities.UI_TIMEOUT_DISMISS_DIALOG)
+            data = new_data if new_data is not None else self.get_current_screen(device_id)
+
+        if data.has_state(ScreenSnapshot.UNRESTRICTED_INTERNET):
+            x, y = data.tap_target("dialog", ((816+948)//2, (1107+1217)//2))
+            session.shell("input tap %d %d" % (x, y))
+            new_data = self.wait_for_screen("dismiss_unrestricted_internet", device_id,
+                                            lambda data: not data.has_state(ScreenSnapshot.UNRESTRICTED_INTERNET),
+                                            AdbUtilities.UI_TIMEOUT_DISMISS_DIALOG)
+            data = new_data if new_data is not None else self.get_current_screen(device_id)
+
+        return data
+
+    def get_free_storage(self, device_id: str) -> int:
+        '''
+        Get the free space in the data partition of the
+        device, where the applications are installed.
 
-        ret = data.find("node",{'text':"Try again, and if it still doesn\'t work, see common ways to fix the problem"})
+        :return: free bytes, or None if it could not be obtained.
+        '''
+        session = self._get_session(device_id)
 
-        if ret is not None:
-            device.shell("input tap %d %d" % ((816+948)/2, (1135+1245)/2))
-            time.sleep(2)
+        output = session.shell("df -k /data")
 
-        ret = data.find("node",{'text':"Unrestricted Internet"})
-        if ret is not None:
-            device.shell("input tap %d %d" % ((816+948)/2, (1107+1217)/2))
-            time.sleep(2)
+        # Filesystem 1K-blocks Used Available Use% Mounted on
+        lines = [line for line in output.splitlines() if line.strip() != '']
+        if len(lines) < 2:
+            return None
 
-        
+        try:
+            return int(lines[-1].split()[3]) * 1024
+        except (IndexError, ValueError):
+            print(f"[-] Unexpected output from df: {output}")
+            return None
 
-    def download_apks_from_emulator(self, pkg:str, path_to_dump_apks: str):
+    def install_apk_from_googleplay(self, pkg: str, device_id: str) -> list:
         '''
-        From a list of package names, download them from google play
-        one by one.
+        Open the page of the application in google play, click
+        on install and wait for the installation. In case of
+        failure the reason is kept, see get_last_failure.
+
+        :return: paths of the apk files in the device, None if it could not be installed.
         '''
-        # id for the device, in this case as only one is taken
-        # I hard code it like emulator-5554
-        device_id = "emulator-5554"
+        self.last_failure[device_id] = None
+        self.apps_since_rollback[device_id] = self.apps_since_rollback.get(device_id, 0) + 1
 
         print('Starting google play')
-        self._start_googleplay_with_package_name(pkg, device_id)
+        with self.stage_timer.stage(pkg, device_id, StageTimer.OPEN_STORE):
+            data_from_screen = self._start_googleplay_with_package_name(pkg, device_id)
 
-        if not self._is_current_focus_googleplay(device_id):
-            print(f'Error accessing {pkg} in google play')
-            return False
+            if not self._is_current_focus_googleplay(device_id):
+                print(f'Error accessing {pkg} in google play')
+                self.last_failure[device_id] = CrawlFailure.FOCUS_LOST
+                return None
 
-        data_from_screen = self.get_current_screen_xml(device_id)
+            if data_from_screen is None:
+                data_from_screen = self.get_current_screen(device_id)
 
         if not self.is_device_compatible(data_from_screen):
-            return False
+            self.last_failure[device_id] = CrawlFailure.INCOMPATIBLE_DEVICE
+            return None
         
         if not self.is_content_available_in_country(data_from_screen):
-            return False
+            self.last_failure[device_id] = CrawlFailure.NOT_AVAILABLE_IN_COUNTRY
+            return None
 
-        self.check_cannot_install_apk_press_got_it(device_id)
+        with self.stage_timer.stage(pkg, device_id, StageTimer.DIALOG):
+            data_from_screen = self.check_cannot_install_apk_press_got_it(device_id, data_from_screen)
 
 
-        print('Click on google play install button')
-        self._click_googleplay_on_install(device_id)
+        with self.stage_timer.stage(pkg, device_id, StageTimer.INSTALL):
+            print('Click on google play install button')
+            self._clear_install_events(device_id)
+            self._click_googleplay_on_install(device_id, data_from_screen)
 
-        print("Getting the path to the apk")
-        apk_path = self._get_path_to_apk(pkg, device_id)
+            print("Getting the paths to the apk")
+            apk_paths = self._get_paths_to_apk(pkg, device_id)
 
-        if apk_path == None or apk_path == '':
+        if apk_paths == None or len(apk_paths) == 0:
             print(f'Error accessing {pkg} in the device')
-            return False
+            if self.last_failure.get(device_id) is None:
+                # the page never showed the install button
+                if data_from_screen.state == ScreenSnapshot.UNKNOWN:
+                    self.last_failure[device_id] = CrawlFailure.STORE_NOT_LOADED
+                else:
+                    self.last_failure[device_id] = CrawlFailure.INSTALL_TIMEOUT
+            return None
 
-        print("Retriving apk to host")
-        folder_for_apk = "%s/%s/" % (path_to_dump_apks, pkg)
-        if not os.path.exists(folder_for_apk):
-            os.mkdir(folder_for_apk)
-        self._retrieve_apk(device_id, apk_path, folder_for_apk+"base.apk")
+        return apk_paths
 
-        print("Uninstaling apk")
-        self._uninstall_apk(pkg, device_id)
+    def get_version_code(self, pkg_name: str, device_id: str) -> int:
+        '''
+        Get the versionCode of an installed package.
 
-        self.check_cannot_install_apk_press_got_it(device_id)
+        :return: versionCode or None if it could not be obtained.
+        '''
+        session = self._get_session(device_id)
+
+        output = session.shell("dumpsys package %s | grep versionCode" % (pkg_name))
+
+        # versionCode=1234 minSdk=21 targetSdk=33
+        for field in output.split():
+            if field.startswith("versionCode="):
+                try:
+                    return int(field.split("=")[1])
+                except ValueError:
+                    break
+
+        return None
+
+    def retrieve_and_uninstall_apk(self, pkg: str, apk_paths: list, apk_store: ApkStore, device_id: str,
+                                   version: str = None) -> dict:
+        '''
+        Pull an installed apk into the store of the host and
+        uninstall it, this does not touch the screen, so it
+        can run while the store installs the next application.
+
+        :param version: version from Google Play, saved in the store.
+        :return: record of the apk in the store, None if it could not be pulled.
+        '''
+        device = self._get_session(device_id).device
+
+        with self.stage_timer.stage(pkg, device_id, StageTimer.PULL):
+            version_code = self.get_version_code(pkg, device_id)
+
+            print(f"Retrieving apk from {', '.join(apk_paths)} to the store")
+            try:
+                record = apk_store.store_from_device(device, apk_paths, pkg, version, version_code)
+                print(f"Stored apk from {pkg} with sha256 {record['sha256']} ({len(record['files'])} files)")
+            except Exception as e:
+                print(f"[-] Error retrieving apk from {pkg}: {str(e)}")
+                record = None
+
+        # with rollback the package is removed with the snapshot
+        if not self.is_rollback_enabled():
+            print("Uninstaling apk")
+            self._uninstall_apk(pkg, device_id)
+
+        return record
+
+    def export_apks_bulk(self, packages: dict, apk_store: ApkStore, device_id: str, versions: dict = None) -> dict:
+        '''
+        Pull the files of several installed packages through a
+        single 'exec-out tar' stream, the store unpacks it while
+        it is received, after that all the packages are
+        uninstalled. This avoids one sync handshake per file.
+
+        :param packages: package name -> paths of its apk files in the device.
+        :param versions: package name -> version from Google Play, saved in the store.
+        :return: package name -> record in the store, packages that failed are not included.
+        '''
+        paths = [path for pkg_paths in packages.values() for path in pkg_paths]
+        if len(paths) == 0:
+            return dict()
+
+        device = self._get_session(device_id).device
+
+        start = time.time()
+
+        version_codes = dict()
+        for pkg in packages.keys():
+            version_codes[pkg] = self.get_version_code(pkg, device_id)
+
+        # relative paths and no stderr, 'exec:' mixes stderr
+        # (warnings, errors) with the archive
+        cmd = "tar -C / -cf - %s 2>/dev/null" % (" ".join(shlex.quote(path.lstrip('/')) for path in paths))
+
+        print(f"Retrieving {len(paths)} apk files from {len(packages)} packages in one stream")
+        try:
+            with ExecOutStream(device, cmd, exit_code=True) as stream:
+                records = apk_store.store_from_tar_stream(stream, packages, versions, version_codes)
+                exit_code = stream.get_exit_code()
+
+            if exit_code != 0:
+                print(f"[-] Error retrieving apks in bulk: tar exited with {exit_code}")
+                records = dict()
+        except Exception as e:
+            print(f"[-] Error retrieving apks in bulk: {str(e)}")
+            records = dict()
+
+        # the stream is shared, each package gets its part of the time
+        elapsed = (time.time() - start) / len(packages)
+        for pkg in packages.keys():
+            self.stage_timer.record(pkg, device_id, StageTimer.PULL, elapsed)
+
+        if not self.is_rollback_enabled():
+            print("Uninstaling apks")
+            for pkg in packages.keys():
+                self._uninstall_apk(pkg, device_id)
+
+        return records
+
+    def download_apks_from_emulator(self, pkg:str, path_to_dump_apks: str, device_id: str = "emulator-5554",
+                                    apk_store: ApkStore = None):
+        '''
+        Download the apk from a package name from google play
+        using the given device, by default the first emulator
+        (emulator-5554) is used, use a DevicePool to crawl
+        with several devices at the same time.
+
+        :param apk_store: store where the apk is saved, if None a store in
+                          path_to_dump_apks is opened and closed for this call.
+        '''
+        apk_paths = self.install_apk_from_googleplay(pkg, device_id)
+
+        if apk_paths is None:
+            return False
+
+        if apk_store is not None:
+            record = self.retrieve_and_uninstall_apk(pkg, apk_paths, apk_store, device_id)
+        else:
+            apk_store = ApkStore(path_to_dump_apks)
+            try:
+                record = self.retrieve_and_uninstall_apk(pkg, apk_paths, apk_store, device_id)
+            finally:
+                apk_store.close()
+
+        if self.needs_rollback(device_id):
+            self.rollback_device(device_id)
+        else:
+            with self.stage_timer.stage(pkg, device_id, StageTimer.DIALOG):
+                self.check_cannot_install_apk_press_got_it(device_id)
 
-        return True
+        return record is not None
         
 
 def main():
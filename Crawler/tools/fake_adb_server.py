@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Fake adb server with fake devices running a fake Play
+Store, it implements the part of the adb protocol used
+by ppadb (host:devices, host:transport, shell:, exec:,
+sync: RECV) and the commands sent by AdbUtilities:
+
+    am start, input tap, uiautomator dump, dumpsys activity,
+    dumpsys package, pm path, pm uninstall, logcat, df,
+    getprop, tar (exec-out) and the pull of files.
+
+The latency of each command and the rate of each kind
+of failure can be configured, so the crawler can be
+tested and its throughput measured without emulators
+and without network.
+'''
+
+import io
+import re
+import time
+import shlex
+import zlib
+import random
+import struct
+import tarfile
+import threading
+import socketserver
+
+
+class FakeDevice(object):
+    '''
+    State of one fake device, the page of the store that
+    is open, the installations in progress, the installed
+    packages and the logcat buffer.
+    '''
+
+    # bounds of the install button in the fake store page
+    INSTALL_BOUNDS = (600, 700, 1000, 900)
+    # size of the data partition (bytes)
+    STORAGE_SIZE = 8 * 1024 * 1024 * 1024
+
+    def __init__(self, serial: str, server) -> None:
+        self.serial = serial
+        self.server = server
+        self.lock = threading.Lock()
+
+        self.page = None
+        self.page_ready_at = 0
+        self.page_state = None
+        self.focus_lost = False
+        # package -> time when the installation finishes
+        self.installing = dict()
+        # package -> paths of the apk files
+        self.installed = dict()
+        self.logcat = list()
+
+    def _log(self, tag: str, message: str) -> None:
+        self.logcat.append("%s I %s: %s" % (time.strftime("%m-%d %H:%M:%S"), tag, message))
+
+    def _update(self) -> None:
+        '''
+        Finish the installations whose time has come.
+        '''
+        now = time.time()
+        for pkg_name, ready_at in list(self.installing.items()):
+            if ready_at <= now:
+                del self.installing[pkg_name]
+                self.installed[pkg_name] = self.server.get_apk_paths(pkg_name)
+                self._log("PackageManager", "Package %s installed" % (pkg_name))
+
+    def _screen(self) -> str:
+        '''
+        XML of the current screen, as written by uiautomator.
+        '''
+        nodes = list()
+
+        if self.page is not None and time.time() >= self.page_ready_at:
+            if self.page_state == "incompatible":
+                nodes.append('<node text="" content-desc="Your device isn\'t compatible with this version." bounds="[0,600][1080,700]" />')
+            elif self.page_state == "not_available":
+                nodes.append('<node text="" content-desc="This item isn\'t available in your country." bounds="[0,600][1080,700]" />')
+            elif self.page in self.installing:
+                nodes.append('<node text="Cancel" content-desc="" bounds="[600,700][1000,900]" />')
+            elif self.page in self.installed:
+                nodes.append('<node text="Uninstall" content-desc="" bounds="[80,700][500,900]" />')
+                nodes.append('<node text="Open" content-desc="" bounds="[600,700][1000,900]" />')
+            else:
+                nodes.append('<node text="Install" content-desc="" bounds="[%d,%d][%d,%d]" />' %
+                             FakeDevice.INSTALL_BOUNDS)
+
+        return ('<?xml version=\'1.0\' encoding=\'UTF-8\' standalone=\'yes\' ?>'
+                '<hierarchy rotation="0"><node text="" content-desc="" bounds="[0,0][1080,1920]">%s</node></hierarchy>'
+                'UI hierchary dumped to: /dev/tty\n' % ("".join(nodes)))
+
+    def _am_start(self, args: str) -> str:
+        match = re.search(r"details\?id=([\w.]+)", args)
+        if match is None:
+            return "Error: Activity not started\n"
+
+        pkg_name = match.group(1)
+        self.page = pkg_name
+        self.page_ready_at = time.time() + self.server.get_latency("store_load")
+        self.focus_lost = self.server.draw_failure("focus_lost")
+
+        # permanent failures are the same in every attempt
+        if self.server.draw_failure("incompatible", pkg_name):
+            self.page_state = "incompatible"
+        elif self.server.draw_failure("not_available", pkg_name):
+            self.page_state = "not_available"
+        else:
+            self.page_state = "store"
+
+        return "Starting: Intent { act=android.intent.action.VIEW dat=%s }\n" % (args.split()[-1])
+
+    def _input_tap(self, x: int, y: int) -> str:
+        x1, y1, x2, y2 = FakeDevice.INSTALL_BOUNDS
+
+        if (self.page is None or self.page_state != "store" or time.time() < self.page_ready_at or
+                self.page in self.installing or self.page in self.installed):
+            return ""
+
+        if not (x1 <= x <= x2 and y1 <= y <= y2):
+            return ""
+
+        if self.server.draw_failure("install_error"):
+            self._log("Finsky", "[%d] Install failed for %s: INSTALL_FAILED_INSUFFICIENT_STORAGE" %
+                      (random.randint(100, 999), self.page))
+            return ""
+
+        self._log("Finsky", "[%d] Installing %s" % (random.randint(100, 999), self.page))
+        self.installing[self.page] = time.time() + self.server.get_latency("install")
+        return ""
+
+    def _run_single(self, cmd: str, tty: bool) -> tuple:
+        '''
+        Run one command (without pipes).
+
+        :param tty: the command has a PTY ('shell:').
+        :return: tuple (output, exit code).
+        '''
+        args = cmd.split()
+        if len(args) == 0:
+            return ("", 0)
+
+        if args[0] == "getprop":
+            values = {"sys.boot_completed": "1", "init.svc.bootanim": "stopped"}
+            return ("%s\n" % (values.get(args[1], "") if len(args) > 1 else ""), 0)
+
+        if args[0] == "am" and len(args) > 1 and args[1] == "start":
+            return (self._am_start(cmd), 0)
+
+        if args[0] == "input" and len(args) == 4 and args[1] == "tap":
+            return (self._input_tap(int(args[2]), int(args[3])), 0)
+
+        if args[0] == "uiautomator" and len(args) > 1 and args[1] == "dump":
+            if len(args) > 2 and args[2] == "/dev/tty" and not tty:
+                return ("java.io.FileNotFoundException: /dev/tty: open failed: ENXIO (No such device or address)\n", 1)
+            self._update()
+            return (self._screen(), 0)
+
+        if args[0] == "dumpsys" and len(args) > 1 and args[1] == "activity":
+            top = "com.google.android.apps.nexuslauncher" if self.focus_lost or self.page is None else "com.android.vending"
+            return ("    Proc # 0: fore  T/A/T  trm: 0 1234:%s/u0a88 (top-activity)\n" % (top), 0)
+
+        if args[0] == "dumpsys" and len(args) > 2 and args[1] == "package":
+            self._update()
+            if args[2] not in self.installed:
+                return ("", 0)
+            return ("    versionCode=%d minSdk=21 targetSdk=33\n" % (self.server.get_version_code(args[2])), 0)
+
+        if args[0] == "pm" and len(args) > 2 and args[1] == "path":
+            self._update()
+            paths = self.installed.get(args[2])
+            if paths is None:
+                return ("", 1)
+            return ("".join("package:%s\n" % (path) for path in paths), 0)
+
+        if args[0] == "pm" and len(args) > 2 and args[1] == "uninstall":
+            self._update()
+            if self.installed.pop(args[2], None) is None:
+                return ("Failure [DELETE_FAILED_INTERNAL_ERROR]\n", 1)
+            return ("Success\n", 0)
+
+        if args[0] == "logcat":
+            if "-c" in args:
+                self.logcat = list()
+                return ("", 0)
+            self._update()
+            return ("".join("%s\n" % (line) for line in self.logcat), 0)
+
+        if args[0] == "df":
+            self._update()
+            used = sum(self.server.get_apk_size(pkg_name) for pkg_name in self.installed.keys()) // 1024
+            total = FakeDevice.STORAGE_SIZE // 1024
+            return ("Filesystem     1K-blocks    Used Available Use%% Mounted on\n"
+                    "/dev/block/dm-0 %d %d %d %d%% /data\n" % (total, used, total - used, used * 100 // total), 0)
+
+        if args[0] == "grep":
+            return ("", 1)
+
+        return ("/system/bin/sh: %s: not found\n" % (args[0]), 127)
+
+    def _get_latency_name(self, args: list) -> str:
+        if len(args) < 2:
+            return None
+        names = {
+            ("am", "start"): "am_start",
+            ("input", "tap"): "input_tap",
+            ("uiautomator", "dump"): "uiautomator_dump",
+            ("dumpsys", "activity"): "dumpsys",
+            ("dumpsys", "package"): "dumpsys",
+            ("pm", "path"): "pm_path",
+            ("pm", "uninstall"): "pm_uninstall",
+        }
+        if args[0] == "logcat":
+            return "logcat"
+        return names.get((args[0], args[1]))
+
+    def run_command(self, cmd: str, tty: bool = False) -> tuple:
+        '''
+        Run a command line, pipes to 'grep' and 'grep -F'
+        are applied to the output.
+
+        :param tty: the command has a PTY ('shell:').
+        :return: tuple (output, exit code).
+        '''
+        parts = [part.strip() for part in cmd.split("|")]
+
+        # the latency is simulated outside the lock, so the
+        # commands of different connections run at the same time
+        latency_name = self._get_latency_name(parts[0].split())
+        if latency_name is not None:
+            self.server.sleep(latency_name)
+
+        with self.lock:
+            output, exit_code = self._run_single(parts[0], tty)
+
+        for part in parts[1:]:
+            args = part.split(None, 2)
+            if len(args) < 2 or args[0] != "grep":
+                return ("/system/bin/sh: %s: not found\n" % (part), 127)
+            pattern = args[2] if args[1] == "-F" and len(args) > 2 else " ".join(args[1:])
+            lines = [line for line in output.splitlines(True) if pattern in line]
+            output = "".join(lines)
+            exit_code = 0 if len(lines) > 0 else 1
+
+        return (output, exit_code)
+
+
+class FakeAdbHandler(socketserver.StreamRequestHandler):
+    '''
+    One connection from the client, the requests follow
+    the smart socket protocol of the adb server.
+    '''
+
+    PRINTF_MARKER = re.compile(r"printf '\\n(\S+) %d\\n' \$\?")
+
+    def _read_request(self) -> str:
+        length = self.rfile.read(4)
+        if len(length) < 4:
+            return None
+        return self.rfile.read(int(length.decode('utf-8'), 16)).decode('utf-8')
+
+    def _okay(self) -> None:
+        self.wfile.write(b"OKAY")
+
+    def _fail(self, message: str) -> None:
+        data = message.encode('utf-8')
+        self.wfile.write(b"FAIL" + ("%04x" % (len(data))).encode('utf-8') + data)
+
+    def handle(self) -> None:
+        try:
+            self._handle()
+        except (ConnectionResetError, BrokenPipeError):
+            # the client closed the connection (e.g. close_sessions)
+            pass
+
+    def _handle(self) -> None:
+        device = None
+
+        while True:
+            request = self._read_request()
+            if request is None:
+                return
+
+            if request == "host:devices":
+                self._okay()
+                data = "".join("%s\tdevice\n" % (serial) for serial in self.server.devices.keys()).encode('utf-8')
+                self.wfile.write(("%04x" % (len(data))).encode('utf-8') + data)
+                return
+
+            if request == "host:version":
+                self._okay()
+                self.wfile.write(b"00040029")
+                return
+
+            if request.startswith("host:transport:"):
+                device = self.server.devices.get(request[len("host:transport:"):])
+                if device is None:
+                    self._fail("device not found")
+                    return
+                self._okay()
+                continue
+
+            if device is None:
+                self._fail("no device selected")
+                return
+
+            if request.startswith("shell:"):
+                self._okay()
+                output, _ = device.run_command(request[len("shell:"):], tty=True)
+                self.wfile.write(output.encode('utf-8'))
+                return
+
+            if request == "exec:sh":
+                self._okay()
+                self._interactive_shell(device)
+                return
+
+            if request.startswith("exec:tar "):
+                self._okay()
+                self._tar(device, request[len("exec:"):])
+                return
+
+            if request.startswith("exec:"):
+                self._okay()
+                output, _ = device.run_command(request[len("exec:"):])
+                self.wfile.write(output.encode('utf-8'))
+                return
+
+            if request == "sync:":
+                self._okay()
+                self._sync()
+                return
+
+            self._fail("unknown request %s" % (request))
+            return
+
+    def _interactive_shell(self, device: FakeDevice) -> None:
+        '''
+        Shell without PTY, one command per line.
+        '''
+        exit_code = 0
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            line = line.decode('utf-8').strip()
+            if line == "":
+                continue
+
+            match = FakeAdbHandler.PRINTF_MARKER.match(line)
+            if match is not None:
+                self.wfile.write(("\n%s %d\n" % (match.group(1), exit_code)).encode('utf-8'))
+                continue
+
+            output, exit_code = device.run_command(line)
+            self.wfile.write(output.encode('utf-8'))
+
+    def _tar(self, device: FakeDevice, command: str) -> None:
+        '''
+        Run 'tar [-C dir] -cf - <paths> [2>/dev/null][; ...]'
+        as 'exec:' does: there is no separate stderr, so the
+        messages of tar are mixed with the archive unless they
+        are sent to /dev/null, and the exit status is only
+        known through an 'echo'. After tar, 'echo [text]' and
+        'name=$?' are run as sh does, $? is the status of the
+        previous part (0 after an echo or an assignment).
+        '''
+        command, _, trailer = command.partition("; ")
+
+        stderr_to_null = command.endswith(" 2>/dev/null")
+        if stderr_to_null:
+            command = command[:-len(" 2>/dev/null")]
+
+        args = shlex.split(command)[1:]
+        directory = "/"
+        if args[0] == "-C":
+            directory = args[1]
+            args = args[2:]
+        paths = args[2:]
+
+        installed = set(path for pkg_paths in list(device.installed.values()) for path in pkg_paths)
+
+        stderr = ""
+        exit_code = 0
+        if any(path.startswith('/') for path in paths):
+            stderr += "tar: Removing leading '/' from member names\n"
+
+        files = list()
+        for path in paths:
+            full_path = path if path.startswith('/') else directory.rstrip('/') + '/' + path
+            if full_path not in installed or self.server.draw_failure("pull_error"):
+                stderr += "tar: %s: No such file or directory\n" % (path)
+                exit_code = 1
+                continue
+            files.append((path, full_path))
+
+        if not stderr_to_null:
+            self.wfile.write(stderr.encode('utf-8'))
+
+        with tarfile.open(fileobj=self.wfile, mode='w|') as tar:
+            for path, full_path in files:
+                data = self.server.get_file_content(full_path)
+                self.server.sleep_transfer(len(data))
+                info = tarfile.TarInfo(name=path.lstrip('/'))
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+
+        status = exit_code
+        variables = dict()
+
+        def expand(text):
+            return re.sub(r"\$(\?|\w+)",
+                          lambda match: str(status) if match.group(1) == "?" else variables.get(match.group(1), ""),
+                          text)
+
+        for part in trailer.split("; ") if trailer else []:
+            assignment = re.fullmatch(r"(\w+)=(.*)", part)
+            if assignment is not None:
+                variables[assignment.group(1)] = expand(assignment.group(2))
+            elif part == "echo":
+                self.wfile.write(b"\n")
+            elif part.startswith("echo "):
+                self.wfile.write((expand(part[len("echo "):]) + "\n").encode('utf-8'))
+            status = 0
+
+    def _sync(self) -> None:
+        '''
+        Sync protocol, only RECV (pull) and QUIT.
+        '''
+        while True:
+            header = self.rfile.read(8)
+            if len(header) < 8:
+                return
+
+            command = header[0:4].decode('utf-8')
+            length = struct.unpack("<I", header[4:8])[0]
+
+            if command == "QUIT":
+                return
+
+            if command != "RECV":
+                message = b"unsupported sync command"
+                self.wfile.write(b"FAIL" + struct.pack("<I", len(message)) + message)
+                return
+
+            path = self.rfile.read(length).decode('utf-8')
+
+            if self.server.draw_failure("pull_error"):
+                message = ("remote object '%s' does not exist" % (path)).encode('utf-8')
+                self.wfile.write(b"FAIL" + struct.pack("<I", len(message)) + message)
+                continue
+
+            data = self.server.get_file_content(path)
+            self.server.sleep_transfer(len(data))
+
+            for i in range(0, len(data), 65536):
+                chunk = data[i:i+65536]
+                self.wfile.write(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+            self.wfile.write(b"DONE" + struct.pack("<I", 0))
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+
+    NAME = "FakeAdbServer"
+    VERSION = "0.1"
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # mean latency of each command (seconds), the real one
+    # is taken between half and one and a half of it
+    LATENCIES = {
+        "am_start": 0.3,
+        "store_load": 1.5,
+        "input_tap": 0.1,
+        "uiautomator_dump": 1.0,
+        "dumpsys": 0.2,
+        "pm_path": 0.1,
+        "pm_uninstall": 0.5,
+        "logcat": 0.1,
+        "install": 8.0,
+        # seconds per MiB pulled
+        "transfer": 0.02,
+    }
+
+    # probability of each failure
+    FAILURE_RATES = {
+        "incompatible": 0.02,
+        "not_available": 0.02,
+        "focus_lost": 0.01,
+        "install_error": 0.02,
+        "pull_error": 0.01,
+    }
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 5038, number_of_devices: int = 1,
+                 latencies: dict = None, failure_rates: dict = None, time_scale: float = 1.0,
+                 apk_size: int = 4 * 1024 * 1024) -> None:
+        '''
+        :param host: address to listen.
+        :param port: port to listen, 5037 is the one of the real server.
+        :param number_of_devices: fake emulators, named emulator-5554, emulator-5556...
+        :param latencies: values that replace the ones from LATENCIES.
+        :param failure_rates: values that replace the ones from FAILURE_RATES.
+        :param time_scale: factor applied to every latency.
+        :param apk_size: mean size of the base apk (bytes).
+        '''
+        super().__init__((host, port), FakeAdbHandler)
+
+        self.latencies = dict(FakeAdbServer.LATENCIES)
+        self.latencies.update(latencies or dict())
+        self.failure_rates = dict(FakeAdbServer.FAILURE_RATES)
+        self.failure_rates.update(failure_rates or dict())
+        self.time_scale = time_scale
+        self.apk_size = apk_size
+
+        self.devices = dict()
+        for i in range(number_of_devices):
+            serial = "emulator-%d" % (5554 + i * 2)
+            self.devices[serial] = FakeDevice(serial, self)
+
+        self.thread = None
+
+    def get_latency(self, name: str) -> float:
+        latency = self.latencies.get(name, 0) * self.time_scale
+        return random.uniform(latency / 2, latency * 3 / 2)
+
+    def sleep(self, name: str) -> None:
+        time.sleep(self.get_latency(name))
+
+    def sleep_transfer(self, size: int) -> None:
+        time.sleep(self.latencies["transfer"] * self.time_scale * size / (1024 * 1024))
+
+    def draw_failure(self, name: str, key: str = None) -> bool:
+        '''
+        Decide if a failure happens, with a key the result is
+        always the same for the key (permanent failures).
+        '''
+        if key is not None:
+            return (zlib.crc32(("%s:%s" % (name, key)).encode('utf-8')) % 10000) < self.failure_rates[name] * 10000
+        return random.random() < self.failure_rates[name]
+
+    def get_version_code(self, pkg_name: str) -> int:
+        return zlib.crc32(pkg_name.encode('utf-8')) % 1000000
+
+    def get_apk_size(self, pkg_name: str) -> int:
+        return self.apk_size // 2 + zlib.crc32(pkg_name.encode('utf-8')) % self.apk_size
+
+    def get_apk_paths(self, pkg_name: str) -> list:
+        '''
+        Half of the packages are installed as a bundle with a split apk.
+        '''
+        base = "/data/app/~~%08x==/%s-1" % (zlib.crc32(pkg_name.encode('utf-8')), pkg_name)
+        paths = ["%s/base.apk" % (base)]
+        if zlib.crc32(pkg_name.encode('utf-8')) % 2 == 0:
+            paths.append("%s/split_config.arm64_v8a.apk" % (base))
+        return paths
+
+    def get_file_content(self, path: str) -> bytes:
+        '''
+        Content of an apk file, always the same for a path.
+        '''
+        match = re.search(r"/([\w.]+)-1/", path)
+        pkg_name = match.group(1) if match is not None else path
+        size = self.get_apk_size(pkg_name)
+        if not path.endswith("base.apk"):
+            size //= 8
+        return random.Random(path).randbytes(size)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.serve_forever, name=FakeAdbServer.NAME, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    '''
+    Run the fake server with two devices until Ctrl+C,
+    for example to try the crawler by hand.
+    '''
+    server = FakeAdbServer(number_of_devices=2)
+    print(f"Fake adb server listening on {server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
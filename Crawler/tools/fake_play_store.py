@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Fake Google Play web server for google_play_scraper,
+it answers /store/apps/details with a page containing
+the data of the application in the same structure as
+the real one, so GoogleMetaInf can be pointed to it
+with BASE_URL. The latency, the rate of applications
+not found (404) and the rate of transient errors (503)
+can be configured.
+'''
+
+import json
+import time
+import zlib
+import random
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakePlayStoreHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code: int, body: str) -> None:
+        data = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        app_id = parse_qs(url.query).get("id", [None])[0]
+
+        latency = self.server.latency
+        time.sleep(random.uniform(latency / 2, latency * 3 / 2))
+
+        if url.path != "/store/apps/details" or app_id is None:
+            self._send(404, "Not Found")
+            return
+
+        if self.server.is_not_found(app_id):
+            self._send(404, "Not Found")
+            return
+
+        if random.random() < self.server.error_rate:
+            self._send(503, "Service Unavailable")
+            return
+
+        self._send(200, self.server.get_page(app_id))
+
+
+class FakePlayStore(ThreadingHTTPServer):
+
+    NAME = "FakePlayStore"
+    VERSION = "0.1"
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8088, latency: float = 0.3,
+                 not_found_rate: float = 0.01, error_rate: float = 0.02) -> None:
+        '''
+        :param latency: mean latency of each request (seconds).
+        :param not_found_rate: part of the applications that do not exist (always the same ones).
+        :param error_rate: probability of a transient error in a request.
+        '''
+        super().__init__((host, port), FakePlayStoreHandler)
+        self.latency = latency
+        self.not_found_rate = not_found_rate
+        self.error_rate = error_rate
+        self.thread = None
+
+    def get_base_url(self) -> str:
+        return "http://%s:%d" % (self.server_address[0], self.server_address[1])
+
+    def is_not_found(self, app_id: str) -> bool:
+        return (zlib.crc32(app_id.encode('utf-8')) % 10000) < self.not_found_rate * 10000
+
+    def get_app_data(self, app_id: str) -> list:
+        '''
+        Data of the application at the positions read by
+        the ElementSpecs of google_play_scraper ('ds:5').
+        '''
+        seed = zlib.crc32(app_id.encode('utf-8'))
+
+        data = [None] * 146
+        data[0] = [app_id.split(".")[-1].capitalize()]
+        data[12] = [[None, "Description of %s" % (app_id)]]
+        data[13] = ["%d+" % (10 ** (seed % 7 + 3)), 10 ** (seed % 7 + 3), 10 ** (seed % 7 + 3) + seed % 1000]
+        data[51] = [[None, 3 + (seed % 200) / 100], None, [None, seed % 100000], [None, seed % 10000]]
+        data[68] = ["Developer of %s" % (app_id)]
+        data[79] = [[["Tools", None, "TOOLS"]]]
+        data[140] = [[["1.%d.%d" % (seed % 10, seed % 100)]]]
+
+        return [None, [None, None, data]]
+
+    def get_page(self, app_id: str) -> str:
+        return ("<html><body><script nonce=\"fake\">AF_initDataCallback({key: 'ds:5', hash: '1', "
+                "data:%s, sideChannel: {}});</script></body></html>" % (json.dumps(self.get_app_data(app_id))))
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.serve_forever, name=FakePlayStore.NAME, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
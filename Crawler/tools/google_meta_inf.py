@@ -10,10 +10,17 @@ application.
 
 import random
 import time
+import socket
+from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor
 from tools.base import BaseTool
+from tools.token_bucket import TokenBucket
+from tools.metadata_cache import MetadataCache
+from tools.stage_timer import StageTimer
 
 from google_play_scraper import app
 from google_play_scraper import exceptions
+from google_play_scraper.constants.request import Formats
 
 
 class GoogleMetaInf(BaseTool):
@@ -21,37 +28,130 @@ class GoogleMetaInf(BaseTool):
     NAME = "GooglePlayInformation"
     VERSION = "0.1"
 
+    # errors that can disappear retrying the request
+    TRANSIENT_ERRORS = (exceptions.ExtraHTTPError, URLError, socket.timeout, ConnectionError)
+
     def __init__(self) -> None:
         super().__init__()
         self.logger.info("[%s] Started tool" % (GoogleMetaInf.NAME))
         self.seconds_wait = 0
+        self.requests_per_wait = 1
+        self.max_workers = 1
+        self.max_retries = 0
+        self.retry_base_delay = 1.0
+        self.rate_limiter = None
+        self.lang = "en"
+        self.country = "us"
+        self.cache = None
+        self.force_refresh = False
+        # time spent retrieving the metadata of each package
+        self.stage_timer = StageTimer()
 
     def config(self) -> None:
         '''
-        Configure values for this tool
+        Configure values for this tool, the rate of requests
+        is REQUESTS_PER_WAITTIME requests each WAITTIME seconds.
+        In case BASE_URL is given, the requests are sent there
+        instead of to Google Play (useful for a local server).
+        The cache is used if [MetadataCache] has a PATH.
         '''
-        pass
+        if "MetadataCache" in self.config_parser:
+            cache_config = self.config_parser["MetadataCache"]
+            cache_path = cache_config.get("PATH", "").strip()
+            self.force_refresh = cache_config.getboolean("FORCE_REFRESH", False)
+
+            if cache_path != "" and self.cache is None:
+                self.logger.info("[%s] Using metadata cache in %s" % (GoogleMetaInf.NAME, cache_path))
+                self.cache = MetadataCache(cache_path,
+                                           cache_config.getfloat("TTL", 0),
+                                           cache_config.getint("MAX_ENTRIES", 0))
+
+        if "GoogleScrapper" not in self.config_parser:
+            return
+
+        scrapper_config = self.config_parser["GoogleScrapper"]
+
+        self.seconds_wait = scrapper_config.getfloat("WAITTIME", 0)
+        self.requests_per_wait = scrapper_config.getint("REQUESTS_PER_WAITTIME", 1)
+        self.max_workers = scrapper_config.getint("MAX_WORKERS", 1)
+        self.max_retries = scrapper_config.getint("MAX_RETRIES", 0)
+        self.retry_base_delay = scrapper_config.getfloat("RETRY_BASE_DELAY", 1.0)
+        self.lang = scrapper_config.get("LANG", "en")
+        self.country = scrapper_config.get("COUNTRY", "us")
+
+        if self.seconds_wait > 0:
+            self.rate_limiter = TokenBucket(self.requests_per_wait / self.seconds_wait,
+                                            self.requests_per_wait)
+
+        base_url = scrapper_config.get("BASE_URL", "").strip()
+        if base_url != "":
+            self.logger.info("[%s] Using %s as Google Play" % (GoogleMetaInf.NAME, base_url))
+            Formats.Detail.URL_FORMAT = base_url + "/store/apps/details?id={app_id}&hl={lang}&gl={country}"
+            Formats.Detail.FALLBACK_URL_FORMAT = base_url + "/store/apps/details?id={app_id}&hl={lang}"
+
+    def _scrape(self, package_name: str) -> dict:
+        '''
+        Call the scrapper respecting the rate limit, retry
+        with an exponential backoff with jitter when the
+        error is transient.
+        '''
+        attempt = 0
+
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            try:
+                return app(
+                    package_name,
+                    lang=self.lang,
+                    country=self.country)
+            except GoogleMetaInf.TRANSIENT_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise e
+
+                delay = self.retry_base_delay * (2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+                self.logger.info("[%s] Transient error retrieving '%s' (%s), retrying in %.1f seconds" %
+                                 (GoogleMetaInf.NAME, package_name, str(e), delay))
+                time.sleep(delay)
+                attempt += 1
 
     def run(self, args: dict) -> dict:
         '''
         Run the scrapper for GooglePlay and retrieve the
         metadata, keep only interesting information,
         no interested on comments...
-        :param args: {"package_name":<package name of app>}
+        :param args: {"package_name":<package name of app>, "force_refresh":<ignore the cache (optional)>}
         :return: metadata from google play
         '''
         self.logger.info("[%s] Running tool" % (GoogleMetaInf.NAME))
+
+        with self.stage_timer.stage(args["package_name"], None, StageTimer.METADATA):
+            return self._retrieve(args)
+
+    def _retrieve(self, args: dict) -> dict:
+        '''
+        Retrieve the metadata from the cache or from the scrapper.
+        '''
         package_name = args["package_name"]
+        force_refresh = args.get("force_refresh", self.force_refresh)
+
+        if self.cache is not None and not force_refresh:
+            output_from_cache = self.cache.get(package_name, self.lang, self.country)
+            if output_from_cache is not None:
+                self.logger.info("[%s] Information from '%s' found in cache" %
+                                 (GoogleMetaInf.NAME, package_name))
+                return output_from_cache
+
         self.logger.info("[%s] Retrieving information from '%s'" %
                          (GoogleMetaInf.NAME, package_name))
         output_from_scrapper = None
         try:
-            output_from_scrapper = app(
-                package_name,
-                lang="en",
-                country="us")
+            output_from_scrapper = self._scrape(package_name)
         except exceptions.NotFoundError as nfe:
-            return {"EXCEPTION": "Application with package name %s not found on Google Play" % (package_name)}
+            return {"EXCEPTION": "Application with package name %s not found on Google Play" % (package_name),
+                    "ERROR": "NOT_FOUND"}
         except Exception as e:
             return {"EXCEPTION": str(e)}
 
@@ -63,4 +163,29 @@ class GoogleMetaInf(BaseTool):
             if k in output_from_scrapper.keys():
                 del output_from_scrapper[k]
 
+        if self.cache is not None:
+            self.cache.put(package_name, self.lang, self.country, output_from_scrapper)
+
         return output_from_scrapper
+
+    def run_many(self, package_names: list, force_refresh: bool = None) -> dict:
+        '''
+        Retrieve the metadata from a list of packages using
+        a pool of MAX_WORKERS threads, all of them share the
+        same rate limit.
+
+        :param package_names: list of package names.
+        :param force_refresh: ignore the cache, if None FORCE_REFRESH from config is used.
+        :return: dictionary package name -> output of run.
+        '''
+        if force_refresh is None:
+            force_refresh = self.force_refresh
+
+        self.logger.info("[%s] Retrieving information from %d packages with %d workers" %
+                         (GoogleMetaInf.NAME, len(package_names), self.max_workers))
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            outputs = executor.map(lambda package_name: self.run({"package_name": package_name,
+                                                                  "force_refresh": force_refresh}),
+                                   package_names)
+            return dict(zip(package_names, outputs))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Queue of crawl jobs stored in MongoDB, shared by the
+crawlers of several hosts. The list of applications is
+loaded once in the jobs collection, each worker claims
+jobs atomically, and keeps them with a lease renewed by
+a heartbeat thread; if a worker dies, its jobs are
+claimed by other worker once the lease expires.
+
+It can be tried with a local mongod, setting the URI
+from [DATABASE] in config.ini to mongodb://127.0.0.1:27017/
+and running several crawlers with --jobs.
+'''
+
+import os
+import socket
+import logging
+import threading
+
+from database_connector import DatabaseConnector
+
+
+class CrawlJobQueue(object):
+
+    NAME = "CrawlJobQueue"
+    VERSION = "0.1"
+
+    # seconds a claimed job belongs to the worker without heartbeat
+    LEASE_SECONDS = 600
+
+    def __init__(self, database_connector: DatabaseConnector, worker_id: str = None,
+                 lease_seconds: float = None) -> None:
+        '''
+        :param database_connector: DatabaseConnector already configured.
+        :param worker_id: identifier of this worker, by default <hostname>-<pid>.
+        :param lease_seconds: duration of the lease, LEASE_SECONDS if None.
+        '''
+        self.logger = logging.getLogger("CrawlJobQueue")
+        self.database_connector = database_connector
+
+        if worker_id is None:
+            worker_id = "%s-%d" % (socket.gethostname(), os.getpid())
+        self.worker_id = worker_id
+
+        if lease_seconds is None:
+            lease_seconds = CrawlJobQueue.LEASE_SECONDS
+        self.lease_seconds = lease_seconds
+
+        self.lock = threading.Lock()
+        # packages claimed by this worker
+        self.claimed = set()
+
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def load(self, jobs: list) -> int:
+        '''
+        Load jobs in the collection, see DatabaseConnector.insert_jobs.
+
+        :return: number of new jobs.
+        '''
+        self.database_connector.create_job_indexes()
+        return self.database_connector.insert_jobs(jobs)
+
+    def start(self) -> None:
+        '''
+        Start the heartbeat thread, it renews the leases
+        three times per lease.
+        '''
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat,
+                                                 name="%s-heartbeat" % (CrawlJobQueue.NAME),
+                                                 daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop(self) -> None:
+        '''
+        Stop the heartbeat and give back the jobs not finished.
+        '''
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+
+        with self.lock:
+            claimed = list(self.claimed)
+            self.claimed = set()
+
+        for pkg_name in claimed:
+            self.database_connector.finish_job(pkg_name, self.worker_id, DatabaseConnector.JOB_PENDING)
+
+    def _heartbeat(self) -> None:
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            with self.lock:
+                claimed = list(self.claimed)
+
+            if len(claimed) == 0:
+                continue
+
+            try:
+                renewed = self.database_connector.heartbeat_jobs(claimed, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                self.logger.error("[%s] Error renewing the leases: %s" % (CrawlJobQueue.NAME, str(e)))
+                continue
+
+            if renewed < len(claimed):
+                self.logger.warning("[%s] %d jobs of %s were claimed by other worker" %
+                                    (CrawlJobQueue.NAME, len(claimed) - renewed, self.worker_id))
+
+    def claim(self, count: int) -> list:
+        '''
+        Claim up to count jobs.
+
+        :return: list of jobs, empty if there are no jobs left.
+        '''
+        jobs = list()
+
+        while len(jobs) < count:
+            job = self.database_connector.claim_job(self.worker_id, self.lease_seconds)
+            if job is None:
+                break
+            jobs.append(job)
+
+        with self.lock:
+            self.claimed.update(job["package"] for job in jobs)
+
+        self.logger.info("[%s] Worker %s claimed %d jobs" % (CrawlJobQueue.NAME, self.worker_id, len(jobs)))
+        return jobs
+
+    def complete(self, pkg_name: str, success: bool, reason: str = None) -> bool:
+        '''
+        Set the result of a claimed job.
+
+        :return: False if the job was not owned anymore by this worker.
+        '''
+        with self.lock:
+            self.claimed.discard(pkg_name)
+
+        status = DatabaseConnector.JOB_DONE if success else DatabaseConnector.JOB_FAILED
+        ret = self.database_connector.finish_job(pkg_name, self.worker_id, status, reason)
+
+        if not ret:
+            self.logger.warning("[%s] Job of %s was not owned by %s" % (CrawlJobQueue.NAME, pkg_name, self.worker_id))
+
+        return ret
+
+    def release(self, pkg_name: str) -> bool:
+        '''
+        Give back a claimed job that was not crawled, so any
+        worker can claim it again.
+        '''
+        with self.lock:
+            self.claimed.discard(pkg_name)
+
+        return self.database_connector.finish_job(pkg_name, self.worker_id, DatabaseConnector.JOB_PENDING)
+
+    def get_counts(self) -> dict:
+        return self.database_connector.get_job_counts()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Histogram of latencies for the different steps of the
+crawler, used to tune the timeouts from real data
+instead of guessing them.
+'''
+
+import bisect
+import threading
+
+
+class LatencyHistogram(object):
+
+    # upper bounds of the buckets (seconds), the last
+    # bucket takes everything bigger.
+    BUCKETS = [0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.counts = [0] * (len(LatencyHistogram.BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, timeout: bool = False) -> None:
+        '''
+        Record the latency of one execution of the step.
+
+        :param seconds: time spent on the step.
+        :param timeout: True if the step did not finish before its deadline.
+        '''
+        with self.lock:
+            self.counts[bisect.bisect_left(LatencyHistogram.BUCKETS, seconds)] += 1
+            self.total += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+            if timeout:
+                self.timeouts += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            buckets = dict()
+            for i, bound in enumerate(LatencyHistogram.BUCKETS):
+                buckets["<=%s" % (str(bound))] = self.counts[i]
+            buckets[">%s" % (str(LatencyHistogram.BUCKETS[-1]))] = self.counts[-1]
+
+            return {
+                'step': self.name,
+                'count': self.total,
+                'mean': (self.sum / self.total) if self.total > 0 else 0.0,
+                'max': self.max,
+                'timeouts': self.timeouts,
+                'buckets': buckets
+            }
+
+    def __str__(self) -> str:
+        data = self.to_dict()
+        buckets = ", ".join(["%s: %d" % (k, v) for k, v in data['buckets'].items() if v > 0])
+        return "Step: %s, count: %d, mean: %.2f, max: %.2f, timeouts: %d, buckets: {%s}" % (
+            data['step'],
+            data['count'],
+            data['mean'],
+            data['max'],
+            data['timeouts'],
+            buckets
+        )
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Local cache in a SQLite database for the metadata
+retrieved from Google Play, so re-running the crawler
+does not scrape again the packages already retrieved.
+'''
+
+import json
+import time
+import sqlite3
+import threading
+
+
+class MetadataCache(object):
+
+    NAME = "MetadataCache"
+    VERSION = "0.1"
+
+    def __init__(self, path: str, ttl: float, max_entries: int) -> None:
+        '''
+        :param path: path of the SQLite database.
+        :param ttl: seconds an entry is valid, 0 for no expiration.
+        :param max_entries: maximum number of entries, the least recently used are removed.
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS metadata (
+                package_name TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                country TEXT NOT NULL,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (package_name, lang, country)
+            )''')
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS metadata_last_access ON metadata (last_access)")
+        self.connection.commit()
+
+    def get(self, package_name: str, lang: str, country: str) -> dict:
+        '''
+        Get the metadata of a package if it is in the
+        cache and it has not expired.
+
+        :return: metadata or None.
+        '''
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data, fetched_at FROM metadata WHERE package_name = ? AND lang = ? AND country = ?",
+                (package_name, lang, country)).fetchone()
+
+            if row is None:
+                return None
+
+            data, fetched_at = row
+
+            if self.ttl > 0 and now - fetched_at > self.ttl:
+                self.connection.execute(
+                    "DELETE FROM metadata WHERE package_name = ? AND lang = ? AND country = ?",
+                    (package_name, lang, country))
+                self.connection.commit()
+                return None
+
+            self.connection.execute(
+                "UPDATE metadata SET last_access = ? WHERE package_name = ? AND lang = ? AND country = ?",
+                (now, package_name, lang, country))
+            self.connection.commit()
+
+        return json.loads(data)
+
+    def put(self, package_name: str, lang: str, country: str, metadata: dict) -> None:
+        '''
+        Store the metadata of a package, removing the least
+        recently used entries if the cache is full.
+        '''
+        now = time.time()
+        data = json.dumps(metadata, default=str)
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                (package_name, lang, country, data, now, now))
+
+            if self.max_entries > 0:
+                self.connection.execute('''
+                    DELETE FROM metadata WHERE rowid IN (
+                        SELECT rowid FROM metadata ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )''', (self.max_entries,))
+
+            self.connection.commit()
+
+    def invalidate(self, package_name: str, lang: str, country: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM metadata WHERE package_name = ? AND lang = ? AND country = ?",
+                (package_name, lang, country))
+            self.connection.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Classification of the failures of the crawl and retry
+of the packages, the transient failures (focus lost,
+timeouts, errors pulling...) are retried after a delay
+that grows with each attempt, if possible in a different
+device. The permanent failures (device not compatible,
+not available in the country...) and the packages that
+failed too many times go to a dead-letter file, so no
+emulator time is spent again on them.
+'''
+
+import json
+import time
+import random
+import threading
+
+
+class CrawlFailure(object):
+    '''
+    Reasons why the crawl of a package can fail.
+    '''
+
+    # permanent
+    NOT_FOUND = "not_found"
+    INCOMPATIBLE_DEVICE = "incompatible_device"
+    NOT_AVAILABLE_IN_COUNTRY = "not_available_in_country"
+    # transient
+    STORE_NOT_LOADED = "store_not_loaded"
+    FOCUS_LOST = "focus_lost"
+    INSTALL_ERROR = "install_error"
+    INSTALL_TIMEOUT = "install_timeout"
+    PULL_ERROR = "pull_error"
+    EXCEPTION = "exception"
+
+    PERMANENT = [NOT_FOUND, INCOMPATIBLE_DEVICE, NOT_AVAILABLE_IN_COUNTRY]
+    # caused by the device and not by the application
+    DEVICE = [STORE_NOT_LOADED, FOCUS_LOST, INSTALL_TIMEOUT, PULL_ERROR, EXCEPTION]
+
+    @staticmethod
+    def is_permanent(reason: str) -> bool:
+        return reason in CrawlFailure.PERMANENT
+
+    @staticmethod
+    def is_device_failure(reason: str) -> bool:
+        return reason in CrawlFailure.DEVICE
+
+
+class RetryScheduler(object):
+
+    NAME = "RetryScheduler"
+    VERSION = "0.1"
+
+    def __init__(self, dead_letter_path: str, max_attempts: int = 3, base_delay: float = 30) -> None:
+        '''
+        :param dead_letter_path: JSONL file where the packages that will not be retried are written.
+        :param max_attempts: attempts of a package before giving up.
+        :param base_delay: delay before the first retry (seconds), doubled on each attempt.
+        '''
+        self.dead_letter_path = dead_letter_path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+
+        self.lock = threading.Lock()
+        # package name -> list of (device id, reason) of each failed attempt
+        self.failures = dict()
+        # package name -> time when it can be retried
+        self.scheduled = dict()
+
+        self.dead_letter = open(self.dead_letter_path, 'a')
+
+    def schedule(self, pkg_name: str, device_id: str, reason: str) -> bool:
+        '''
+        Register a failed attempt of a package, and decide
+        if it will be retried or sent to the dead-letter file.
+
+        :return: True if the package will be retried.
+        '''
+        with self.lock:
+            failures = self.failures.setdefault(pkg_name, list())
+            failures.append((device_id, reason))
+
+            if not CrawlFailure.is_permanent(reason) and len(failures) < self.max_attempts:
+                delay = self.base_delay * (2 ** (len(failures) - 1))
+                self.scheduled[pkg_name] = time.time() + random.uniform(delay / 2, delay)
+                print(f"Failure '{reason}' of {pkg_name} on {device_id}, attempt {len(failures)}, retrying later")
+                return True
+
+            print(f"Failure '{reason}' of {pkg_name} on {device_id}, sending it to the dead-letter file")
+            self.dead_letter.write(json.dumps({
+                'package': pkg_name,
+                'reason': reason,
+                'permanent': CrawlFailure.is_permanent(reason),
+                'attempts': [{'device': device, 'reason': failure} for device, failure in failures],
+                'time': time.time()
+            }) + "\n")
+            self.dead_letter.flush()
+            return False
+
+    def get_attempts(self, pkg_name: str) -> int:
+        with self.lock:
+            return len(self.failures.get(pkg_name, list()))
+
+    def has_failed_on(self, pkg_name: str, device_id: str) -> bool:
+        '''
+        Check if the package already failed on the device,
+        used to retry it in a different device.
+        '''
+        with self.lock:
+            return any(device == device_id for device, _ in self.failures.get(pkg_name, list()))
+
+    def has_scheduled(self) -> bool:
+        with self.lock:
+            return len(self.scheduled) > 0
+
+    def pop_due(self) -> list:
+        '''
+        Wait until the first scheduled package can be retried,
+        and return all the packages that can be retried then.
+
+        :return: list of package names.
+        '''
+        with self.lock:
+            if len(self.scheduled) == 0:
+                return list()
+            first_due = min(self.scheduled.values())
+
+        wait = first_due - time.time()
+        if wait > 0:
+            print(f"Waiting {wait:.1f} seconds to retry the failed packages")
+            time.sleep(wait)
+
+        now = time.time()
+        with self.lock:
+            due = [pkg_name for pkg_name, due_time in self.scheduled.items() if due_time <= now]
+            for pkg_name in due:
+                del self.scheduled[pkg_name]
+
+        return due
+
+    def close(self) -> None:
+        with self.lock:
+            self.dead_letter.close()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Snapshot of the screen of a device obtained from an
+uiautomator dump, the XML is parsed only once and the
+screen is classified in the same pass, the coordinates
+for the taps are taken from the 'bounds' attribute of
+the nodes instead of hardcoding them.
+'''
+
+import io
+import re
+
+from lxml import etree
+
+
+class ScreenSnapshot(object):
+
+    # states of the screen
+    UNKNOWN = "unknown"
+    STORE_PAGE = "store_page"
+    INSTALLING = "installing"
+    INSTALLED = "installed"
+    INCOMPATIBLE_DEVICE = "incompatible_device"
+    NOT_AVAILABLE_IN_COUNTRY = "not_available_in_country"
+    TRY_AGAIN = "try_again"
+    UNRESTRICTED_INTERNET = "unrestricted_internet"
+
+    # (attribute, value) of a node -> state of the screen
+    MARKERS = {
+        ('content-desc', "Your device isn't compatible with this version."): INCOMPATIBLE_DEVICE,
+        ('content-desc', "This item isn't available in your country."): NOT_AVAILABLE_IN_COUNTRY,
+        ('text', "Try again, and if it still doesn't work, see common ways to fix the problem"): TRY_AGAIN,
+        ('text', "Unrestricted Internet"): UNRESTRICTED_INTERNET,
+        ('text', "Install"): STORE_PAGE,
+        ('text', "Cancel"): INSTALLING,
+        ('text', "Uninstall"): INSTALLED,
+        ('text', "Open"): INSTALLED,
+        ('text', "Update"): INSTALLED,
+    }
+
+    # when several states are present, the first one of
+    # this list is the state of the screen (dialogs are
+    # shown over the page of the application).
+    PRIORITY = [
+        TRY_AGAIN,
+        UNRESTRICTED_INTERNET,
+        INCOMPATIBLE_DEVICE,
+        NOT_AVAILABLE_IN_COUNTRY,
+        INSTALLING,
+        INSTALLED,
+        STORE_PAGE
+    ]
+
+    # texts of the nodes that can be used as tap targets
+    BUTTONS = {
+        "Install": "install",
+        "Got it": "dialog",
+        "OK": "dialog",
+    }
+
+    BOUNDS_REGEX = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+    def __init__(self, xml: str) -> None:
+        '''
+        :param xml: output from 'uiautomator dump', it can contain text before and after the XML.
+        '''
+        self.states = set()
+        # name of the button -> bounds (x1, y1, x2, y2)
+        self.buttons = dict()
+        self.number_of_nodes = 0
+
+        self._parse(xml)
+
+        self.state = ScreenSnapshot.UNKNOWN
+        for state in ScreenSnapshot.PRIORITY:
+            if state in self.states:
+                self.state = state
+                break
+
+    @staticmethod
+    def parse_bounds(bounds: str) -> tuple:
+        '''
+        Parse the bounds attribute of a node, with the
+        format "[x1,y1][x2,y2]".
+
+        :return: tuple (x1, y1, x2, y2) or None if bounds is not valid.
+        '''
+        if bounds is None:
+            return None
+
+        match = ScreenSnapshot.BOUNDS_REGEX.match(bounds)
+        if match is None:
+            return None
+
+        return tuple(int(value) for value in match.groups())
+
+    def _parse(self, xml: str) -> None:
+        '''
+        Walk all the nodes of the dump once, looking for
+        the markers of the states and for the buttons.
+        '''
+        start = xml.find('<')
+        end = xml.rfind('>')
+        if start == -1 or end == -1:
+            return
+
+        data = xml[start:end+1].encode('utf-8')
+
+        try:
+            for _, node in etree.iterparse(io.BytesIO(data), events=('end',), tag='node', recover=True):
+                self.number_of_nodes += 1
+
+                text = node.get('text')
+                content_desc = node.get('content-desc')
+
+                state = ScreenSnapshot.MARKERS.get(('text', text))
+                if state is not None:
+                    self.states.add(state)
+
+                state = ScreenSnapshot.MARKERS.get(('content-desc', content_desc))
+                if state is not None:
+                    self.states.add(state)
+
+                button = ScreenSnapshot.BUTTONS.get(text)
+                if button is not None and button not in self.buttons:
+                    bounds = ScreenSnapshot.parse_bounds(node.get('bounds'))
+                    if bounds is not None:
+                        self.buttons[button] = bounds
+
+                # children have been already visited
+                node.clear()
+        except etree.XMLSyntaxError as e:
+            print(f"[-] Error parsing screen dump: {str(e)}")
+
+    def has_state(self, state: str) -> bool:
+        return state in self.states
+
+    def tap_target(self, button: str, default: tuple = None) -> tuple:
+        '''
+        Get the coordinates of the center of a button.
+
+        :param button: name of the button ('install', 'dialog').
+        :param default: coordinates to return if the button is not on the screen.
+        :return: tuple (x, y).
+        '''
+        bounds = self.buttons.get(button)
+        if bounds is None:
+            return default
+
+        x1, y1, x2, y2 = bounds
+        return ((x1 + x2) // 2, (y1 + y2) // 2)
+
+    def __str__(self) -> str:
+        return "Screen state: %s, states: [%s], buttons: [%s], nodes: %d" % (
+            self.state,
+            ", ".join(sorted(self.states)),
+            ", ".join(sorted(self.buttons.keys())),
+            self.number_of_nodes
+        )
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Timers for the stages of the crawl (metadata, store,
+install, pull, uninstall, dialogs), the time of each
+stage is kept for each package, so it can be saved
+with the analysis of the package, and for each stage
+a summary with the percentiles is exported as JSON
+and as a Prometheus textfile.
+'''
+
+import os
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+
+class StageTimer(object):
+
+    NAME = "StageTimer"
+    VERSION = "0.1"
+
+    # stages of the crawl
+    METADATA = "metadata"
+    OPEN_STORE = "open_store"
+    INSTALL = "install"
+    PULL = "pull"
+    UNINSTALL = "uninstall"
+    DIALOG = "dialog"
+
+    PERCENTILES = [50, 95, 99]
+    # samples kept for each stage to calculate the percentiles,
+    # once reached, a random sample of all the values is kept.
+    MAX_SAMPLES = 100000
+
+    PROMETHEUS_METRIC = "kunai_crawler_stage_seconds"
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # package name -> {'device': device id, 'stages': {stage: seconds}}
+        self.package_timings = dict()
+        # stage -> samples in seconds
+        self.samples = dict()
+        # stage -> [count, sum of seconds]
+        self.totals = dict()
+
+    def record(self, pkg_name: str, device_id: str, stage: str, seconds: float) -> None:
+        '''
+        Add the time of a stage to the package, a stage
+        that runs more than once for the same package
+        (dialogs) is accumulated.
+        '''
+        with self.lock:
+            timings = self.package_timings.setdefault(pkg_name, {'device': None, 'stages': dict()})
+            if device_id is not None:
+                timings['device'] = device_id
+            timings['stages'][stage] = timings['stages'].get(stage, 0) + seconds
+
+            total = self.totals.setdefault(stage, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+
+            samples = self.samples.setdefault(stage, list())
+            if len(samples) < StageTimer.MAX_SAMPLES:
+                samples.append(seconds)
+            else:
+                # reservoir sampling
+                index = random.randrange(total[0])
+                if index < StageTimer.MAX_SAMPLES:
+                    samples[index] = seconds
+
+    @contextmanager
+    def stage(self, pkg_name: str, device_id: str, stage: str):
+        '''
+        Time the code inside the with block, the time is
+        recorded even if there is an exception.
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(pkg_name, device_id, stage, time.time() - start)
+
+    def pop_package_timings(self, pkg_name: str) -> dict:
+        '''
+        Get the timings of a package and forget them, this is
+        called once the package is saved in the database.
+
+        :return: {'device': <last device>, 'stages': {stage: seconds}} or None.
+        '''
+        with self.lock:
+            return self.package_timings.pop(pkg_name, None)
+
+    def _percentile(self, sorted_samples: list, percentile: int) -> float:
+        if len(sorted_samples) == 0:
+            return None
+        index = int(round(percentile / 100 * (len(sorted_samples) - 1)))
+        return sorted_samples[index]
+
+    def get_summary(self) -> dict:
+        '''
+        :return: dictionary stage -> count, total and p50/p95/p99 in seconds.
+        '''
+        summary = dict()
+
+        with self.lock:
+            stages = [(stage, sorted(self.samples[stage]), list(self.totals[stage])) for stage in self.samples.keys()]
+
+        for stage, sorted_samples, (count, total) in stages:
+            summary[stage] = {
+                'count': count,
+                'total': total,
+                'mean': total / count if count > 0 else None
+            }
+            for percentile in StageTimer.PERCENTILES:
+                summary[stage]['p%d' % (percentile)] = self._percentile(sorted_samples, percentile)
+
+        return summary
+
+    def _write_atomic(self, path: str, data: str) -> None:
+        '''
+        Write to a temporary file and rename it, so readers
+        (node exporter) never see a partial file.
+        '''
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, 'w') as f_:
+            f_.write(data)
+        os.replace(tmp_path, path)
+
+    def write_summary(self, path: str) -> None:
+        self._write_atomic(path, json.dumps(self.get_summary(), indent=4))
+
+    def write_prometheus(self, path: str) -> None:
+        '''
+        Write the summary in the text format of Prometheus,
+        to be collected by the textfile collector of the
+        node exporter.
+        '''
+        metric = StageTimer.PROMETHEUS_METRIC
+        lines = ["# HELP %s Time spent in each stage of the crawl of a package." % (metric),
+                 "# TYPE %s summary" % (metric)]
+
+        for stage, values in sorted(self.get_summary().items()):
+            for percentile in StageTimer.PERCENTILES:
+                lines.append('%s{stage="%s",quantile="%s"} %f' %
+                             (metric, stage, str(percentile / 100), values['p%d' % (percentile)]))
+            lines.append('%s_sum{stage="%s"} %f' % (metric, stage, values['total']))
+            lines.append('%s_count{stage="%s"} %d' % (metric, stage, values['count']))
+
+        self._write_atomic(path, "\n".join(lines) + "\n")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Token bucket used to limit the rate of requests that
+several threads do to the same service.
+'''
+
+import time
+import threading
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        '''
+        :param rate: tokens added to the bucket per second.
+        :param capacity: maximum number of tokens (size of a burst).
+        '''
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self) -> None:
+        '''
+        Take one token from the bucket, block until
+        there is one available.
+        '''
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)